@@ -0,0 +1,113 @@
+"""
+Recall@k and latency of the partitioned IVF index against exact search.
+
+Synthetic unit vectors are grouped by question and band, with topic
+clusters inside each group so the coarse quantiser has structure to find.
+Queries are routed to their question's partition; recall is measured against
+an exact scan of that same partition. The flat row is the exact scan over the
+whole bank that the "numpy" backend does today.
+
+    python benchmarks/bench_ann.py --sizes 10000 100000 1000000 --dim 128
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from peel_ann import PartitionedExemplarIndex, question_key
+
+BANDS = ["13–15", "9–12", "0–8"]
+
+
+def synthetic_bank(n: int, dim: int, questions: int, topics: int, noise: float, rng):
+    question_of = rng.integers(0, questions, n)
+    band_of = rng.integers(0, len(BANDS), n)
+    topic_of = rng.integers(0, topics, n)
+    q_centres = rng.standard_normal((questions, dim)).astype(np.float32)
+    b_centres = rng.standard_normal((len(BANDS), dim)).astype(np.float32) * 0.5
+    t_centres = rng.standard_normal((questions, topics, dim)).astype(np.float32)
+    vectors = np.empty((n, dim), dtype=np.float32)
+    for i in range(0, n, 100_000):
+        j = slice(i, min(n, i + 100_000))
+        vectors[j] = (
+            q_centres[question_of[j]] + b_centres[band_of[j]] + t_centres[question_of[j], topic_of[j]]
+            + rng.standard_normal((j.stop - j.start, dim)).astype(np.float32) * noise
+        )
+    metadatas = [{"question": f"question {q}", "band": BANDS[b]} for q, b in zip(question_of, band_of)]
+    return vectors, metadatas, q_centres, t_centres
+
+def queries_for(n: int, dim: int, q_centres, t_centres, noise: float, rng):
+    questions = rng.integers(0, len(q_centres), n)
+    topics = rng.integers(0, t_centres.shape[1], n)
+    vectors = q_centres[questions] + t_centres[questions, topics] + rng.standard_normal((n, dim)).astype(np.float32) * noise
+    return vectors, [f"question {q}" for q in questions]
+
+def timed(fn, queries):
+    results, latencies = [], []
+    for args in queries:
+        t = time.perf_counter()
+        results.append(fn(*args))
+        latencies.append(time.perf_counter() - t)
+    return results, latencies
+
+def recall(approx, exact) -> float:
+    hits = sum(len(set(a[0].tolist()) & set(e[0].tolist())) for a, e in zip(approx, exact))
+    return hits / sum(len(e[0]) for e in exact)
+
+def report(label: str, latencies, rec=None):
+    q = statistics.quantiles(latencies, n=20)
+    rec = f"{rec:8.3f}" if rec is not None else f"{'-':>8}"
+    print(f"  {label:<24} p50={statistics.median(latencies) * 1000:8.3f}ms p95={q[-1] * 1000:8.3f}ms recall@k={rec}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--dim", type=int, default=128)
+    parser.add_argument("--questions", type=int, default=10)
+    parser.add_argument("--topics", type=int, default=256, help="topic clusters per question")
+    parser.add_argument("--noise", type=float, default=1.0, help="per-vector noise relative to topic spread")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--min-ivf-size", type=int, default=2048)
+    args = parser.parse_args()
+
+    for n in args.sizes:
+        rng = np.random.default_rng(0)
+        vectors, metadatas, q_centres, t_centres = synthetic_bank(n, args.dim, args.questions, args.topics, args.noise, rng)
+        started = time.perf_counter()
+        index = PartitionedExemplarIndex.from_vectors(vectors, [""] * n, metadatas, min_ivf_size=args.min_ivf_size)
+        build_s = time.perf_counter() - started
+        del vectors
+        ivf_leaves = sum(leaf.centroids is not None for leaf in index.leaves.values())
+        print(f"{n} vectors, dim={args.dim}, {len(index.leaves)} partitions ({ivf_leaves} with IVF), build {build_s:.1f}s, k={args.k}")
+
+        query_vectors, query_questions = queries_for(args.queries, args.dim, q_centres, t_centres, args.noise, rng)
+        _, flat_latencies = timed(lambda v: index.exact_search(v, args.k), [(v,) for v in query_vectors])
+        report("exact, whole bank", flat_latencies)
+
+        def exact_partition(v, question):
+            rows = [index.exact_search(v, args.k, slice(leaf.start, leaf.end)) for leaf in index._by_question[question_key(question)].values()]
+            r, s = np.concatenate([x[0] for x in rows]), np.concatenate([x[1] for x in rows])
+            top = np.argsort(-s)[:args.k]
+            return r[top], s[top]
+
+        pairs = list(zip(query_vectors, query_questions))
+        exact, exact_latencies = timed(exact_partition, pairs)
+        report("exact, question", exact_latencies, 1.0)
+        for nprobe in args.nprobe:
+            approx, latencies = timed(lambda v, q: index.search_vector(v, args.k, q, nprobe=nprobe), pairs)
+            report(f"ivf nprobe={nprobe}, question", latencies, recall(approx, exact))
+        _, latencies = timed(lambda v, q: index.search_vector(v, args.k, q, stratify=True), pairs)
+        report("ivf, stratified bands", latencies)
+        del index
+
+
+if __name__ == "__main__":
+    main()
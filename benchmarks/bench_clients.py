@@ -0,0 +1,145 @@
+"""
+Connection reuse and client memory: per-client HTTP pools against peel_clients.
+
+Runs the same workload against the local FakeOpenAIServer, whose new
+connections each wait ``--connect-ms`` (standing in for TCP + TLS setup):
+
+  1. sync   ``--rounds`` evaluations, each embedding the answer then calling
+            the chat model at one of ``--temperatures`` temperatures (what
+            the app's slider produces)
+  2. async  ``--loops`` separate asyncio.run() batches of ``--concurrency``
+            calls each, like repeated batch runs or worker threads
+
+"per-client" builds ChatOpenAI / OpenAIEmbeddings with their default HTTP
+clients and keeps every client, as ``st.cache_resource`` did. "shared" puts
+them all on one peel_clients.HTTPPool, with clients in the LRU ClientCache.
+For each it prints elapsed time, connections the server accepted, and
+async calls that failed. A last section builds ``--combos`` model/temperature
+clients and reports how many stay cached and the memory they hold.
+
+    python benchmarks/bench_clients.py --rounds 60 --connect-ms 50
+"""
+import argparse
+import asyncio
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def workload(label: str, args, chat_for, embeddings):
+    from peel_fakes import FakeOpenAIServer
+
+    with FakeOpenAIServer(latency=args.latency, connect_latency=args.connect_ms / 1000) as server:
+        llm_for, embed = chat_for(server.base_url), embeddings(server.base_url)
+        started = time.perf_counter()
+        for i in range(args.rounds):
+            embed.embed_query(f"answer {i}")
+            llm_for(i % args.temperatures / 10).invoke(f"Grade essay {i}")
+        sync_s = time.perf_counter() - started
+        sync_connections = server.stats()["connections"]
+
+        async def batch(loop_no: int):
+            llm = llm_for(0.0)
+            results = await asyncio.gather(
+                *(llm.ainvoke(f"Batch {loop_no} essay {i}") for i in range(args.concurrency)), return_exceptions=True
+            )
+            return [r for r in results if isinstance(r, Exception)]
+
+        failed, first_error = 0, None
+        started = time.perf_counter()
+        for loop_no in range(args.loops):
+            errors = asyncio.run(batch(loop_no))
+            failed += len(errors)
+            first_error = first_error or (errors and f"{type(errors[0]).__name__}: {errors[0]}")
+        async_s = time.perf_counter() - started
+        connections = server.stats()["connections"]
+
+    print(
+        f"  {label:<11} sync {sync_s:5.2f}s {sync_connections:>3} connections   "
+        f"async {async_s:5.2f}s {connections - sync_connections:>3} connections {failed:>3} failed"
+    )
+    if first_error:
+        print(f"              first async error: {first_error[:100]}")
+
+def memory(label: str, combos: int, build):
+    gc.collect()
+    tracemalloc.start()
+    kept, holder = build(combos)
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del holder
+    print(f"  {label:<11} {combos} model/temperature combinations -> {kept} clients kept, {current / 1e6:5.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=60)
+    parser.add_argument("--temperatures", type=int, default=6, help="distinct temperatures the sync rounds cycle through")
+    parser.add_argument("--loops", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--connect-ms", type=float, default=50.0, help="server delay per new connection")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per completion")
+    parser.add_argument("--combos", type=int, default=200)
+    args = parser.parse_args()
+
+    from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+    from peel_clients import ClientCache, HTTPPool
+
+    common = dict(api_key="fake", max_retries=0)
+
+    def per_client_chat(base_url):
+        built = {}
+
+        def get(temperature):
+            if temperature not in built:
+                built[temperature] = ChatOpenAI(model="gpt-4.1-mini", temperature=temperature, base_url=base_url, **common)
+            return built[temperature]
+        return get
+
+    def per_client_embeddings(base_url):
+        return OpenAIEmbeddings(model="text-embedding-3-large", base_url=base_url, check_embedding_ctx_length=False, **common)
+
+    pool = None
+
+    def shared_kwargs():
+        return {"http_client": pool.sync, "http_async_client": pool.async_client}
+
+    def shared_chat(base_url):
+        cache = ClientCache(16)
+        return lambda t: cache.get(t, lambda: ChatOpenAI(model="gpt-4.1-mini", temperature=t, base_url=base_url, **common, **shared_kwargs()))
+
+    def shared_embeddings(base_url):
+        return OpenAIEmbeddings(model="text-embedding-3-large", base_url=base_url, check_embedding_ctx_length=False, **common, **shared_kwargs())
+
+    print(f"{args.rounds} sync evaluations, {args.loops} async batches of {args.concurrency}, {args.connect_ms:g} ms per new connection")
+    workload("per-client", args, per_client_chat, per_client_embeddings)
+    pool = HTTPPool()
+    workload("shared", args, shared_chat, shared_embeddings)
+    print("  pool: " + " ".join(f"{k}={v}" for k, v in pool.stats().items()))
+
+    print("client memory")
+
+    def unbounded(n):
+        kept = {}
+        for i in range(n):
+            kept[i] = ChatOpenAI(model=f"model-{i % 5}", temperature=i / n, base_url="http://127.0.0.1:9/v1", **common)
+        return len(kept), kept
+
+    def bounded(n):
+        cache = ClientCache(16)
+        for i in range(n):
+            cache.get(i, lambda: ChatOpenAI(model=f"model-{i % 5}", temperature=i / n, base_url="http://127.0.0.1:9/v1", **common, **shared_kwargs()))
+        return cache.stats()["cached"], cache
+
+    memory("per-client", args.combos, unbounded)
+    memory("shared", args.combos, bounded)
+
+
+if __name__ == "__main__":
+    main()
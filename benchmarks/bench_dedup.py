@@ -0,0 +1,114 @@
+"""
+Near-duplicate detection over a batch: MinHash/LSH against all-pairs Jaccard.
+
+Synthetic essays draw words from a Zipf-distributed vocabulary, so unrelated
+essays share the common words and phrases real ones do. A share of them
+(``--copies``) are planted copies of another essay with a fraction of words
+replaced (``--edits``, spread over several edit rates). Every essay answers one
+of ``--questions`` questions, and copies keep their source's question.
+
+For each size it prints the time to sign, band and cluster the batch, how many
+essays would reuse an evaluation, and recall / precision against the planted
+copies, split by edit rate. The all-pairs row computes exact Jaccard similarity
+of the shingle sets for every pair of essays on the same question; it is only
+run up to ``--exact-max`` essays and extrapolated (as n^2) above that.
+
+    python benchmarks/bench_dedup.py --sizes 1000 10000 100000
+"""
+import argparse
+import os
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from peel_dedup import MinHasher, find_duplicates
+
+
+def synthetic_batch(n: int, words: int, vocab: int, questions: int, copies: float, edits: list, rng):
+    """Essays, their questions, and {copy index: (source index, edit rate)}."""
+    weights = 1.0 / np.arange(1, vocab + 1)
+    weights /= weights.sum()
+    n_copies = int(n * copies)
+    originals = n - n_copies
+    tokens = rng.choice(vocab, size=(originals, words), p=weights)
+    question_of = list(rng.integers(0, questions, originals))
+    texts = [" ".join(f"w{t}" for t in row) for row in tokens]
+    planted = {}
+    for c in range(n_copies):
+        source = int(rng.integers(0, originals))
+        rate = edits[c % len(edits)]
+        row = tokens[source].copy()
+        changed = rng.random(words) < rate
+        row[changed] = rng.choice(vocab, size=int(changed.sum()), p=weights)
+        planted[len(texts)] = (source, rate)
+        texts.append(" ".join(f"w{t}" for t in row))
+        question_of.append(question_of[source])
+    return texts, [f"question {q}" for q in question_of], planted
+
+def score(duplicates: dict, planted: dict, edits: list) -> str:
+    found = defaultdict(int)
+    total = defaultdict(int)
+    for copy, (source, rate) in planted.items():
+        total[rate] += 1
+        if duplicates.get(copy, (None,))[0] == source:
+            found[rate] += 1
+    true = sum(found.values())
+    precision = true / len(duplicates) if duplicates else 1.0
+    per_rate = " ".join(f"{rate:.0%}:{found[rate] / total[rate]:.2f}" for rate in edits if total[rate])
+    return f"recall by edit rate {per_rate}  precision={precision:.3f}"
+
+def all_pairs(texts, questions, threshold: float, shingle: int) -> int:
+    hasher = MinHasher(shingle=shingle)
+    sets = [set(hasher.shingles(t).tolist()) for t in texts]
+    by_question = defaultdict(list)
+    for i, q in enumerate(questions):
+        by_question[q].append(i)
+    pairs = 0
+    for members in by_question.values():
+        for x, i in enumerate(members):
+            for j in members[x + 1:]:
+                a, b = sets[i], sets[j]
+                if len(a & b) / len(a | b) >= threshold:
+                    pairs += 1
+    return pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10_000, 100_000])
+    parser.add_argument("--words", type=int, default=350, help="words per essay")
+    parser.add_argument("--vocab", type=int, default=8000)
+    parser.add_argument("--questions", type=int, default=5)
+    parser.add_argument("--copies", type=float, default=0.05, help="share of the batch that are planted copies")
+    parser.add_argument("--edits", type=float, nargs="+", default=[0.0, 0.01, 0.03, 0.06], help="share of words changed in a copy")
+    parser.add_argument("--threshold", type=float, default=0.7)
+    parser.add_argument("--exact-max", type=int, default=2000, help="largest batch to run all-pairs on")
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+
+    exact_rate = None
+    for n in args.sizes:
+        texts, questions, planted = synthetic_batch(n, args.words, args.vocab, args.questions, args.copies, args.edits, rng)
+        started = time.perf_counter()
+        duplicates = find_duplicates(texts, questions, args.threshold)
+        elapsed = time.perf_counter() - started
+        print(
+            f"n={n:>7}  minhash/lsh {elapsed:7.2f}s ({n / elapsed:,.0f} essays/s)  "
+            f"reused={len(duplicates):>6}  {score(duplicates, planted, args.edits)}"
+        )
+        if n <= args.exact_max:
+            started = time.perf_counter()
+            pairs = all_pairs(texts, questions, args.threshold, MinHasher().shingle)
+            exact = time.perf_counter() - started
+            exact_rate = exact / n**2
+            print(f"{'':>9}  all pairs   {exact:7.2f}s  pairs>={args.threshold}: {pairs}")
+        elif exact_rate is not None:
+            print(f"{'':>9}  all pairs   ~{exact_rate * n**2:,.0f}s (extrapolated)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Tail latency with and without the hedging / fallback execution policy.
+
+The primary fake model has a heavy-tailed time to first token (most requests
+start quickly, a few stall); the fallback is a smaller model that starts fast
+but streams the same feedback. Use it to pick --first-token-timeout.
+
+    python benchmarks/bench_hedging.py --requests 300 --threshold 1.0
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from peel_fakes import FakeGradingChatModel
+from peel_policy import ExecutionPolicy
+
+
+def heavy_tail(fast: float, slow: float, slow_fraction: float, rng: random.Random):
+    def sample() -> float:
+        if rng.random() < slow_fraction:
+            return slow * rng.uniform(0.5, 1.5)
+        return fast * rng.uniform(0.5, 1.5)
+    return sample
+
+async def run(label: str, llm, policy, n: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i: int):
+        async with semaphore:
+            started = time.perf_counter()
+            prompt = f"essay {i}"
+            if policy is None:
+                await llm.ainvoke(prompt)
+            else:
+                await policy.ainvoke(llm, prompt)
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one(i) for i in range(n)))
+    q = statistics.quantiles(latencies, n=100)
+    wins = policy.stats.summary()["wins"] if policy else {}
+    print(f"{label:<22} p50={statistics.median(latencies):6.2f}s p95={q[94]:6.2f}s p99={q[98]:6.2f}s  {wins}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--threshold", type=float, default=1.0, help="first-token timeout before the backup request")
+    parser.add_argument("--fast", type=float, default=0.4, help="typical primary first-token latency (s)")
+    parser.add_argument("--slow", type=float, default=6.0, help="stalled primary first-token latency (s)")
+    parser.add_argument("--slow-fraction", type=float, default=0.05)
+    args = parser.parse_args()
+
+    def primary():
+        rng = random.Random(0)
+        return FakeGradingChatModel(
+            model_name="gpt-5",
+            first_token_latency_fn=heavy_tail(args.fast, args.slow, args.slow_fraction, rng),
+            token_latency=0.005,
+        )
+
+    fallback = FakeGradingChatModel(model_name="gpt-4.1-mini", first_token_latency=0.2, token_latency=0.002)
+
+    asyncio.run(run("no policy", _Streamed(primary()), None, args.requests, args.concurrency))
+    asyncio.run(run("hedge (same model)", primary(), ExecutionPolicy(args.threshold, 60.0), args.requests, args.concurrency))
+    asyncio.run(run("fallback gpt-4.1-mini", primary(), ExecutionPolicy(args.threshold, 60.0, fallback), args.requests, args.concurrency))
+
+
+class _Streamed:
+    """Consume the model's stream end to end, like the policy does, but with no backup."""
+
+    def __init__(self, llm):
+        self.llm = llm
+
+    async def ainvoke(self, prompt):
+        async for _ in self.llm.astream(prompt):
+            pass
+
+
+if __name__ == "__main__":
+    main()
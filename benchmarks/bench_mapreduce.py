@@ -0,0 +1,126 @@
+"""
+Single-call grading against peel_mapreduce: wall-clock time and token usage.
+
+Each essay has an introduction, ``--body`` body paragraphs of ``--words``
+words and a conclusion. It is graded with FakeGradingChatModel, once per mode:
+
+    single  the usual single call (rubric + k exemplars + whole essay)
+    model   paragraphs marked in parallel, then one reduce call with the rubric
+    local   paragraphs marked in parallel, scored and summarised locally
+
+The fake model is timed like a hosted one. A non-streamed call takes
+``--request-ms``, plus ``--prefill-ms`` per prompt word and ``--decode-ms``
+per reply word. Full feedback is padded to ``--feedback-words`` words, about
+as long as real feedback runs. Word counts stand in for tokens. The exemplar
+bank has ``--exemplars`` essays of the same shape, so the prompt is a
+realistic size.
+``--essays`` essays are graded one after another, and the script prints the
+mean time per essay, the model calls and the input / output words.
+
+    python benchmarks/bench_mapreduce.py --body 3 5 8 --words 120
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import peel_core
+from peel_fakes import FAKE_FEEDBACK, FakeGradingChatModel, fake_embeddings
+from peel_mapreduce import aevaluate_mapreduce
+from peel_trace import Trace
+
+WORDS = (
+    "the writer uses imagery to build tension as the storm approaches and the boy feels afraid "
+    "this suggests danger because the sentences become shorter and the reader senses panic"
+).split()
+
+
+class LongFeedbackModel(FakeGradingChatModel):
+    feedback_words: int = 0
+
+    def _feedback(self, messages) -> str:
+        feedback = super()._feedback(messages)
+        if feedback.startswith("**Score"):
+            extra = self.feedback_words - len(FAKE_FEEDBACK.split())
+            feedback += "\n\n" + " ".join(["analysis"] * max(0, extra))
+        return feedback
+
+
+def essay(rng, body: int, words: int) -> str:
+    def paragraph(n: int) -> str:
+        return " ".join(rng.choice(WORDS) for _ in range(n)) + '. "The wind howled like a wounded animal."'
+    return "\n\n".join([paragraph(words // 2)] + [paragraph(words) for _ in range(body)] + [paragraph(words // 2)])
+
+def exemplar_bank(rng, n: int, body: int, words: int) -> list[dict]:
+    bank = []
+    for i in range(n):
+        score = rng.randint(4, 15)
+        text = (
+            f"Question: How does the writer create tension?\nStudent answer:\n{essay(rng, body, words)}\n\n"
+            f"Teacher feedback:\n**Score: {score}/15**\n" + " ".join(rng.choice(WORDS) for _ in range(120))
+        )
+        bank.append({"label": f"exemplar_{i}", "band": str(score), "text": text})
+    return bank
+
+async def grade(mode: str, answer: str, llm, vectorstore, k: int) -> dict:
+    trace = Trace("evaluate")
+    started = time.perf_counter()
+    if mode == "single":
+        await peel_core.aevaluate_answer("How does the writer create tension?", answer, llm, vectorstore, k, trace=trace)
+        calls = 1
+    else:
+        result, _ = await aevaluate_mapreduce(
+            "How does the writer create tension?", answer, llm, vectorstore, k, mode, trace=trace, min_words=0,
+        )
+        calls = len(result.paragraphs) + (mode == "model")
+    elapsed = time.perf_counter() - started
+    attrs = trace.finish()["attrs"]
+    return {"s": elapsed, "calls": calls, "input": attrs["input_tokens"], "output": attrs["output_tokens"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--body", type=int, nargs="+", default=[3, 5, 8], help="body paragraphs per essay")
+    parser.add_argument("--words", type=int, default=120, help="words per body paragraph")
+    parser.add_argument("--essays", type=int, default=5)
+    parser.add_argument("--k", type=int, default=3, help="exemplars per prompt")
+    parser.add_argument("--exemplars", type=int, default=30)
+    parser.add_argument("--request-ms", type=float, default=400.0)
+    parser.add_argument("--prefill-ms", type=float, default=0.05, help="per prompt word")
+    parser.add_argument("--decode-ms", type=float, default=20.0, help="per reply word")
+    parser.add_argument("--feedback-words", type=int, default=250, help="length of full feedback")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    llm = LongFeedbackModel(
+        latency=args.request_ms / 1000, input_token_latency=args.prefill_ms / 1000,
+        output_token_latency=args.decode_ms / 1000, feedback_words=args.feedback_words,
+    )
+    print(
+        f"{args.essays} essays per row, {args.words} words per body paragraph, k={args.k}; "
+        f"{args.request_ms:g} ms per call + {args.prefill_ms:g} ms per prompt word + {args.decode_ms:g} ms per reply word"
+    )
+    for body in args.body:
+        vectorstore = peel_core.build_vectorstore(
+            peel_core.build_embeddings(fake_embeddings(), cache=False), "numpy",
+            exemplar_bank(rng, args.exemplars, body, args.words),
+        )
+        answers = [essay(rng, body, args.words) for _ in range(args.essays)]
+        print(f"{body} body paragraphs ({len(answers[0].split()):,} words)")
+        for mode in ("single", "model", "local"):
+            runs = [asyncio.run(grade(mode, a, llm, vectorstore, args.k)) for a in answers]
+            print(
+                f"  {mode:<7} {statistics.mean(r['s'] for r in runs):6.2f} s per essay   "
+                f"{runs[0]['calls']:>2} calls   "
+                f"input {statistics.mean(r['input'] for r in runs):7,.0f}   "
+                f"output {statistics.mean(r['output'] for r in runs):5,.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
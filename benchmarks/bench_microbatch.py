@@ -0,0 +1,92 @@
+"""
+Query embedding throughput with and without peel_microbatch.
+
+``--sessions`` threads, each standing in for one Streamlit session, embed
+``--queries`` distinct answers one after another with embed_query. Requests
+go to the local FakeOpenAIServer, where each embeddings request takes
+``--embed-ms`` whatever its size. The server optionally enforces
+``--rpm`` requests per ``--period`` seconds (a 429 with Retry-After, which
+the SDK retries).
+
+"direct" is OpenAIEmbeddings as the apps used it. The other rows wrap it in
+MicroBatchEmbeddings for each ``--windows`` flush window (ms) and
+``--sizes`` batch size. For each row it prints queries per second, p50 and
+p95 latency per query, requests that reached the server, mean batch size and
+429s.
+
+    python benchmarks/bench_microbatch.py --sessions 32 --queries 20 --embed-ms 40
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def run(label: str, args, build):
+    from langchain_openai import OpenAIEmbeddings
+
+    from peel_clients import HTTPPool
+    from peel_fakes import FakeOpenAIServer
+
+    pool = HTTPPool()
+    with FakeOpenAIServer(rpm=args.rpm, period=args.period, embed_latency=args.embed_ms / 1000) as server:
+        direct = OpenAIEmbeddings(
+            model="text-embedding-3-large", base_url=server.base_url, api_key="fake",
+            check_embedding_ctx_length=False, http_client=pool.sync, max_retries=5,
+        )
+        embeddings = build(direct)
+        embeddings.embed_query("warm up the connection")
+        before = server.stats()
+
+        def session(s: int) -> list[float]:
+            latencies = []
+            for q in range(args.queries):
+                started = time.perf_counter()
+                embeddings.embed_query(f"session {s} answer {q} " + "essay text " * 50)
+                latencies.append(time.perf_counter() - started)
+            return latencies
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.sessions) as executor:
+            latencies = [t for per_session in executor.map(session, range(args.sessions)) for t in per_session]
+        elapsed = time.perf_counter() - started
+        after = server.stats()
+    pool.close()
+
+    total = args.sessions * args.queries
+    requests = after["requests"] - before["requests"]
+    p95 = statistics.quantiles(latencies, n=20)[-1]
+    print(
+        f"  {label:<22} {total / elapsed:8.0f} queries/s   p50 {statistics.median(latencies) * 1000:6.1f} ms   "
+        f"p95 {p95 * 1000:6.1f} ms   {requests:>5} requests ({total / max(requests, 1):5.1f} per request)   "
+        f"{after['rate_limited'] - before['rate_limited']:>4} x 429"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=32)
+    parser.add_argument("--queries", type=int, default=20, help="queries per session")
+    parser.add_argument("--embed-ms", type=float, default=40.0, help="server time per embeddings request")
+    parser.add_argument("--windows", type=float, nargs="+", default=[2.0, 5.0, 10.0], help="flush windows (ms)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[64], help="batch sizes")
+    parser.add_argument("--rpm", type=int, default=None, help="requests the server admits per period")
+    parser.add_argument("--period", type=float, default=60.0)
+    args = parser.parse_args()
+
+    from peel_microbatch import MicroBatchEmbeddings
+
+    limit = f", {args.rpm} requests per {args.period:g}s" if args.rpm else ""
+    print(f"{args.sessions} sessions x {args.queries} queries, {args.embed_ms:g} ms per embeddings request{limit}")
+    run("direct", args, lambda e: e)
+    for size in args.sizes:
+        for window in args.windows:
+            run(f"batched {window:g} ms / {size}", args, lambda e: MicroBatchEmbeddings(e, window / 1000, size))
+
+
+if __name__ == "__main__":
+    main()
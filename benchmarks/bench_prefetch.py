@@ -0,0 +1,93 @@
+"""
+Retrieval prefetch hit rate under Streamlit's input timing.
+
+A Streamlit text area sends its value only when it loses focus. A teacher
+who pastes an answer and clicks Evaluate blurs the text area on mousedown,
+which starts a rerun with the new text. The click itself arrives on mouseup,
+``--click-ms`` later, and cuts that rerun short. The rerun reaches the
+prefetch call ``--reach-ms`` in (about 10 ms for few_shot_peel.py under
+streamlit.testing, with or without a result on the page). Prefetch only
+helps if retrieval starts soon after that. Each simulated session runs on
+its own thread against a shared Prefetcher, with a retrieval that sleeps
+``--retrieval-ms``:
+
+    paste + click   the blur rerun, then the click ``--click-ms`` later
+    paste + pause   the teacher clicks elsewhere and reads for ``--pause`` s first
+
+Two configurations are compared:
+
+    before  0.75 s trailing debounce (start once the text has been quiet that long)
+    after   leading edge: new text starts at once, later text waits out a 0.25 s window
+
+The script prints the share of evaluations that used a prefetched retrieval
+(finished or still running) and the mean time the evaluation then spent on
+retrieval, against ``--retrieval-ms`` without prefetch.
+
+    python benchmarks/bench_prefetch.py --sessions 200 --retrieval-ms 350
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from peel_prefetch import Prefetcher
+
+
+def session(prefetcher: Prefetcher, slot: str, click_at: float, reach: float, retrieval: float) -> float:
+    """One paste-then-Evaluate; returns the seconds the evaluation spent on retrieval."""
+    retrieve = lambda: time.sleep(retrieval) or "examples"
+    started = time.perf_counter()
+    if reach < click_at:
+        # The blur rerun got as far as the prefetch call before the click cut it short.
+        time.sleep(reach)
+        prefetcher.schedule(slot, slot, retrieve)
+    time.sleep(max(0.0, started + click_at - time.perf_counter()))
+    evaluating = time.perf_counter()
+    if prefetcher.get(slot) is None:
+        retrieve()
+    return time.perf_counter() - evaluating
+
+
+def run(label: str, prefetcher: Prefetcher, delays: list, reach: float, retrieval: float, concurrency: int):
+    with ThreadPoolExecutor(concurrency) as pool:
+        waits = list(pool.map(
+            lambda item: session(prefetcher, f"{label}-{item[0]}", item[1], reach, retrieval), enumerate(delays),
+        ))
+    stats = prefetcher.stats()
+    used = stats["hits"] + stats["waited"]
+    print(
+        f"  {label:<7} prefetched {used:>4} of {len(delays)} ({used / len(delays):4.0%})   "
+        f"retrieval at click {statistics.mean(waits) * 1000:5.0f} ms mean"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--retrieval-ms", type=float, default=350.0, help="embedding call + search")
+    parser.add_argument("--click-ms", type=float, nargs=2, default=[60.0, 200.0], help="mousedown to mouseup range")
+    parser.add_argument("--pause", type=float, nargs=2, default=[0.5, 3.0], help="reading time before the click (s)")
+    parser.add_argument("--reach-ms", type=float, default=10.0, help="rerun start to the prefetch call")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    retrieval, reach = args.retrieval_ms / 1000, args.reach_ms / 1000
+    scenarios = {
+        "paste + click": [rng.uniform(*args.click_ms) / 1000 for _ in range(args.sessions)],
+        "paste + pause": [rng.uniform(*args.pause) for _ in range(args.sessions)],
+    }
+    print(f"{args.sessions} sessions per row, {args.retrieval_ms:g} ms retrieval without prefetch")
+    for name, delays in scenarios.items():
+        print(name)
+        run("before", Prefetcher(debounce=0.75, workers=args.concurrency, leading=False), delays, reach, retrieval, args.concurrency)
+        run("after", Prefetcher(workers=args.concurrency), delays, reach, retrieval, args.concurrency)
+
+
+if __name__ == "__main__":
+    main()
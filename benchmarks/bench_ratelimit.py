@@ -0,0 +1,107 @@
+"""
+Batch grading against a rate-limited endpoint, with and without the limiter.
+
+Starts the local OpenAI-compatible FakeOpenAIServer with TPM/RPM limits over
+a short window (``--period`` seconds stands in for a minute), and grades the
+same synthetic essays through the real ChatOpenAI / OpenAIEmbeddings clients:
+
+  sdk retries   the OpenAI SDK's own retries (2, honouring Retry-After)
+  limiter       RateLimiter pacing chat and embedding calls at the limits
+  limiter x2    the limiter told the limits are twice what the server enforces,
+                so it has to learn from 429s and back off
+
+For each run it prints essays graded and failed, 429s the server sent,
+elapsed time and throughput next to the ceiling the limits allow.
+
+    python benchmarks/bench_ratelimit.py --essays 300 --rpm 120 --tpm 200000 --period 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def synthetic_essays(n: int) -> list[dict]:
+    return [
+        {
+            "student_id": f"s{i}",
+            "question": "How does Shakespeare present ambition in Macbeth?",
+            "answer": f"Essay {i}. " + "Shakespeare presents ambition as corrupting and destructive. " * 40,
+        }
+        for i in range(n)
+    ]
+
+def run(label: str, args, limits: dict = None) -> dict:
+    from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+
+    import peel_core
+    from peel_batch import run_batch
+    from peel_fakes import FakeOpenAIServer
+    from peel_ratelimit import RateLimitedChatModel, RateLimitedEmbeddings, RateLimiter
+
+    with FakeOpenAIServer(tpm=args.tpm, rpm=args.rpm, period=args.period, latency=args.latency) as server:
+        client = dict(base_url=server.base_url, api_key="fake", max_retries=0 if limits else 2)
+        llm = ChatOpenAI(model="gpt-4.1-mini", temperature=0, stream_usage=True, **client)
+        embeddings = OpenAIEmbeddings(model="text-embedding-3-small", check_embedding_ctx_length=False, **client)
+        chat_limiter = embed_limiter = None
+        if limits:
+            chat_limiter = RateLimiter(period=args.period, max_concurrency=args.concurrency, **limits)
+            embed_limiter = RateLimiter(period=args.period, max_concurrency=args.concurrency, **limits)
+            llm = RateLimitedChatModel.wrap(llm, chat_limiter)
+            embeddings = RateLimitedEmbeddings(embeddings, embed_limiter)
+        vectorstore = peel_core.build_vectorstore(embeddings, "numpy", peel_core.EXAMPLE_EVALUATIONS)
+
+        output = os.path.join(tempfile.mkdtemp(), "results.jsonl")
+        submissions = synthetic_essays(args.essays)
+        started = time.perf_counter()
+        stats = asyncio.run(run_batch(submissions, output, llm, vectorstore, concurrency=args.concurrency))
+        elapsed = time.perf_counter() - started
+        served = server.stats()
+
+    print(
+        f"  {label:<12} graded={stats['graded']:>4} failed={stats['errors']:>4} 429s={served['rate_limited']:>5} "
+        f"elapsed={elapsed:6.1f}s throughput={stats['graded'] / elapsed:5.2f} essays/s"
+    )
+    with open(output, encoding="utf-8") as f:
+        errors = [json.loads(line)["error"] for line in f if '"error"' in line]
+    if errors:
+        print(f"               first error: {errors[0][:120]}")
+    for name, limiter in (("chat", chat_limiter), ("embed", embed_limiter)):
+        if limiter is not None:
+            print(f"               {name}: " + " ".join(f"{k}={v}" for k, v in limiter.stats().items()))
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--essays", type=int, default=300)
+    parser.add_argument("--rpm", type=int, default=120, help="requests per window, per model")
+    parser.add_argument("--tpm", type=int, default=200_000, help="tokens per window, per model")
+    parser.add_argument("--period", type=float, default=10.0, help="window length in seconds")
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds per completion")
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    os.environ["PEEL_DATA_DIR"] = tempfile.mkdtemp()
+    import peel_core
+    from peel_ratelimit import estimate_tokens
+
+    sample = peel_core.build_prompt(peel_core.EXAMPLES_SECTION, synthetic_essays(1)[0]["question"], synthetic_essays(1)[0]["answer"]).text
+    per_essay = estimate_tokens(sample, "gpt-4.1-mini") + 100
+    ceiling = min(args.rpm, args.tpm / per_essay) / args.period
+    print(
+        f"{args.essays} essays, limits rpm={args.rpm} tpm={args.tpm} per {args.period:g}s, "
+        f"~{per_essay} tokens/essay, ceiling ~{ceiling:.2f} essays/s"
+    )
+    run("sdk retries", args)
+    run("limiter", args, {"tpm": args.tpm, "rpm": args.rpm})
+    run("limiter x2", args, {"tpm": args.tpm * 2, "rpm": args.rpm * 2})
+
+
+if __name__ == "__main__":
+    main()
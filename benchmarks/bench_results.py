@@ -0,0 +1,140 @@
+"""
+Results store: write throughput and dashboard query time as the table grows.
+
+Fills a fresh peel_results.ResultStore with ``--rows`` synthetic evaluations
+spread over ``--days`` days and ``--models`` models. Latency is lognormal
+and scores are 0-15. Rows are written in chunks of ``--chunk`` (as batch runs
+do), and also one at a time for the first ``--single`` rows (as the apps do).
+
+At each checkpoint it times the dashboard's queries (summary with p50/p95 and
+score histograms, and the daily timeline) for the last 7 days and for all
+time. It
+then times the same figures computed from the raw evaluations table, and
+compares the rollup p50/p95 with the exact values.
+
+    python benchmarks/bench_results.py --rows 2000000
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from peel_results import PRICES, ResultStore, cost_usd
+
+MODELS = list(PRICES)
+
+
+def synthetic(n: int, start: float, days: int, models: int, rng) -> list[dict]:
+    rows = []
+    for _ in range(n):
+        model = MODELS[int(rng.random() * models)]
+        total = rng.lognormvariate(math.log(6000), 0.5)
+        tokens_in, tokens_out = int(rng.gauss(2500, 300)), int(rng.gauss(400, 80))
+        rows.append({
+            "ts": start + rng.random() * days * 86400,
+            "app": rng.choice(("few_shot_peel", "peel_batch", "peel_vector")),
+            "model": model,
+            "temperature": 0.0,
+            "k_examples": 3,
+            "exemplar_ids": '["high_band_example", "mid_band_example", "low_band_example"]',
+            "score": float(min(15, max(0, round(rng.gauss(9, 3))))),
+            "input_tokens": tokens_in,
+            "output_tokens": tokens_out,
+            "cost_usd": cost_usd(model, tokens_in, tokens_out),
+            "total_ms": total,
+            "retrieval_ms": rng.lognormvariate(math.log(250), 0.4),
+            "first_token_ms": total * 0.3,
+            "llm_ms": total * 0.9,
+            "cache_hit": 0,
+        })
+    return rows
+
+def timed(fn, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+def dashboard(store: ResultStore, since):
+    store.summary(since=since)
+    store.timeline(since=since)
+
+def raw(store: ResultStore, since):
+    """The same figures straight from the evaluations table; returns exact p50/p95 per model."""
+    where, params = ("WHERE ts >= ?", [since]) if since else ("", [])
+    conn = store._conn
+    conn.execute(f"SELECT model, COUNT(*), AVG(score), SUM(cost_usd) FROM evaluations {where} GROUP BY model", params).fetchall()
+    conn.execute(f"SELECT model, CAST(ROUND(score) AS INTEGER), COUNT(*) FROM evaluations {where} GROUP BY 1, 2", params).fetchall()
+    conn.execute(f"SELECT model, CAST(ts / 86400 AS INTEGER), COUNT(*), SUM(cost_usd) FROM evaluations {where} GROUP BY 1, 2", params).fetchall()
+    exact = {}
+    for model in MODELS:
+        latencies = [r[0] for r in conn.execute(
+            f"SELECT total_ms FROM evaluations {where}{' AND' if where else ' WHERE'} model = ? ORDER BY total_ms",
+            [*params, model],
+        )]
+        if latencies:
+            exact[model] = (latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95)])
+    return exact
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--checkpoints", type=int, default=3, help="measure queries this many times while filling")
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--models", type=int, default=3)
+    parser.add_argument("--chunk", type=int, default=5000, help="rows per write transaction")
+    parser.add_argument("--single", type=int, default=2000, help="rows written one per transaction first")
+    args = parser.parse_args()
+    rng = random.Random(0)
+    now = time.time()
+    start = now - args.days * 86400
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ResultStore(os.path.join(tmp, "results.sqlite"))
+        started = time.perf_counter()
+        for row in synthetic(args.single, start, args.days, args.models, rng):
+            store.add(row)
+        single_s = time.perf_counter() - started
+        print(f"one row per transaction: {args.single / single_s:,.0f} rows/s")
+
+        written, write_s = args.single, 0.0
+        for checkpoint in range(1, args.checkpoints + 1):
+            target = args.single + (args.rows - args.single) * checkpoint // args.checkpoints
+            while written < target:
+                rows = synthetic(min(args.chunk, target - written), start, args.days, args.models, rng)
+                started = time.perf_counter()
+                store.record_many(rows)
+                write_s += time.perf_counter() - started
+                written += len(rows)
+
+            week = now - 7 * 86400
+            rollup_week, rollup_all = timed(lambda: dashboard(store, week)), timed(lambda: dashboard(store, None))
+            raw_week, raw_all = timed(lambda: raw(store, week), 1), timed(lambda: raw(store, None), 1)
+            print(
+                f"{written:>10,} rows  chunked writes {written / write_s:,.0f} rows/s   "
+                f"dashboard 7d {rollup_week:6.1f} ms  all {rollup_all:6.1f} ms   "
+                f"raw table 7d {raw_week:8.1f} ms  all {raw_all:8.1f} ms"
+            )
+
+        exact = raw(store, None)
+        for row in store.summary():
+            p50, p95 = exact[row["model"]]
+            print(
+                f"  {row['model']:<14} p50 {row['total_p50_ms']:>6} ms (exact {p50:6.0f})   "
+                f"p95 {row['total_p95_ms']:>6} ms (exact {p95:6.0f})"
+            )
+        size = os.path.getsize(os.path.join(tmp, "results.sqlite")) / 1e6
+        rollups = {t: store._conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in ("rollup_hourly", "rollup_daily")}
+        print(f"database {size:,.0f} MB; rollup rows: " + ", ".join(f"{t} {n:,}" for t, n in rollups.items()))
+
+
+if __name__ == "__main__":
+    main()
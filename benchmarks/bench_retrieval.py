@@ -0,0 +1,101 @@
+"""
+Compare the Chroma and NumPy exemplar retrievers.
+
+Each backend runs in a fresh subprocess so that load time and resident memory
+are measured from a cold interpreter. Embeddings come from the local fake
+model through the persistent embedding store, as they would on a warm replica.
+
+    python benchmarks/bench_retrieval.py --exemplars 3000 --queries 200
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+def synthetic_exemplars(n: int) -> list[dict]:
+    bands = ["13–15", "9–12", "0–8"]
+    return [
+        {
+            "label": f"exemplar_{i}",
+            "band": bands[i % 3],
+            "text": f"EXAMPLE\nQuestion: question {i % 50}\nStudent answer:\nessay {i} " + "word " * 200,
+        }
+        for i in range(n)
+    ]
+
+def run_backend(backend: str, n_exemplars: int, n_queries: int, dim: int, k: int) -> dict:
+    import peel_core
+    from peel_fakes import fake_embeddings
+
+    exemplars = synthetic_exemplars(n_exemplars)
+    embeddings = peel_core.build_embeddings(fake_embeddings(dim))
+    queries = [f"student answer {i} " + "text " * 100 for i in range(n_queries)]
+    embeddings.embed_documents(queries)  # warm the store so queries measure search only
+
+    baseline = rss_mb()
+    started = time.perf_counter()
+    retriever = peel_core.build_vectorstore(embeddings, backend, exemplars)
+    load_s = time.perf_counter() - started
+
+    latencies = []
+    for q in queries:
+        t = time.perf_counter()
+        peel_core.select_examples(retriever, q, k)
+        latencies.append(time.perf_counter() - t)
+
+    result = {
+        "backend": backend,
+        "load_s": load_s,
+        "query_p50_ms": statistics.median(latencies) * 1000,
+        "query_p95_ms": statistics.quantiles(latencies, n=20)[-1] * 1000,
+        "rss_mb": rss_mb() - baseline,
+    }
+    if hasattr(retriever, "similarity_search_batch"):
+        t = time.perf_counter()
+        peel_core.select_examples_batch(retriever, queries, k)
+        result["batch_per_query_ms"] = (time.perf_counter() - t) / n_queries * 1000
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--exemplars", type=int, default=3000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=3072, help="embedding size (text-embedding-3-large is 3072)")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--worker", choices=["chroma", "numpy"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_backend(args.worker, args.exemplars, args.queries, args.dim, args.k)))
+        return
+
+    env = dict(os.environ, PEEL_DATA_DIR=os.environ.get("PEEL_DATA_DIR") or tempfile.mkdtemp(prefix="peel-bench-"))
+    common = ["--exemplars", str(args.exemplars), "--queries", str(args.queries), "--dim", str(args.dim), "--k", str(args.k)]
+    # One untimed pass per backend fills the embedding store and builds the .npy artifact.
+    for backend in ("chroma", "numpy"):
+        subprocess.run([sys.executable, __file__, "--worker", backend, *common], env=env, check=True, capture_output=True)
+
+    print(f"{args.exemplars} exemplars, {args.queries} queries, dim={args.dim}, k={args.k}")
+    print(f"{'backend':<8} {'load s':>8} {'p50 ms':>8} {'p95 ms':>8} {'batch ms/q':>11} {'RSS MB':>8}")
+    for backend in ("chroma", "numpy"):
+        out = subprocess.run([sys.executable, __file__, "--worker", backend, *common], env=env, check=True, capture_output=True, text=True)
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        batch = f"{r['batch_per_query_ms']:.3f}" if "batch_per_query_ms" in r else "-"
+        print(f"{r['backend']:<8} {r['load_s']:>8.3f} {r['query_p50_ms']:>8.3f} {r['query_p95_ms']:>8.3f} {batch:>11} {r['rss_mb']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
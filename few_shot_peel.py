@@ -1,192 +1,62 @@
 import os
-import random
+import uuid
+
 import streamlit as st
 
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_community.vectorstores import Chroma
-from langchain_core.prompts import PromptTemplate
+from peel_cache import EvaluationCache
+from peel_core import data_path, load_exemplars, parse_score
+from peel_jobs import FINISHED, EvaluationRunner, JobStore, WorkerPool
+from peel_results import ResultStore
+from peel_trace import JsonlTraceSink, Tracer
+from peel_ui import load_api_key, render_connection_stats, render_ensemble, render_paragraphs, render_trace
 
 
 # =========================
 #  CONFIG: OPENAI KEY
 # =========================
 
-import openai
-#os.environ["OPENAI_API_KEY"] = st.secrets.get("OPENAI_API_KEY", "")
-from dotenv import load_dotenv, find_dotenv
-_ = load_dotenv(find_dotenv()) # read local .env file
-openai.api_key = os.environ['OPENAI_API_KEY']
-
-api_key = os.getenv("OPENAI_API_KEY")  # locally: export OPENAI_API_KEY="sk-..."
-if not api_key:
-    # On Streamlit Cloud, secrets are also exposed as env vars, but in case:
-    try:
-        api_key = st.secrets["OPENAI_API_KEY"]
-        os.environ["OPENAI_API_KEY"] = api_key
-    except Exception:
-        pass
-
-# =========================
-#  EXAMPLE EVALUATIONS
-# =========================
-# TODO: Replace placeholder contents with your real examples (15–20 entries ideally).
-EXAMPLE_EVALUATIONS = [
-    {
-        "label": "high_band_example",
-        "band": "13–15",
-        "text": """EXAMPLE
-Question: How does the writer create tension in this passage?
-Student answer:
-[Put the full strong student answer here.]
-
-Teacher feedback:
-**Score: 14/15**
-This response shows a strong understanding of the passage and follows the required essay structure effectively. The introduction clearly states the title, author, and context of the extract, and the thesis statement directly answers the question by outlining the key ways tension is created. The body paragraphs generally follow a PEEL structure, and the student supports their points with relevant quotations and clear explanations. Language aspects such as sensory imagery and short, abrupt sentences are identified and analysed, which strengthens the response. Minor improvements in depth of analysis could push this into full marks.
-"""
-    },
-    {
-        "label": "mid_band_example",
-        "band": "9–12",
-        "text": """EXAMPLE
-Question: In what ways is the character shown as selfish?
-Student answer:
-[Put a mid-level student answer here.]
-
-Teacher feedback:
-**Score: 10/15**
-The response attempts to follow the required structure and does answer the question, but not always consistently. The introduction names the character and briefly mentions the situation, yet the thesis statement is vague and does not clearly outline the main points that will be developed. The body paragraphs show some PEEL features, but explanations are often descriptive rather than analytical, and the answer sometimes slips into narration. Language aspects are mentioned but not always accurately analysed. With a clearer thesis and deeper explanation, this could move to a higher band.
-"""
-    },
-    {
-        "label": "low_band_example",
-        "band": "0–8",
-        "text": """EXAMPLE
-Question: How is the setting important in this extract?
-Student answer:
-[Put a weak student answer here.]
-
-Teacher feedback:
-**Score: 6/15**
-This response shows a basic awareness of the setting but does not fully address how it is important to the extract. The introduction is very brief and does not include the title, author, or a clear thesis statement. The paragraphs are loosely organised and do not consistently follow a PEEL structure. There is little direct evidence from the text, and explanations remain general rather than analytical. Language features are not clearly identified or discussed. To improve, the student needs to include a proper introduction, use quotations to support points, and focus on explaining how the setting affects mood, character, or theme.
-"""
-    },
-    # ➜ Add more examples here in the same format
-]
+api_key = load_api_key()  # locally: export OPENAI_API_KEY="sk-..."
 
 # =========================
-#  PROMPT TEMPLATE
+#  JOBS & WORKERS
 # =========================
+# Evaluations run as jobs on a worker pool rather than inside the script run,
+# so a rerun or a refresh never throws work away. Set PEEL_JOB_WORKERS=0 to
+# leave the queue to separate `python peel_jobs.py` worker processes.
+JOB_WORKERS = int(os.environ.get("PEEL_JOB_WORKERS", "4"))
 
-peel_prompt_string = """
-You are an experienced IGCSE examiner. Your task is to evaluate a middle school student’s written response using the PEEL structure: Point, Evidence, Explanation, Link.
-
-You will be given several EXAMPLE EVALUATIONS. Each example contains:
-- The question
-- The student’s answer
-- The teacher’s feedback
-- The score out of 15
-
-Study these examples carefully and imitate their style, tone, level of strictness, and scoring when evaluating the new answer.
-
-EXAMPLE_EVALUATIONS:
-{examples}
-
-Evaluate the new answer against these criteria:
-
-1. POINT — Is the argument clearly stated and directly answering the question?
-2. EVIDENCE — Is there relevant, accurate, and specific supporting evidence?
-3. EXPLANATION — Does the student explain how the evidence supports the point, showing understanding and analysis?
-4. LINK — Does the student connect back to the question or provide a clear transition?
-
-Expectation from the Student's Answer:
-There should be one introductory paragraph followed by three body paragraphs and one conclusion paragraph.
-The introductory paragraph should first begin with the title of the story,
-then the name of the author,
-then a short one or two lines about the content of the extract or the content of the scene,
-followed by a thesis statement.
-The thesis statement should provide a clear answer to the question and outline all the points which will be highlighted in the following essay.
-The body paragraphs should follow the PEEL format, but language aspects also require to be mentioned.
-In language aspects, the student should identify a literary device or other forms of language used by the author to bring out what they're trying to say.
-They can either use the PETAL (Point, Evidence, Technique, Analysis, Link) format for this or provide a separate body paragraph for the same.
-If they are providing a separate body paragraph, they will have two paragraphs which explain points and one paragraph which highlights the literary devices.
-Then in the conclusion, they must summarize all the points and restate the thesis statement.
-Throughout the essay, they should not narrate the story; they need to be specific to the question.
-However, evidence must be explained and some content and background may be provided while doing the same.
-
-Evaluation Criteria:
-- 10 marks for the content of the answer
-- 5 marks for quality of writing (grammar, vocabulary, clarity)
-- Total: 15 marks
-
-Now evaluate the NEW answer.
-
-Provide your feedback in paragraph format using the structure below:
-- Start with giving a score out of 15 based on overall effectiveness. Output this in bold (Markdown) and add a newline after this line.
-- Then add a separate paragraph for each of the following, separated by a blank line:
-  - A judgment of how well the PEEL structure is followed.
-  - Comments on the strengths in Point, Evidence, Explanation, and Link.
-  - 2–3 clear suggestions for improvement (EBI: Even Better If…).
-  - A brief summary sentence encouraging improvement.
-
-Tone: Constructive, supportive, and academically appropriate for IGCSE level.
-Do not use bullet lists in your feedback paragraphs. Do not provide separate numeric scores for each criterion; only provide one overall score out of 15 at the start.
-
-QUESTION:
-{question}
-
-STUDENT_ANSWER:
-{student_answer}
-"""
-
-prompt = PromptTemplate(
-    template=peel_prompt_string,
-    input_variables=["examples", "question", "student_answer"],
-)
+@st.cache_resource
+def get_exemplars():
+    return load_exemplars()
 
-# =========================
-#  LLM & VECTORSTORE
-# =========================
+@st.cache_resource
+def get_tracer():
+    return Tracer(JsonlTraceSink(data_path("traces.jsonl")))
 
 @st.cache_resource
-def get_llm(model_name: str, temperature: float):
-    return ChatOpenAI(
-        model=model_name,
-        temperature=temperature,
-    )
+def get_job_store():
+    return JobStore(data_path("jobs.sqlite"))
 
 @st.cache_resource
-def get_vectorstore():
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-large")
-    texts = [ex["text"] for ex in EXAMPLE_EVALUATIONS]
-    metadatas = [{"label": ex["label"], "band": ex["band"]} for ex in EXAMPLE_EVALUATIONS]
-
-    vectorstore = Chroma.from_texts(
-        texts=texts,
-        embedding=embeddings,
-        metadatas=metadatas,
-        collection_name="peel_examples",
+def get_runner():
+    # Models, retriever, cache, single-flight and class sessions for this process.
+    return EvaluationRunner(
+        EvaluationCache(data_path("eval_cache.sqlite")), get_tracer().sink, results=ResultStore(data_path("results.sqlite")),
     )
-    return vectorstore
-
-def select_examples(vectorstore, student_answer: str, k: int = 3) -> tuple[str, list]:
-    docs = vectorstore.similarity_search(student_answer, k=k)
-    examples_text = "\n\n---\n\n".join(d.page_content for d in docs)
-    return examples_text, docs
-
-def evaluate_answer(question: str, student_answer: str, model_name: str, temperature: float, k_examples: int):
-    llm = get_llm(model_name, temperature)
-    vectorstore = get_vectorstore()
 
-    examples_text, docs_used = select_examples(vectorstore, student_answer, k=k_examples)
+@st.cache_resource
+def get_worker_pool():
+    return WorkerPool(get_job_store(), get_runner(), workers=JOB_WORKERS).start()
 
-    final_prompt = prompt.format(
-        examples=examples_text,
-        question=question,
-        student_answer=student_answer,
-    )
+get_worker_pool()
 
-    response = llm.invoke(final_prompt)
-    return response.content, docs_used
+HEDGE_SAME_MODEL = "Same model (hedged duplicate)"
+# Long-essay modes (peel_mapreduce): the reduce step after the paragraph calls.
+LONG_ESSAY_MODES = {
+    "Whole essay in one call": None,
+    "Paragraph by paragraph, local summary": "local",
+    "Paragraph by paragraph, model summary": "model",
+}
 
 
 # =========================
@@ -241,7 +111,7 @@ st.markdown(
 )
 
 # Warn if API key missing
-if not os.getenv("OPENAI_API_KEY"):
+if not api_key:
     st.warning("⚠️ OpenAI API key not found. Set `OPENAI_API_KEY` as an environment variable or Streamlit secret.")
 
 # ---- LAYOUT: two main columns ----
@@ -250,11 +120,26 @@ left_col, right_col = st.columns([2.5, 1.5])
 with left_col:
     st.subheader("✏️ Student Response")
 
+    class_session = st.toggle(
+        "Class session",
+        help="Grading a class set for one question? Its exemplar shortlist and prompt are prepared once and reused for every essay.",
+    )
+    screen = st.toggle(
+        "Pre-screen essays",
+        help="Check length, paragraphs, quotations and copying locally first. Empty, copied or very short answers are marked or turned back without a model call, and structure notes are added to the prompt.",
+    )
+
     question = st.text_area(
         "Question / Prompt",
         placeholder="e.g. How does the writer create sympathy for the main character in this extract?",
         height=150,
     )
+    # Changing the question (or leaving session mode) starts a new session.
+    if not class_session or st.session_state.get("session_question") != question:
+        st.session_state["session_question"] = question
+        st.session_state["session_essays"] = 0
+    if class_session and question.strip():
+        st.caption(f"Class session for this question · {st.session_state['session_essays']} essays graded")
 
     student_answer = st.text_area(
         "Student's Answer",
@@ -264,6 +149,38 @@ with left_col:
 
     run_button = st.button("🔍 Evaluate Answer", type="primary", use_container_width=True)
 
+with st.sidebar:
+    st.header("⏱️ Performance")
+    trace_requests = st.toggle(
+        "Trace requests",
+        value=get_tracer().enabled,
+        help="Record per-stage timings and token usage for each evaluation.",
+    )
+    use_fallback = st.toggle(
+        "Back up slow requests",
+        value=False,
+        help="If the model has not started answering within the threshold, send a backup request and keep whichever starts first.",
+    )
+    if use_fallback:
+        first_token_timeout = st.slider("Back up after (seconds without a first token)", 1.0, 30.0, 8.0, 0.5)
+        fallback_model = st.selectbox("Backup", ["gpt-4.1-mini", "gpt-4o-mini", HEDGE_SAME_MODEL])
+        policy_summary = get_runner().policy_stats.summary()
+        st.caption(
+            "Winners so far: " + " · ".join(f"{name} {count}" for name, count in policy_summary["wins"].items())
+        )
+    flight_stats = get_runner().singleflight.stats()
+    st.caption(
+        f"Coalesced requests: {flight_stats['coalesced']} of {flight_stats['leaders'] + flight_stats['coalesced']} "
+        f"· {flight_stats['in_flight']} in flight"
+    )
+    prefetch_stats = get_runner().prefetcher.stats()
+    if prefetch_stats["hits"] + prefetch_stats["waited"] + prefetch_stats["misses"]:
+        st.caption(
+            f"Prefetched retrieval: {prefetch_stats['hits'] + prefetch_stats['waited']} of "
+            f"{prefetch_stats['hits'] + prefetch_stats['waited'] + prefetch_stats['misses']} evaluations"
+        )
+    render_connection_stats()
+
 with right_col:
     st.subheader("⚙️ Settings & Model")
 
@@ -281,8 +198,8 @@ with right_col:
     k_examples = st.slider(
         "Number of examples to guide evaluation",
         min_value=1,
-        max_value=min(5, len(EXAMPLE_EVALUATIONS)),
-        value=min(3, len(EXAMPLE_EVALUATIONS)),
+        max_value=min(5, len(get_exemplars())),
+        value=min(3, len(get_exemplars())),
         step=1,
         help="How many marked examples should the model see before evaluating the new answer?",
     )
@@ -296,6 +213,31 @@ with right_col:
         help="Keep this low for consistent, rubric-like marking.",
     )
 
+    samples = st.slider(
+        "Samples per evaluation",
+        min_value=1,
+        max_value=7,
+        value=1,
+        step=1,
+        help="Grade the essay several times in parallel and report the median score and its spread.",
+    )
+    ensemble_models = [model_name]
+    if samples > 1:
+        ensemble_models += st.multiselect(
+            "Also sample from",
+            [m for m in ["gpt-5", "gpt-4.1-mini", "gpt-4o-mini"] if m != model_name],
+            help="Samples are spread round-robin across the selected models.",
+        )
+
+    long_essays = st.selectbox(
+        "Long essays",
+        list(LONG_ESSAY_MODES),
+        disabled=samples > 1,
+        help="Mark each paragraph in its own parallel call, then summarise the marks locally (fastest) or with one "
+        "more model call (slower than a single call, but calibrated against the exemplars). Essays under 250 words "
+        "or without clear paragraphs are still graded in one call.",
+    )
+
     st.markdown("### ℹ️ Guidance")
     st.markdown(
         "- Expects intro, 3 body paragraphs, and a conclusion.\n"
@@ -303,8 +245,17 @@ with right_col:
         "- Focus on analysis, not narration."
     )
 
+    cache_stats = get_runner().cache.stats()
+    st.caption(
+        f"Evaluation cache: {cache_stats['hits']} hits · {cache_stats['misses']} misses · "
+        f"{cache_stats['entries']} stored" + (" (bypassed when temperature > 0)" if temperature > 0 else "")
+    )
+
     with st.expander("View raw example bands"):
-        for ex in EXAMPLE_EVALUATIONS:
+        exemplars = get_exemplars()
+        if len(exemplars) > 20:
+            st.caption(f"Showing 20 of {len(exemplars)} exemplars.")
+        for ex in exemplars[:20]:
             st.markdown(f"**{ex['label']}** (Band {ex['band']})")
             st.code(ex["text"][:500] + ("...\n[truncated]" if len(ex["text"]) > 500 else ""), language="markdown")
 
@@ -329,79 +280,156 @@ def copy_to_clipboard(text: str):
         st.experimental_js(clipboard_js)
         st.toast("Copied to clipboard!")  # Nice visual confirmation
 
+def render_examples(examples: list[dict]):
+    with st.expander("🔎 Examples used for this evaluation"):
+        st.caption("The model was guided by these marked examples (retrieved via similarity search):")
+        for i, ex in enumerate(examples, start=1):
+            label = ex.get("label", f"example_{i}")
+            band = ex.get("band", "?")
+            st.markdown(
+                f'<span class="pill">Band {band}</span> **{label}**',
+                unsafe_allow_html=True,
+            )
+            st.code(
+                ex["text"][:800] + ("...\n[truncated]" if len(ex["text"]) > 800 else ""),
+                language="markdown",
+            )
+
+@st.fragment(run_every=0.5)
+def poll_job(job_id: str):
+    """Show a queued or running job's progress; rerun the page once it finishes."""
+    job = get_job_store().get(job_id)
+    if job["status"] in FINISHED:
+        st.rerun()
+    if job["status"] == "queued":
+        st.caption("Queued, waiting for a free worker...")
+        return
+    partial = job["partial"]
+    score = parse_score(partial)
+    if score is not None:
+        st.metric("Score", f"{score:g}/15")
+    if partial:
+        st.markdown(partial + " ▌")
+    else:
+        st.caption("Waiting for the model...")
+
+def render_job(job_id: str):
+    job = get_job_store().get(job_id)
+    if job is None:
+        st.warning(f"Evaluation job `{job_id}` was not found.")
+        return
+    st.markdown("### ✅ Evaluation Result")
+    st.caption(f"Job `{job_id}` · open this page with `?job={job_id}` to come back to it or share it.")
+    if job["status"] not in FINISHED:
+        poll_job(job_id)
+        return
+    if job["status"] == "failed":
+        if job["error"].startswith("EssayRejected: "):
+            st.warning("Not graded: " + job["error"].split(": ", 2)[-1])
+        else:
+            st.error(f"Evaluation failed: {job['error']}")
+        return
+
+    result = job["result"]
+    feedback = result["feedback"]
+    st.markdown('<div class="result-box">', unsafe_allow_html=True)
+    if "ensemble" in result:
+        render_ensemble(result["ensemble"], feedback)
+    elif "map_reduce" in result:
+        render_paragraphs(result["map_reduce"], feedback)
+    else:
+        if result["score"] is not None:
+            st.metric("Score", f"{result['score']:g}/15")
+        st.markdown(feedback)
+    st.markdown("</div>", unsafe_allow_html=True)
+
+    timings = result.get("timings")
+    if timings and timings["total_s"] is not None:
+        parts = [f"First token {timings['first_token_s'] or 0:.1f}s"]
+        if timings["score_s"] is not None:
+            parts.append(f"score at {timings['score_s']:.1f}s")
+        parts.append(f"complete in {timings['total_s']:.1f}s")
+        st.caption(" · ".join(parts))
+    if result.get("trace"):
+        st.session_state["last_trace"] = result["trace"]
+    tokens = result["prompt_tokens"]
+    reduce = result.get("map_reduce", {}).get("reduce")
+    if reduce == "local":
+        st.caption(f"Scored from {len(result['map_reduce']['paragraphs'])} paragraph assessments, without a summary call.")
+    elif tokens is None and not result["examples"]:
+        st.caption("Marked by pre-screening, without a model call.")
+    elif tokens is not None:
+        request = "question + paragraph assessments" if reduce == "model" else "question + answer"
+        st.caption(
+            f"Prompt tokens: {tokens['static']} static rubric · {tokens['examples']} exemplars · "
+            f"{tokens['request']} {request} ({tokens['total']} total)"
+        )
+
+    # --- ACTION BUTTONS: Copy + Download ---
+    btn_col1, btn_col2 = st.columns(2)
+
+    with btn_col1:
+        st.download_button(
+            "⬇️ Download feedback as .txt",
+            data=feedback,
+            file_name="peel_feedback.txt",
+            mime="text/plain",
+            use_container_width=True,
+        )
+
+    with btn_col2:
+        if st.button("📋 Copy feedback", use_container_width=True):
+            copy_to_clipboard(feedback)
+
+    # --- SHOW WHICH EXAMPLES WERE USED ---
+    render_examples(result["examples"])
+
+# Retrieve exemplars for the current draft in the background, so Evaluate goes
+# straight to the completion if the text has not changed since. Without local
+# workers the job runs in another process, which cannot use this prefetch.
+if JOB_WORKERS and api_key and question.strip() and student_answer.strip() and not run_button:
+    get_runner().prefetch(
+        {"question": question, "answer": student_answer, "k_examples": k_examples, "class_session": class_session},
+        slot=st.session_state.setdefault("prefetch_slot", uuid.uuid4().hex),
+    )
+
 if run_button:
     if not question.strip() or not student_answer.strip():
         st.error("Please enter both a **Question** and a **Student's Answer** before evaluating.")
-    elif not os.getenv("OPENAI_API_KEY"):
+    elif not api_key:
         st.error("OpenAI API key missing. Set `OPENAI_API_KEY` in your environment or Streamlit secrets.")
     else:
-        with st.spinner("Evaluating answer using PEEL criteria..."):
-            feedback, docs_used = evaluate_answer(
-                question=question,
-                student_answer=student_answer,
-                model_name=model_name,
-                temperature=temperature,
-                k_examples=k_examples,
-            )
-
-        # st.markdown("### ✅ Evaluation Result")
-        # st.markdown('<div class="result-box">', unsafe_allow_html=True)
-        # st.markdown(feedback)
-        # st.markdown("</div>", unsafe_allow_html=True)
-
-        # with st.expander("🔎 Examples used for this evaluation"):
-        #     st.caption("The model was guided by these marked examples (retrieved via similarity search):")
-        #     for i, d in enumerate(docs_used, start=1):
-        #         label = d.metadata.get("label", f"example_{i}")
-        #         band = d.metadata.get("band", "?")
-        #         st.markdown(f'<span class="pill">Band {band}</span> **{label}**', unsafe_allow_html=True)
-        #         st.code(d.page_content[:800] + ("...\n[truncated]" if len(d.page_content) > 800 else ""), language="markdown")
-
-        st.markdown("### ✅ Evaluation Result")
-        st.markdown('<div class="result-box">', unsafe_allow_html=True)
-        st.markdown(feedback)
-        st.markdown("</div>", unsafe_allow_html=True)
-
-        # --- ACTION BUTTONS: Copy + Download ---
-        btn_col1, btn_col2 = st.columns(2)
-
-        with btn_col1:
-            st.download_button(
-                "⬇️ Download feedback as .txt",
-                data=feedback,
-                file_name="peel_feedback.txt",
-                mime="text/plain",
-                use_container_width=True,
-            )
+        params = {
+            "app": "few_shot_peel",
+            "question": question,
+            "answer": student_answer,
+            "model": model_name,
+            "temperature": temperature,
+            "k_examples": k_examples,
+            "samples": samples,
+            "ensemble_models": ensemble_models[1:],
+            "map_reduce": LONG_ESSAY_MODES[long_essays],
+            "class_session": class_session,
+            "screen": screen,
+            "trace": trace_requests,
+        }
+        if use_fallback:
+            params["first_token_timeout"] = first_token_timeout
+            params["fallback_model"] = None if fallback_model == HEDGE_SAME_MODEL else fallback_model
+        job_id = get_job_store().submit(params)
+        st.session_state["job_id"] = job_id
+        st.query_params["job"] = job_id
+        if class_session:
+            st.session_state["session_essays"] += 1
+
+job_id = st.session_state.get("job_id") or st.query_params.get("job")
+if job_id:
+    render_job(job_id)
+
+if trace_requests and st.session_state.get("last_trace"):
+    with st.sidebar:
+        render_trace(st.session_state["last_trace"])
 
-        with btn_col2:
-            # Simple JS-based copy-to-clipboard button
-            # safe_feedback = feedback.replace("`", "\\`")
-            # copy_button_html = f"""
-            # <button onclick="navigator.clipboard.writeText(`{safe_feedback}`)">
-            #     📋 Copy feedback
-            # </button>
-            # """
-           
-            if st.button("📋 Copy feedback", use_container_width=True):
-                copy_to_clipboard(feedback)
-
-            # st.markdown(copy_button_html, unsafe_allow_html=True)
-
-        # --- SHOW WHICH EXAMPLES WERE USED ---
-        with st.expander("🔎 Examples used for this evaluation"):
-            st.caption("The model was guided by these marked examples (retrieved via similarity search):")
-            for i, d in enumerate(docs_used, start=1):
-                label = d.metadata.get("label", f"example_{i}")
-                band = d.metadata.get("band", "?")
-                st.markdown(
-                    f'<span class="pill">Band {band}</span> **{label}**',
-                    unsafe_allow_html=True,
-                )
-                st.code(
-                    d.page_content[:800] + ("...\n[truncated]" if len(d.page_content) > 800 else ""),
-                    language="markdown",
-                )
 # Footer
 st.markdown("---")
 st.caption("PEEL & PETAL essay evaluator • Designed for IGCSE-style literature responses.")
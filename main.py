@@ -1,122 +1,122 @@
-import streamlit as st
+import asyncio
 import os
-import openai
-# from openai import OpenAI
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import PromptTemplate
+import re
+
+import streamlit as st
 
-from dotenv import load_dotenv, find_dotenv
-_ = load_dotenv(find_dotenv()) # read local .env file
-openai.api_key = os.environ['OPENAI_API_KEY']
+import peel_core
+from peel_cache import EvaluationCache
+from peel_core import ZERO_SHOT_PEEL_PROMPT, data_path, invoke_ensemble, log_stream_timings, stream_llm
+from peel_ingest import UPLOAD_TYPES, count_answers, extract_text, iter_submissions
+from peel_singleflight import SingleFlight
+from peel_trace import Trace
+from peel_ui import load_api_key, render_connection_stats, render_ensemble, render_stream, render_stream_timings
+
+api_key = load_api_key()
 
 # LLM initialization (choose a model you have access to)
-llm = ChatOpenAI(
-    model="gpt-4.1-mini",
-    #model="gpt-4o",
-    temperature=0.7,
-)
-
-# Prompt Template
-evaluation_prompt = PromptTemplate.from_template("""
-You are an expert English teacher. Your job is to evaluate the student's answer and give helpful feedback.
-
-**Task:**
-- Read the question and the student's answer.
-- Decide if the answer is correct, partially correct, or incorrect.
-- Give clear feedback on grammar, clarity, vocabulary, and missing information.
-- Provide a suggested improved answer (only if needed).
-
-**Output Format:**
-Evaluation:
-- Correctness: (Correct / Partially correct / Incorrect)
-- Score: X/10
-- Strengths: ...
-- Areas to improve: ...
-- Suggested improved answer: ...
-
-**Here is the content to evaluate:**
-Question: "{question}"
-Student Answer: "{answer}"
-""")
-
-# 1. Define the prompt template
-peel_prompt_string = """
-You are an experienced IGCSE examiner. Your task is to evaluate a middle school student’s written response using the PEEL structure: Point, Evidence, Explanation, Link.
-
-Evaluate the answer against these criteria:
-
-1. POINT — Is the argument clearly stated and directly answering the question?
-2. EVIDENCE — Is there relevant, accurate, and specific supporting evidence?
-3. EXPLANATION — Does the student explain how the evidence supports the point, showing understanding and analysis?
-4. LINK — Does the student connect back to the question or provide a clear transition?
-
-Expectation form the Student's Answer:
-There should be one introductory paragraph followed by three body paragraphs and one conclusion paragraph. 
-The introductory paragraph should first begin with the title of the story, 
-then the name of the author,
-then a short one or two lines about the content of the extract or the content of the scene, 
-followed by a thesis statement. 
-The thesis statement should provide a clear answer to the question and outline all the points which will be highlighted in the following essay. 
-The body paragraphs should follow the PEEL format, but language aspects also require to be mentioned. 
-In language aspects, you must identify a literary device or other forms of language used by the author to bring out what they're trying to say. 
-You can either use the PETAL (point, Evidence, Explanation, Link) format for this or provide a separate body paragraph for the same. 
-If you're providing a separate body paragraph, you have two paragraphs which explain points and one paragraph which highlights the literary devices. 
-Then in the conclusion, you must summarize all the points and restate the thesis statement. 
-Throughout the essay, you should not narrate and you need to be specific to the answer. 
-However, evidence must be explained and some content and background may be provided by doing the same.
-
-Evaluation Criteria:
-- 10 marks for the content of the answer
-- 5 marks for quality of writing (grammar, vocabulary, clarity)
-- Total: 15 marks
-
-Provide your feedback in paragraph format using the structure below:
-- Start with giving a score out of 15 based on overall effectiveness. (Output this in bold and add newline after this line).
-- Add a paragrah for each of the sections below and seperate them by a newline.
-- Provide a judgment of how well the PEEL structure is followed.
-- Comment specifically on the strengths in Point, Evidence, Explanation, and Link.
-- Provide 2–3 clear suggestions for improvement (EBI: Even Better If…).
-- Conclude with a brief summary sentence encouraging improvement.
-
-Tone: Constructive, supportive, and academically appropriate for IGCSE level.
-
-
-QUESTION:
-{question}
-
-STUDENT_ANSWER:
-{student_answer}
-"""
-
-peel_prompt = PromptTemplate(
-    template=peel_prompt_string,
-    input_variables=["question", "student_answer"],
-)
-
-
-def evaluate_answer(question_text, answer_text):
-    prompt_value = peel_prompt.format(
+MODEL_NAME = "gpt-4.1-mini"
+#MODEL_NAME = "gpt-4o"
+
+def get_llm():
+    # Shared with the other apps' clients through peel_clients (bounded, one connection pool).
+    return peel_core.get_llm(MODEL_NAME, temperature=0.7)
+
+@st.cache_resource
+def get_cache():
+    return EvaluationCache(data_path("eval_cache.sqlite"))
+
+@st.cache_resource
+def get_singleflight():
+    return SingleFlight()
+
+@st.cache_resource
+def get_results():
+    from peel_results import ResultStore
+
+    return ResultStore(data_path("results.sqlite"))
+
+def load_upload(upload, key):
+    """Put an uploaded .txt/.html file's text into the text area ``key`` (once per upload)."""
+    if upload is None or upload.name.lower().endswith(".zip"):
+        return
+    if st.session_state.get(f"{key}_upload") != upload.file_id:
+        st.session_state[key] = extract_text(upload, upload.name)
+        st.session_state[f"{key}_upload"] = upload.file_id
+
+def grade_archive(upload, question_text):
+    """Grade every answer in an uploaded zip with the batch pipeline, one file at a time.
+
+    The answers get the same zero-shot prompt as a single answer here, so an
+    essay is marked the same however it was submitted.
+    """
+    # The batch pipeline pulls in httpx, numpy and LangChain; only load it when an archive is graded.
+    from peel_batch import run_batch
+
+    stem = re.sub(r"[^\w.-]", "_", os.path.splitext(os.path.basename(upload.name))[0])
+    output = data_path(f"uploads/{stem}-results.jsonl")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    total = max(1, count_answers(upload))
+    bar = st.progress(0.0, text=f"Grading {total} answers...")
+
+    def progress(stats):
+        done = stats["graded"] + stats["errors"] + stats["skipped"]
+        bar.progress(min(1.0, done / total), text=f"{done}/{total} answers graded")
+
+    ingest = {}
+    stats = asyncio.run(run_batch(
+        iter_submissions(upload, question_text or None, ingest), output, get_llm(), None,
+        cache=get_cache(), singleflight=get_singleflight(), progress=progress, results=get_results(),
+        template=ZERO_SHOT_PEEL_PROMPT,
+    ))
+    bar.progress(1.0, text="Done")
+    st.success(f"Graded {stats['graded']} answers ({stats['skipped']} already graded, {stats['errors']} failed).")
+    skipped = {k: v for k, v in ingest.items() if k != "answers"}
+    if skipped:
+        st.warning("Skipped files: " + ", ".join(f"{v} {k.replace('_', ' ')}" for k, v in skipped.items()))
+    with open(output, "rb") as f:
+        st.download_button("Download results (JSONL)", f, file_name=os.path.basename(output), mime="application/jsonl")
+
+def evaluate_answer(question_text, answer_text, trace):
+    prompt_value = ZERO_SHOT_PEEL_PROMPT.format(
         question=question_text,
         student_answer=answer_text
     )
-    response = llm.invoke(prompt_value)
-    return response.content
+    return stream_llm(get_llm(), prompt_value, cache=get_cache(), trace=trace, singleflight=get_singleflight())
+
+def evaluate_answer_ensemble(question_text, answer_text, samples, trace):
+    prompt_value = ZERO_SHOT_PEEL_PROMPT.format(
+        question=question_text,
+        student_answer=answer_text
+    )
+    return invoke_ensemble(get_llm(), prompt_value, samples, trace)
+
+def record_result(trace, score):
+    """Add the finished evaluation to the results store behind peel_analytics.py."""
+    from peel_results import record_trace
+
+    model, temperature = peel_core.llm_identity(get_llm())
+    record_trace(get_results(), trace.finish(), app="main", model=model, temperature=temperature, k_examples=0, score=score)
 
 # Streamlit App
 st.title("PEEL Evaluator")
 col1, col2 = st.columns(2)
 with col1:
     st.subheader("Enter PEEL Question ")
-    # question_file = st.file_uploader("", type=["csv",".txt"], key="question")
-    # if question_file is not None:
-    #     st.info(f"Question file: {question_file.name}")
+    question_file = st.file_uploader("Question file", type=UPLOAD_TYPES, key="question")
+    if question_file is not None:
+        st.info(f"Question file: {question_file.name}")
+    load_upload(question_file, "question_text")
     question_text = st.text_area("Paste or type the question here", height=500, key="question_text")
 
 with col2:
     st.subheader("Enter PEEL Answer")
-    # answer_file = st.file_uploader("", type=["csv",".txt"], key="answer")
-    # if answer_file is not None:
-    #     st.info(f"Answer file: {answer_file.name}")
+    answer_file = st.file_uploader(
+        "Answer file, or a .zip of answers to grade together", type=UPLOAD_TYPES + ["zip"], key="answer",
+    )
+    if answer_file is not None:
+        st.info(f"Answer file: {answer_file.name}")
+    load_upload(answer_file, "answer_text")
     answer_text = st.text_area("Paste or type the answer here", height=500, key="answer_text")
 
 # Add custom button styling
@@ -145,17 +145,42 @@ st.markdown("""
 # Center the button using columns
 col1, col2, col3 = st.columns([1,2,1])
 with col2:
+    samples = st.number_input(
+        "Samples", min_value=1, max_value=7, value=1,
+        help="Grade several times in parallel and report the median score and its spread.",
+    )
     evaluate = st.button("Evaluate")
 
-if evaluate:
+if evaluate and answer_file is not None and answer_file.name.lower().endswith(".zip"):
+    if not api_key:
+        st.error("OpenAI API key missing. Set `OPENAI_API_KEY` in your environment or a local .env file.")
+    else:
+        grade_archive(answer_file, question_text)
+elif evaluate:
     if question_text is None or answer_text is None:
         st.error("Please enter both the question and answer before evaluating.")
-    else:
-        with st.spinner("Evaluating..."):
-            evaluation_result = evaluate_answer(question_text, answer_text)
+    elif not api_key:
+        st.error("OpenAI API key missing. Set `OPENAI_API_KEY` in your environment or a local .env file.")
+    elif samples > 1:
+        trace = Trace("evaluate", app="main", samples=samples)
+        with st.spinner(f"Grading {samples} samples in parallel..."):
+            result = evaluate_answer_ensemble(question_text, answer_text, samples, trace)
+        st.markdown("### Evaluation Result:")
+        render_ensemble(result.summary(), result.feedback)
         st.success("Evaluation Complete!")
+        record_result(trace, result.score)
+    else:
+        trace = Trace("evaluate", app="main")
+        stream = evaluate_answer(question_text, answer_text, trace)
         st.markdown("### Evaluation Result:")
-        st.text_area("", value=evaluation_result, height=500)
+        render_stream(stream)
+        st.success("Evaluation Complete!")
+        log_stream_timings(stream, MODEL_NAME, app="main")
+        record_result(trace, stream.score)
+        render_stream_timings(stream)
+        cache_stats = get_cache().stats()
+        st.caption(f"Evaluation cache: {cache_stats['hits']} hits · {cache_stats['misses']} misses · {cache_stats['bypassed']} bypassed")
+        render_connection_stats()
     # else:
     #     # Add horizontal line separator
     #     st.markdown("<hr style='border:0;border-top:2px solid #eee;margin-top:18px;margin-bottom:18px;'/>", 
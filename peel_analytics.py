@@ -0,0 +1,124 @@
+import time
+from datetime import datetime
+
+import streamlit as st
+
+from peel_core import data_path
+from peel_results import ResultStore, percentile
+
+# Every app and batch run records its evaluations in <data dir>/results.sqlite
+# (peel_results.py). This page only reads the hourly rollups, so it stays
+# quick however many evaluations the store holds.
+#
+#     streamlit run peel_analytics.py
+
+RANGES = {"Last 24 hours": 1, "Last 7 days": 7, "Last 30 days": 30, "Last 90 days": 90, "All time": None}
+
+
+@st.cache_resource
+def get_results():
+    return ResultStore(data_path("results.sqlite"))
+
+def seconds(ms) -> str:
+    return "–" if ms is None else f"{ms / 1000:.2f}s"
+
+
+st.set_page_config(page_title="PEEL Analytics", layout="wide")
+st.title("📊 PEEL Analytics")
+
+results = get_results()
+options = results.options()
+if options["first"] is None:
+    st.info("No evaluations recorded yet. Grade an essay in one of the apps or with peel_batch.py.")
+    st.stop()
+
+with st.sidebar:
+    range_label = st.selectbox("Period", list(RANGES), index=1)
+    models = st.multiselect("Models", options["models"])
+    apps = st.multiselect("Apps", options["apps"])
+    st.caption(f"{results.count():,} evaluations recorded")
+
+days = RANGES[range_label]
+since = time.time() - days * 86400 if days else None
+scope = dict(since=since, models=models or None, apps=apps or None)
+
+started = time.perf_counter()
+summary = results.summary(**scope)
+timeline = results.timeline(**scope, hours=1 if days == 1 else 24)
+query_ms = (time.perf_counter() - started) * 1000
+
+if not summary:
+    st.info("No evaluations in this period.")
+    st.stop()
+
+# Percentiles over all selected models come from the merged histograms.
+merged = sum(row["latency"]["total"] for row in summary)
+evaluations = sum(row["evaluations"] for row in summary)
+cost = sum(row["total_cost_usd"] for row in summary)
+
+cols = st.columns(5)
+cols[0].metric("Evaluations", f"{evaluations:,}")
+cols[1].metric("p50 latency", seconds(percentile(merged, 0.5)))
+cols[2].metric("p95 latency", seconds(percentile(merged, 0.95)))
+cols[3].metric("Cost per essay", f"${cost / evaluations:.4f}")
+cols[4].metric("Total cost", f"${cost:,.2f}")
+
+st.subheader("By model")
+st.table([
+    {
+        "model": row["model"],
+        "evaluations": f"{row['evaluations']:,}",
+        "p50": seconds(row["total_p50_ms"]),
+        "p95": seconds(row["total_p95_ms"]),
+        "first token p50": seconds(row["first_token_p50_ms"]),
+        "first token p95": seconds(row["first_token_p95_ms"]),
+        "cost / essay": f"${row['cost_per_essay_usd']:.4f}",
+        "tokens in / out": f"{row['input_tokens_per_essay']:,} / {row['output_tokens_per_essay']:,}",
+        "cache hits": f"{row['cache_hit_rate']:.0%}",
+        "mean score": "–" if row["mean_score"] is None else f"{row['mean_score']:g}",
+    }
+    for row in summary
+])
+
+left, right = st.columns(2)
+with left:
+    st.subheader("Score distribution")
+    st.bar_chart(
+        [{"score": s, **{row["model"]: row["scores"][s] for row in summary}} for s in range(16)],
+        x="score", y=[row["model"] for row in summary], stack=False,
+    )
+with right:
+    st.subheader("p95 latency (s)")
+    periods = {}
+    for row in timeline:
+        if row["p95_ms"] is not None:
+            period = datetime.fromtimestamp(row["period_start"])
+            periods.setdefault(period, {"period": period})[row["model"]] = row["p95_ms"] / 1000
+    st.line_chart(list(periods.values()), x="period", y=sorted({r["model"] for r in timeline}))
+
+st.subheader("Cost per day" if days != 1 else "Cost per hour")
+costs = {}
+for row in timeline:
+    period = datetime.fromtimestamp(row["period_start"])
+    costs.setdefault(period, {"period": period})[row["model"]] = row["cost_usd"]
+st.bar_chart(list(costs.values()), x="period", y=sorted({r["model"] for r in timeline}))
+
+with st.expander("Latest evaluations"):
+    st.table([
+        {
+            "time": datetime.fromtimestamp(r["ts"]).strftime("%Y-%m-%d %H:%M:%S"),
+            "app": r["app"],
+            "model": r["model"],
+            "k": r["k_examples"],
+            "temperature": r["temperature"],
+            "score": r["score"],
+            "total": seconds(r["total_ms"]),
+            "retrieval": seconds(r["retrieval_ms"]),
+            "first token": seconds(r["first_token_ms"]),
+            "tokens in / out": f"{r['input_tokens'] or 0} / {r['output_tokens'] or 0}",
+            "exemplars": r["exemplar_ids"],
+        }
+        for r in results.recent(20)
+    ])
+
+st.caption(f"Dashboard queries took {query_ms:.0f} ms.")
@@ -0,0 +1,258 @@
+"""
+Partitioned approximate-nearest-neighbour exemplar index (IVF, NumPy only).
+
+Exemplars are grouped by question and band. Each (question, band) leaf with
+more than ``min_ivf_size`` vectors gets its own inverted-file index: a
+spherical k-means coarse quantiser with ``nlist`` centroids, and the leaf's
+rows stored contiguously by cluster. A search embeds nothing new: it scores the
+query against the centroids, scans only the ``nprobe`` closest clusters and
+ranks those rows exactly. Smaller leaves are scanned in full.
+
+The whole matrix is ordered by (question, band, cluster), so every leaf and
+every cluster is a contiguous slice of one memory-mapped ``.npy`` file, and a
+probe costs one matrix-vector product over a slice with no gathering.
+
+Asking for a question that has no exemplars falls back to an exact scan over
+the whole bank, which is what the flat NumpyExemplarIndex always does.
+"""
+import json
+import os
+
+import numpy as np
+from langchain_core.documents import Document
+
+from peel_embeddings import embeddings_model_name
+from peel_index import _normalise, index_version
+
+
+def question_key(question) -> str:
+    return " ".join(str(question or "").lower().split())
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k largest scores, best first."""
+    k = min(k, len(scores))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+def spherical_kmeans(vectors: np.ndarray, nlist: int, iters: int = 10, sample: int = 256, seed: int = 0) -> np.ndarray:
+    """Unit-norm centroids trained on at most ``sample`` points per centroid."""
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    train = vectors[rng.choice(n, min(n, nlist * sample), replace=False)]
+    centroids = train[rng.choice(len(train), nlist, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(train @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, train)
+        empty = np.bincount(assign, minlength=nlist) == 0
+        # Re-seed empty clusters from random training points.
+        sums[empty] = train[rng.choice(len(train), int(empty.sum()))]
+        centroids = _normalise(sums)
+    return centroids
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray, chunk: int = 65536) -> np.ndarray:
+    return np.concatenate([
+        np.argmax(vectors[i:i + chunk] @ centroids.T, axis=1) for i in range(0, len(vectors), chunk)
+    ]) if len(vectors) else np.empty(0, dtype=np.int64)
+
+
+class _Leaf:
+    """One (question, band) partition: rows [start, end) of the matrix.
+
+    ``offsets`` has nlist + 1 entries; cluster c is rows
+    [start + offsets[c], start + offsets[c + 1]). Leaves without an IVF
+    index have ``centroids`` None.
+    """
+
+    def __init__(self, start: int, end: int, centroids=None, offsets=None):
+        self.start = start
+        self.end = end
+        self.centroids = centroids
+        self.offsets = offsets
+
+    def search(self, matrix: np.ndarray, query: np.ndarray, k: int, nprobe: int) -> tuple[np.ndarray, np.ndarray]:
+        if self.centroids is None:
+            scores = matrix[self.start:self.end] @ query
+            top = _top_k(scores, k)
+            return top + self.start, scores[top]
+        probes = _top_k(self.centroids @ query, nprobe)
+        rows, scores = [], []
+        for c in probes:
+            lo, hi = self.start + self.offsets[c], self.start + self.offsets[c + 1]
+            if hi > lo:
+                rows.append(np.arange(lo, hi))
+                scores.append(matrix[lo:hi] @ query)
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        rows, scores = np.concatenate(rows), np.concatenate(scores)
+        top = _top_k(scores, k)
+        return rows[top], scores[top]
+
+
+class PartitionedExemplarIndex:
+    partitioned = True
+
+    def __init__(self, matrix, texts, metadatas, embeddings, leaves: dict, version: str = None, nprobe: int = 8):
+        self.matrix = matrix
+        self.texts = texts
+        self.metadatas = metadatas
+        self.embeddings = embeddings
+        self.leaves = leaves  # {(question_key, band): _Leaf}
+        self.version = version
+        self.nprobe = nprobe
+        self._by_question = {}
+        for (qkey, band), leaf in leaves.items():
+            self._by_question.setdefault(qkey, {})[band] = leaf
+
+    # -------- construction --------
+
+    @classmethod
+    def from_vectors(cls, vectors, texts, metadatas, embeddings=None, min_ivf_size: int = 2048, nlist: int = None, version: str = None, nprobe: int = 8):
+        """Build in memory from raw vectors; ``nlist`` defaults to ~sqrt(leaf size)."""
+        vectors = _normalise(np.asarray(vectors, dtype=np.float32))
+        keys = [(question_key(m.get("question")), str(m.get("band", "?"))) for m in metadatas]
+        groups = {}
+        for i, key in enumerate(keys):
+            groups.setdefault(key, []).append(i)
+
+        order, leaves, start = [], {}, 0
+        for key in sorted(groups):
+            rows = np.asarray(groups[key])
+            leaf_vectors = vectors[rows]
+            centroids = offsets = None
+            if len(rows) >= min_ivf_size:
+                n_clusters = nlist or max(1, int(np.sqrt(len(rows))))
+                centroids = spherical_kmeans(leaf_vectors, n_clusters)
+                assign = _assign(leaf_vectors, centroids)
+                by_cluster = np.argsort(assign, kind="stable")
+                rows = rows[by_cluster]
+                offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=n_clusters))])
+            order.append(rows)
+            leaves[key] = _Leaf(start, start + len(rows), centroids, offsets)
+            start += len(rows)
+
+        order = np.concatenate(order) if order else np.empty(0, dtype=np.int64)
+        return cls(
+            vectors[order], [texts[i] for i in order], [metadatas[i] for i in order],
+            embeddings, leaves, version, nprobe,
+        )
+
+    @staticmethod
+    def artifact_paths(directory: str, version: str) -> tuple[str, str, str]:
+        base = os.path.join(directory, f"ivf-{version}")
+        return base + ".npy", base + ".npz", base + ".json"
+
+    @classmethod
+    def build(cls, exemplars: list[dict], embeddings, directory: str, **options) -> "PartitionedExemplarIndex":
+        version = index_version(exemplars, embeddings_model_name(embeddings))
+        texts = [ex["text"] for ex in exemplars]
+        metadatas = [{k: v for k, v in ex.items() if k != "text"} for ex in exemplars]
+        index = cls.from_vectors(embeddings.embed_documents(texts), texts, metadatas, embeddings, version=version, **options)
+        index.save(directory)
+        return index
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        npy_path, npz_path, meta_path = self.artifact_paths(directory, self.version)
+        keys = list(self.leaves)
+        ivf = [self.leaves[key] for key in keys]
+        with_ivf = [leaf for leaf in ivf if leaf.centroids is not None]
+        dim = self.matrix.shape[1] if self.matrix.ndim == 2 else 0
+        # Write under temporary names so a concurrent loader never sees half a file.
+        np.save(npy_path + ".tmp.npy", self.matrix)
+        np.savez(
+            npz_path + ".tmp.npz",
+            bounds=np.asarray([(leaf.start, leaf.end) for leaf in ivf], dtype=np.int64).reshape(-1, 2),
+            n_clusters=np.asarray([0 if leaf.centroids is None else len(leaf.centroids) for leaf in ivf], dtype=np.int64),
+            centroids=np.concatenate([leaf.centroids for leaf in with_ivf]) if with_ivf else np.empty((0, dim), np.float32),
+            offsets=np.concatenate([leaf.offsets for leaf in with_ivf]) if with_ivf else np.empty(0, np.int64),
+        )
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"version": self.version, "keys": keys, "texts": self.texts, "metadatas": self.metadatas}, f, ensure_ascii=False)
+        os.replace(npy_path + ".tmp.npy", npy_path)
+        os.replace(npz_path + ".tmp.npz", npz_path)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    @classmethod
+    def load(cls, exemplars: list[dict], embeddings, directory: str, **options) -> "PartitionedExemplarIndex":
+        """Open the artifact for this exemplar bank, building it first if needed."""
+        version = index_version(exemplars, embeddings_model_name(embeddings))
+        npy_path, npz_path, meta_path = cls.artifact_paths(directory, version)
+        if not all(os.path.exists(p) for p in (npy_path, npz_path, meta_path)):
+            return cls.build(exemplars, embeddings, directory, **options)
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        # Each NpzFile lookup decompresses the whole array again, so read every array once.
+        with np.load(npz_path) as tables:
+            bounds, n_clusters, all_centroids, all_offsets = (
+                tables[name] for name in ("bounds", "n_clusters", "centroids", "offsets")
+            )
+        leaves, c_at, o_at = {}, 0, 0
+        for key, (start, end), n in zip(meta["keys"], bounds, n_clusters):
+            centroids = offsets = None
+            if n:
+                centroids = all_centroids[c_at:c_at + n]
+                offsets = all_offsets[o_at:o_at + n + 1]
+                c_at, o_at = c_at + n, o_at + n + 1
+            leaves[tuple(key)] = _Leaf(int(start), int(end), centroids, offsets)
+        matrix = np.load(npy_path, mmap_mode="r")
+        nprobe = options.get("nprobe", 8)
+        return cls(matrix, meta["texts"], meta["metadatas"], embeddings, leaves, version, nprobe)
+
+    # -------- search --------
+
+    def search_vector(self, vector, k: int, question=None, stratify: bool = False, nprobe: int = None) -> tuple[np.ndarray, np.ndarray]:
+        """Top-k (row indices, cosine scores), best first.
+
+        With ``question``, only that question's partition is searched. With
+        ``stratify``, the k results are spread across bands, best first
+        within each band.
+        """
+        query = _normalise(np.asarray(vector, dtype=np.float32).reshape(1, -1))[0]
+        nprobe = nprobe or self.nprobe
+        bands = self._by_question.get(question_key(question)) if question is not None else None
+        if not bands:
+            return self.exact_search(query, k)
+        hits = {band: leaf.search(self.matrix, query, k, nprobe) for band, leaf in bands.items()}
+        if stratify:
+            return _interleave(list(hits.values()), k)
+        rows = np.concatenate([r for r, _ in hits.values()])
+        scores = np.concatenate([s for _, s in hits.values()])
+        top = _top_k(scores, k)
+        return rows[top], scores[top]
+
+    def exact_search(self, vector, k: int, rows: slice = slice(None)) -> tuple[np.ndarray, np.ndarray]:
+        query = _normalise(np.asarray(vector, dtype=np.float32).reshape(1, -1))[0]
+        offset = rows.start or 0
+        scores = self.matrix[rows] @ query
+        top = _top_k(scores, k)
+        return top + offset, scores[top]
+
+    def _documents(self, indices) -> list[Document]:
+        return [Document(page_content=self.texts[i], metadata=self.metadatas[i]) for i in indices]
+
+    def similarity_search(self, query: str, k: int = 4, question=None, stratify: bool = False) -> list[Document]:
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k, question, stratify)
+
+    def similarity_search_by_vector(self, embedding, k: int = 4, question=None, stratify: bool = False) -> list[Document]:
+        indices, _ = self.search_vector(embedding, k, question, stratify)
+        return self._documents(indices)
+
+    def similarity_search_batch(self, queries: list[str], k: int = 4, questions: list = None, stratify: bool = False) -> list[list[Document]]:
+        vectors = self.embeddings.embed_documents(queries)
+        questions = questions or [None] * len(queries)
+        return [self.similarity_search_by_vector(v, k, q, stratify) for v, q in zip(vectors, questions)]
+
+
+def _interleave(hits: list, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """Round-robin over per-band results (each best first); bands with better top hits go first."""
+    hits = sorted((h for h in hits if len(h[0])), key=lambda h: -h[1][0])
+    rows, scores = [], []
+    for rank in range(k):
+        for band_rows, band_scores in hits:
+            if rank < len(band_rows) and len(rows) < k:
+                rows.append(band_rows[rank])
+                scores.append(band_scores[rank])
+    return np.asarray(rows, dtype=np.int64), np.asarray(scores, dtype=np.float32)
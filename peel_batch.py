@@ -0,0 +1,364 @@
+"""
+Headless batch grading.
+
+Reads submissions (student_id, question, answer) from a CSV or JSONL file,
+grades them concurrently and appends one JSON line per essay to the output
+file as soon as it is graded. Re-running with the same output file skips the
+essays that were already graded successfully.
+
+    python peel_batch.py essays.csv -o results.jsonl --concurrency 16
+    python peel_batch.py essays.jsonl -o results.jsonl --fake --fake-latency 0.5
+"""
+import argparse
+import asyncio
+import csv
+import hashlib
+import json
+import os
+import time
+
+import peel_core
+from peel_cache import EvaluationCache
+from peel_clients import client_stats
+from peel_dedup import find_duplicates
+from peel_ingest import extract_text, iter_submissions
+from peel_mapreduce import REDUCES, aevaluate_mapreduce
+from peel_ratelimit import RateLimitedChatModel, RateLimiter, limiter_stats
+from peel_results import ResultStore, record_trace
+from peel_screen import load_screener
+from peel_singleflight import SingleFlight
+from peel_trace import NULL_TRACE, JsonlTraceSink, Trace, Tracer
+
+
+# =========================
+#  INPUT / OUTPUT
+# =========================
+
+def read_submissions(path: str, question: str = None, stats: dict = None):
+    """Yield submission dicts from a .csv or .jsonl file, one row at a time.
+
+    Any other path (a .zip, a folder, or a single .txt/.html answer) goes
+    through peel_ingest, with ``question`` for answers that have no question
+    file next to them; files it skips are counted in ``stats``.
+    """
+    if not path.endswith((".csv", ".jsonl")):
+        yield from iter_submissions(path, question, stats)
+        return
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for row in rows:
+            yield {
+                "student_id": str(row["student_id"]),
+                "question": row["question"],
+                "answer": row["answer"],
+            }
+
+def read_question(value: str):
+    """``--question``: a .txt/.html file, or the question text itself."""
+    if value and os.path.isfile(value):
+        with open(value, "rb") as f:
+            return extract_text(f, value)
+    return value
+
+def submission_key(submission: dict) -> str:
+    # A student can appear once per question, so the question is part of the key.
+    question_hash = hashlib.sha256(submission["question"].encode("utf-8")).hexdigest()[:12]
+    return f"{submission['student_id']}:{question_hash}"
+
+def load_finished(output_path: str) -> set:
+    """Keys of rows already graded without error in a previous run."""
+    finished = set()
+    if not os.path.exists(output_path):
+        return finished
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A run killed mid-write can leave a truncated last line.
+                continue
+            if not record.get("error"):
+                finished.add(record["key"])
+    return finished
+
+def plan_duplicates(submissions: list, threshold: float) -> dict:
+    """Group near-duplicate answers to the same question.
+
+    Returns ``{leader key: [(submission, similarity), ...]}``; the members
+    reuse their leader's evaluation and are left out of the grading queue.
+    """
+    duplicates = find_duplicates([s["answer"] for s in submissions], [s["question"] for s in submissions], threshold)
+    clusters = {}
+    for member, (leader, score) in duplicates.items():
+        clusters.setdefault(submission_key(submissions[leader]), []).append((submissions[member], score))
+    return clusters
+
+def duplicate_record(leader: dict, submission: dict, similarity: float) -> dict:
+    record = dict(leader, key=submission_key(submission), student_id=submission["student_id"], elapsed_s=0.0)
+    record.pop("duplicates", None)
+    record["duplicate_of"] = leader["key"]
+    record["similarity"] = similarity
+    return record
+
+
+# =========================
+#  PIPELINE
+# =========================
+
+async def grade_one(submission: dict, llm, vectorstore, k_examples: int, cache=None, tracer=None, policy=None, singleflight=None, samples: int = 1, ensemble_llms=None, screening=None, results=None, map_reduce: str = None, template: str = None) -> dict:
+    """Grade one submission and return its output record.
+
+    ``template`` is a complete prompt with {question} and {student_answer}
+    (e.g. peel_core.ZERO_SHOT_PEEL_PROMPT); with it, no exemplars are
+    retrieved, so the mark matches an app that grades with that prompt.
+    """
+    started = time.perf_counter()
+    trace = NULL_TRACE
+    if tracer is not None:
+        trace = tracer.start("evaluate", app="peel_batch", student_id=submission["student_id"])
+    if results is not None and not trace.enabled:
+        # Spans and token usage for the results store, without writing a trace.
+        trace = Trace("evaluate", app="peel_batch", student_id=submission["student_id"])
+    record = {
+        "key": submission_key(submission),
+        "student_id": submission["student_id"],
+        "question": submission["question"],
+    }
+    try:
+        if template is not None:
+            final_prompt = template.format(question=submission["question"], student_answer=submission["answer"])
+            docs_used = []
+            if samples > 1:
+                result = await peel_core.ainvoke_ensemble(ensemble_llms or llm, final_prompt, samples, trace)
+                feedback = result.feedback
+                record.update(result.summary())
+            else:
+                feedback = await peel_core.ainvoke_llm(llm, final_prompt, cache, trace, policy, singleflight)
+                record["score"] = peel_core.parse_score(feedback)
+        elif samples > 1:
+            result, docs_used = await peel_core.aevaluate_ensemble(
+                submission["question"], submission["answer"], ensemble_llms or llm, vectorstore, k_examples, samples, trace,
+                screening,
+            )
+            feedback = result.feedback
+            record.update(result.summary())
+        elif map_reduce:
+            result, docs_used = await aevaluate_mapreduce(
+                submission["question"], submission["answer"], llm, vectorstore, k_examples, map_reduce, cache, trace,
+                screening,
+            )
+            feedback = result.feedback
+            record.update(result.summary())
+        else:
+            feedback, docs_used = await peel_core.aevaluate_answer(
+                submission["question"], submission["answer"], llm, vectorstore, k_examples, cache, trace, policy, singleflight,
+                screening,
+            )
+            record["score"] = peel_core.parse_score(feedback)
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    else:
+        record["feedback"] = feedback
+        record["examples"] = [d.metadata.get("label") for d in docs_used]
+    record["elapsed_s"] = round(time.perf_counter() - started, 3)
+    finished = trace.finish()
+    if "error" not in record:
+        model, temperature = peel_core.llm_identity(llm)
+        record_trace(
+            results, finished, app="peel_batch", model=model, temperature=temperature,
+            k_examples=0 if template is not None else k_examples,
+            docs=docs_used, score=record.get("score"), student_id=submission["student_id"],
+        )
+    return record
+
+async def run_batch(submissions, output_path: str, llm, vectorstore, k_examples: int = 3, concurrency: int = 8, cache=None, tracer=None, policy=None, singleflight=None, samples: int = 1, ensemble_llms=None, screening=None, dedup: float = None, progress=None, results=None, map_reduce: str = None, template: str = None) -> dict:
+    """Grade ``submissions`` with at most ``concurrency`` evaluations in flight.
+
+    Submissions are pulled from a bounded queue, so the input can be an
+    arbitrarily large iterator. With ``samples`` > 1 each essay is graded by
+    an ensemble (round-robin over ``ensemble_llms``, default ``llm``) and
+    ``concurrency`` counts essays, not model calls. With ``screening`` (a
+    peel_screen.Screener), rejected essays are recorded as errors and
+    screener-marked ones need no model call.
+
+    With ``dedup`` (a MinHash similarity threshold), the pending submissions
+    are read into memory first and clustered. One essay per cluster is graded;
+    the others are written right after it with its result, ``duplicate_of``
+    and ``similarity``, and counted as ``duplicates``.
+
+    With ``map_reduce`` ("model" or "local"), long essays are graded
+    paragraph by paragraph (peel_mapreduce) and ``concurrency`` still counts
+    essays. With ``template``, every essay is graded with that prompt and no
+    exemplars (see grade_one).
+
+    ``progress``, if given, is called with the running stats after each essay.
+    Graded essays are added to ``results`` (a peel_results.ResultStore),
+    which is flushed when the batch ends.
+    """
+    finished = load_finished(output_path)
+    stats = {"graded": 0, "skipped": 0, "errors": 0}
+    clusters = {}
+    if dedup is not None:
+        pending = []
+        for submission in submissions:
+            if submission_key(submission) in finished:
+                stats["skipped"] += 1
+            else:
+                pending.append(submission)
+        clusters = plan_duplicates(pending, dedup)
+        members = {submission_key(m) for group in clusters.values() for m, _ in group}
+        submissions = [s for s in pending if submission_key(s) not in members]
+        stats["duplicates"] = len(members)
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    with open(output_path, "a", encoding="utf-8") as out:
+
+        async def worker():
+            while True:
+                submission = await queue.get()
+                if submission is None:
+                    return
+                record = await grade_one(
+                    submission, llm, vectorstore, k_examples, cache, tracer, policy, singleflight, samples, ensemble_llms,
+                    screening, results, map_reduce, template,
+                )
+                group = clusters.get(record["key"], ())
+                if group:
+                    record["duplicates"] = len(group)
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                for member, score in group:
+                    out.write(json.dumps(duplicate_record(record, member, score), ensure_ascii=False) + "\n")
+                out.flush()
+                stats["errors" if "error" in record else "graded"] += 1
+                if progress is not None:
+                    progress(stats)
+
+        workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+        for submission in submissions:
+            if submission_key(submission) in finished:
+                stats["skipped"] += 1
+                continue
+            await queue.put(submission)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+
+    if results is not None:
+        results.flush()
+    return stats
+
+
+# =========================
+#  CLI
+# =========================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Grade a file of PEEL essays.")
+    parser.add_argument("input", help="CSV or JSONL file with student_id, question, answer; or a .zip, folder or .txt/.html of answers")
+    parser.add_argument("--question", help="question file or text for answers without a question file beside them")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="JSONL results file (appended to)")
+    parser.add_argument("--model", default="gpt-5")
+    parser.add_argument("--temperature", type=float, default=0.0)
+    parser.add_argument("--k", type=int, default=3, help="number of exemplars per prompt")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--retriever", choices=["chroma", "numpy", "ivf"], default=None, help="exemplar retriever backend")
+    parser.add_argument("--no-cache", action="store_true", help="always call the model")
+    parser.add_argument("--cache-sampled", action="store_true", help="also cache evaluations at temperature > 0")
+    parser.add_argument("--first-token-timeout", type=float, help="send a backup request after this many seconds without a first token")
+    parser.add_argument("--fallback-model", help="model for the backup request (default: hedge to the same model)")
+    parser.add_argument("--deadline", type=float, default=120.0, help="per-essay deadline when a backup policy is set")
+    parser.add_argument("--samples", type=int, default=1, help="grade each essay N times in parallel and keep the median score")
+    parser.add_argument("--ensemble-models", help="comma-separated extra models to spread the samples across")
+    parser.add_argument("--map-reduce", choices=REDUCES, nargs="?", const="local", help="mark long essays paragraph by paragraph in parallel, then score them locally (default, fastest) or with a model call (slower than a single call, but calibrated against the exemplars)")
+    parser.add_argument("--tpm", type=float, help="pace requests to this many tokens per minute (default: PEEL_TPM)")
+    parser.add_argument("--rpm", type=float, help="pace requests to this many requests per minute (default: PEEL_RPM)")
+    parser.add_argument("--dedup", type=float, nargs="?", const=0.7, help="grade one essay per cluster of near-duplicates at this similarity (default 0.7)")
+    parser.add_argument("--screen", action="store_true", help="pre-screen essays locally (rules from PEEL_SCREEN_RULES or the defaults)")
+    parser.add_argument("--trace", action="store_true", help="write per-stage spans to <data dir>/traces.jsonl")
+    parser.add_argument("--no-results", action="store_true", help="do not record evaluations in <data dir>/results.sqlite")
+    parser.add_argument("--fake", action="store_true", help="use local fake models (no network)")
+    parser.add_argument("--fake-latency", type=float, default=0.5, help="seconds per fake completion")
+    args = parser.parse_args(argv)
+
+    limiter = None
+    if args.tpm or args.rpm:
+        limiter = RateLimiter(args.tpm, args.rpm, max_concurrency=args.concurrency, name=args.model)
+
+    fallback_llm = None
+    extra_models = [m for m in (args.ensemble_models or "").split(",") if m]
+    if args.fake:
+        from peel_fakes import FakeGradingChatModel, fake_embeddings
+
+        llm = FakeGradingChatModel(temperature=args.temperature, latency=args.fake_latency, first_token_latency=args.fake_latency)
+        if limiter is not None:
+            llm = RateLimitedChatModel.wrap(llm, limiter)
+        vectorstore = peel_core.build_vectorstore(peel_core.build_embeddings(fake_embeddings()), args.retriever)
+        if args.fallback_model:
+            fallback_llm = FakeGradingChatModel(model_name=args.fallback_model, temperature=args.temperature)
+        extra_llms = [
+            FakeGradingChatModel(model_name=m, temperature=args.temperature, latency=args.fake_latency)
+            for m in extra_models
+        ]
+    else:
+        llm = peel_core.build_llm(args.model, args.temperature, limiter)
+        vectorstore = peel_core.build_vectorstore(backend=args.retriever)
+        if args.fallback_model:
+            fallback_llm = peel_core.build_llm(args.fallback_model, args.temperature)
+        extra_llms = [peel_core.build_llm(m, args.temperature) for m in extra_models]
+
+    policy = None
+    if args.first_token_timeout is not None:
+        from peel_policy import ExecutionPolicy
+
+        policy = ExecutionPolicy(args.first_token_timeout, args.deadline, fallback_llm)
+
+    cache = None
+    if not args.no_cache:
+        cache = EvaluationCache(peel_core.data_path("eval_cache.sqlite"), cache_sampled=args.cache_sampled)
+
+    tracer = Tracer(JsonlTraceSink(peel_core.data_path("traces.jsonl")), enabled=args.trace or None)
+    # Duplicate submissions in flight together share one model call.
+    singleflight = SingleFlight()
+    screening = load_screener() if args.screen else None
+    results = None if args.no_results else ResultStore(peel_core.data_path("results.sqlite"), flush_every=500)
+
+    ingest = {}
+    started = time.perf_counter()
+    stats = asyncio.run(run_batch(
+        read_submissions(args.input, read_question(args.question), ingest), args.output, llm, vectorstore,
+        k_examples=args.k, concurrency=args.concurrency, cache=cache, tracer=tracer, policy=policy,
+        singleflight=singleflight, samples=args.samples, ensemble_llms=[llm, *extra_llms], screening=screening,
+        dedup=args.dedup, results=results, map_reduce=args.map_reduce,
+    ))
+    elapsed = time.perf_counter() - started
+    rate = stats["graded"] / elapsed if elapsed else 0.0
+    print(
+        f"graded={stats['graded']} skipped={stats['skipped']} errors={stats['errors']} "
+        f"elapsed={elapsed:.1f}s throughput={rate:.1f} essays/s"
+    )
+    if ingest:
+        print("ingest: " + " ".join(f"{k}={v}" for k, v in ingest.items()))
+    if args.dedup is not None:
+        print(f"near-duplicates: {stats['duplicates']} essays reused an evaluation")
+    if policy is not None:
+        print(f"policy: {policy.stats.summary()}")
+    if cache is not None:
+        print("cache: " + " ".join(f"{k}={v}" for k, v in cache.stats().items()))
+    print("single-flight: " + " ".join(f"{k}={v}" for k, v in singleflight.stats().items()))
+    if screening is not None:
+        print("screening: " + " ".join(f"{k}={v}" for k, v in screening.stats().items()))
+    http = client_stats()
+    if http.get("requests"):
+        print("http: " + " ".join(f"{k}={v}" for k, v in http.items()))
+    limiters = limiter_stats()
+    if limiter is not None:
+        limiters[f"chat:{args.model}"] = limiter.stats()
+    for name, stats in limiters.items():
+        print(f"rate limit {name}: " + " ".join(f"{k}={v}" for k, v in stats.items()))
+
+
+if __name__ == "__main__":
+    main()
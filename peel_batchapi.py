@@ -0,0 +1,416 @@
+"""
+Offline grading through the OpenAI Batch API.
+
+For end-of-term runs where cost and throughput matter more than latency:
+batch requests are billed at half price, do not count against the live
+rate limits and complete within 24 hours. Each step can be re-run safely:
+
+    python peel_batchapi.py prepare essays.csv -d runs/term1 --model gpt-5
+    python peel_batchapi.py submit -d runs/term1
+    python peel_batchapi.py status -d runs/term1
+    python peel_batchapi.py collect -d runs/term1 -o results.jsonl
+
+``prepare`` retrieves exemplars and formats each prompt exactly as the apps
+do, then writes Batch-API request files (requests-0000.jsonl, ...). A new
+file is started before one would go over ``--max-requests`` lines or
+``--max-bytes``. The ``custom_id`` is peel_batch's submission key, so the
+collected results have the same format and resume logic as peel_batch output.
+``submit`` uploads each file and creates its batch, saving the file and
+batch ids to ``manifest.json`` after every step, so an interrupted submit
+never sends a file twice. ``collect`` downloads the output and error files of
+finished batches and appends one record per essay. Failed or expired requests
+are written as errors; ``prepare --skip results.jsonl`` then builds a
+follow-up run with only those essays. With ``prepare --screen``, essays the
+pre-screening rules reject or mark are never sent; their records are kept in
+``screened.jsonl`` and written out by the first ``collect``.
+
+Add ``--local`` to every step to run against peel_fakes.LocalBatchClient,
+which writes result files on disk instead of calling the API.
+"""
+import argparse
+import json
+import os
+import time
+
+import peel_core
+from peel_batch import load_finished, read_question, read_submissions, submission_key
+from peel_screen import EssayRejected, load_screener
+
+ENDPOINT = "/v1/chat/completions"
+MAX_REQUESTS = 50_000  # Batch API per-file limits
+MAX_BYTES = 200 * 2**20
+TERMINAL = ("completed", "failed", "expired", "cancelled")
+
+
+# =========================
+#  BATCH CLIENTS
+# =========================
+
+class OpenAIBatchClient:
+    def __init__(self, client=None):
+        if client is None:
+            from openai import OpenAI
+
+            client = OpenAI()
+        self.client = client
+
+    def upload(self, path: str) -> str:
+        with open(path, "rb") as f:
+            return self.client.files.create(file=f, purpose="batch").id
+
+    def create(self, input_file_id: str, endpoint: str, metadata: dict = None) -> dict:
+        batch = self.client.batches.create(
+            input_file_id=input_file_id, endpoint=endpoint, completion_window="24h", metadata=metadata
+        )
+        return batch.model_dump()
+
+    def retrieve(self, batch_id: str) -> dict:
+        return self.client.batches.retrieve(batch_id).model_dump()
+
+    def download(self, file_id: str, path: str):
+        self.client.files.content(file_id).write_to_file(path)
+
+
+# =========================
+#  PREPARE
+# =========================
+
+class RequestFileWriter:
+    """Writes request lines into numbered files under both per-file limits."""
+
+    def __init__(self, directory: str, max_requests: int = MAX_REQUESTS, max_bytes: int = MAX_BYTES):
+        self.directory = directory
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.files = []
+        self._file = None
+
+    def add(self, line: bytes) -> str:
+        """Append one request line; returns the name of the file it went into."""
+        if len(line) > self.max_bytes:
+            raise ValueError(f"A single request is {len(line)} bytes, over the {self.max_bytes}-byte file limit")
+        current = self.files[-1] if self._file else None
+        if current and (current["requests"] + 1 > self.max_requests or current["bytes"] + len(line) > self.max_bytes):
+            self._close()
+            current = None
+        if current is None:
+            current = {"name": f"requests-{len(self.files):04d}.jsonl", "requests": 0, "bytes": 0}
+            self.files.append(current)
+            self._file = open(os.path.join(self.directory, current["name"]), "wb")
+        self._file.write(line)
+        current["requests"] += 1
+        current["bytes"] += len(line)
+        return current["name"]
+
+    def _close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def close(self) -> list[dict]:
+        self._close()
+        return self.files
+
+
+def manifest_path(directory: str) -> str:
+    return os.path.join(directory, "manifest.json")
+
+def load_manifest(directory: str) -> dict:
+    with open(manifest_path(directory), encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(directory: str, manifest: dict):
+    path = manifest_path(directory)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def request_line(custom_id: str, model: str, prompt: str, temperature: float = None) -> bytes:
+    body = {"model": model, "messages": [{"role": "user", "content": prompt}]}
+    if temperature is not None:
+        body["temperature"] = temperature
+    line = {"custom_id": custom_id, "method": "POST", "url": ENDPOINT, "body": body}
+    return (json.dumps(line, ensure_ascii=False) + "\n").encode("utf-8")
+
+def prepare(submissions, directory: str, vectorstore, model: str, temperature: float = None, k_examples: int = 3, max_requests: int = MAX_REQUESTS, max_bytes: int = MAX_BYTES, skip: set = frozenset(), chunk: int = 256, screening=None) -> dict:
+    """Write request files and the manifest for ``submissions``; returns the manifest.
+
+    Retrieval runs ``chunk`` essays at a time, so the input can be an
+    arbitrarily large iterator. Essays whose key is in ``skip`` and repeated
+    keys are left out. ``screening`` is an optional peel_screen.Screener.
+    """
+    if os.path.exists(manifest_path(directory)):
+        raise FileExistsError(f"{directory} already has a manifest; use a new directory for a new run")
+    os.makedirs(directory, exist_ok=True)
+    writer = RequestFileWriter(directory, max_requests, max_bytes)
+    seen = set(skip)
+    stats = {"requests": 0, "skipped": 0, "screened": 0}
+
+    with open(os.path.join(directory, "submissions.jsonl"), "w", encoding="utf-8") as index, \
+            open(os.path.join(directory, "screened.jsonl"), "w", encoding="utf-8") as screened:
+
+        def screen(submission):
+            """The submission's Verdict, or None after recording a screened-out result."""
+            record = {"key": submission_key(submission), "student_id": submission["student_id"], "question": submission["question"]}
+            try:
+                verdict = peel_core.screen_answer(screening, submission["question"], submission["answer"])
+            except EssayRejected as e:
+                record["error"] = f"{type(e).__name__}: {e}"
+            else:
+                if verdict is None or verdict.feedback is None:
+                    return verdict
+                record.update(model="screen", score=verdict.score, feedback=verdict.feedback, examples=[])
+            screened.write(json.dumps(record, ensure_ascii=False) + "\n")
+            stats["screened"] += 1
+            return None
+
+        def flush(pending):
+            verdicts = [screen(s) for s in pending] if screening is not None else [None] * len(pending)
+            keep = [i for i, v in enumerate(verdicts) if screening is None or v is not None]
+            pending, verdicts = [pending[i] for i in keep], [verdicts[i] for i in keep]
+            if not pending:
+                return
+            selected = peel_core.select_examples_batch(
+                vectorstore, [s["answer"] for s in pending], k_examples, [s["question"] for s in pending]
+            )
+            for submission, verdict, (examples_text, docs) in zip(pending, verdicts, selected):
+                key = submission_key(submission)
+                notes = verdict.note if verdict is not None else ""
+                prompt = peel_core.format_prompt(examples_text, submission["question"], submission["answer"], notes)
+                name = writer.add(request_line(key, model, prompt, temperature))
+                index.write(json.dumps({
+                    "key": key, "file": name, "student_id": submission["student_id"], "question": submission["question"],
+                    "examples": [d.metadata.get("label") for d in docs],
+                }, ensure_ascii=False) + "\n")
+                stats["requests"] += 1
+
+        pending = []
+        for submission in submissions:
+            key = submission_key(submission)
+            if key in seen:
+                stats["skipped"] += 1
+                continue
+            seen.add(key)
+            pending.append(submission)
+            if len(pending) >= chunk:
+                flush(pending)
+                pending = []
+        if pending:
+            flush(pending)
+
+    manifest = {
+        "model": model, "temperature": temperature, "k_examples": k_examples, "endpoint": ENDPOINT,
+        "created_at": time.time(), "stats": stats, "files": writer.close(),
+    }
+    save_manifest(directory, manifest)
+    return manifest
+
+
+# =========================
+#  SUBMIT & TRACK
+# =========================
+
+def submit(directory: str, client) -> dict:
+    """Upload and create a batch for every file that does not have one yet."""
+    manifest = load_manifest(directory)
+    for entry in manifest["files"]:
+        if entry.get("batch_id"):
+            continue
+        if not entry.get("input_file_id"):
+            entry["input_file_id"] = client.upload(os.path.join(directory, entry["name"]))
+            save_manifest(directory, manifest)
+        batch = client.create(entry["input_file_id"], manifest["endpoint"], {"peel_file": entry["name"]})
+        entry.update(batch_id=batch["id"], status=batch["status"])
+        save_manifest(directory, manifest)
+    return manifest
+
+def refresh(directory: str, client) -> dict:
+    """Update each batch's status, request counts and result file ids."""
+    manifest = load_manifest(directory)
+    for entry in manifest["files"]:
+        if not entry.get("batch_id") or entry.get("status") in TERMINAL:
+            continue
+        batch = client.retrieve(entry["batch_id"])
+        entry.update(
+            status=batch["status"], request_counts=batch.get("request_counts"),
+            output_file_id=batch.get("output_file_id"), error_file_id=batch.get("error_file_id"),
+        )
+    save_manifest(directory, manifest)
+    return manifest
+
+
+# =========================
+#  COLLECT
+# =========================
+
+def parse_result(result: dict) -> dict:
+    """Feedback, score and usage, or an error, from one Batch-API result line."""
+    response = result.get("response") or {}
+    body = response.get("body") or {}
+    if result.get("error"):
+        error = result["error"]
+        return {"error": f"{error.get('code')}: {error.get('message')}"}
+    if response.get("status_code") != 200:
+        message = (body.get("error") or {}).get("message")
+        return {"error": f"HTTP {response.get('status_code')}: {message}"}
+    feedback = body["choices"][0]["message"]["content"] or ""
+    usage = body.get("usage") or {}
+    return {
+        "score": peel_core.parse_score(feedback),
+        "feedback": feedback,
+        "usage": {"input_tokens": usage.get("prompt_tokens"), "output_tokens": usage.get("completion_tokens")},
+    }
+
+def _results(path: str):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def collect(directory: str, client, output_path: str) -> dict:
+    """Append a record per essay of every finished, not yet collected batch to ``output_path``.
+
+    Essays already graded in ``output_path`` are not written again. Requests
+    missing from a finished batch's results (expired or cancelled batches, a
+    failed validation) are recorded as errors.
+    """
+    manifest = refresh(directory, client)
+    finished = load_finished(output_path)
+    ready = [e for e in manifest["files"] if e.get("status") in TERMINAL and not e.get("collected")]
+    stats = {"graded": 0, "errors": 0, "skipped": 0, "pending": sum(
+        e["requests"] for e in manifest["files"] if e.get("status") not in TERMINAL
+    )}
+
+    screened_path = os.path.join(directory, "screened.jsonl")
+    if manifest["stats"].get("screened") and not manifest.get("screened_collected"):
+        with open(output_path, "a", encoding="utf-8") as out:
+            for record in _results(screened_path):
+                if record["key"] in finished:
+                    stats["skipped"] += 1
+                    continue
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                stats["errors" if "error" in record else "graded"] += 1
+        manifest["screened_collected"] = True
+        save_manifest(directory, manifest)
+    if not ready:
+        return stats
+
+    names = {e["name"] for e in ready}
+    submissions = {}
+    for row in _results(os.path.join(directory, "submissions.jsonl")):
+        if row["file"] in names:
+            submissions[row["key"]] = row
+
+    with open(output_path, "a", encoding="utf-8") as out:
+        for entry in ready:
+            outcomes = {}
+            for kind in ("output", "error"):
+                file_id = entry.get(f"{kind}_file_id")
+                if not file_id:
+                    continue
+                path = os.path.join(directory, entry["name"].replace("requests-", f"{kind}s-"))
+                client.download(file_id, path)
+                for result in _results(path):
+                    outcomes[result["custom_id"]] = parse_result(result)
+
+            for key, row in submissions.items():
+                if row["file"] != entry["name"]:
+                    continue
+                if key in finished:
+                    stats["skipped"] += 1
+                    continue
+                outcome = outcomes.get(key) or {"error": f"no result (batch {entry['status']})"}
+                record = {
+                    "key": key, "student_id": row["student_id"], "question": row["question"],
+                    "model": manifest["model"], "batch_id": entry["batch_id"], **outcome,
+                }
+                if "error" not in outcome:
+                    record["examples"] = row["examples"]
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                stats["errors" if "error" in outcome else "graded"] += 1
+            out.flush()
+            entry["collected"] = True
+            save_manifest(directory, manifest)
+    return stats
+
+
+# =========================
+#  CLI
+# =========================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Grade PEEL essays offline through the OpenAI Batch API.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    prep = commands.add_parser("prepare", help="write request files for a CSV/JSONL of essays")
+    prep.add_argument("input", help="CSV or JSONL file with student_id, question, answer; or a .zip, folder or .txt/.html of answers")
+    prep.add_argument("--question", help="question file or text for answers without a question file beside them")
+    prep.add_argument("--model", default="gpt-5")
+    prep.add_argument("--temperature", type=float, help="omit to use the model default")
+    prep.add_argument("--k", type=int, default=3, help="number of exemplars per prompt")
+    prep.add_argument("--retriever", choices=["chroma", "numpy", "ivf"], default=None, help="exemplar retriever backend")
+    prep.add_argument("--max-requests", type=int, default=MAX_REQUESTS, help="requests per file")
+    prep.add_argument("--max-bytes", type=int, default=MAX_BYTES, help="bytes per file")
+    prep.add_argument("--skip", help="results file whose successfully graded essays are left out")
+    prep.add_argument("--screen", action="store_true", help="pre-screen essays locally (rules from PEEL_SCREEN_RULES or the defaults)")
+    prep.add_argument("--fake", action="store_true", help="retrieve with local fake embeddings (no network)")
+
+    for name, description in (("submit", "upload files and create batches"), ("status", "show batch progress"), ("collect", "ingest finished results")):
+        command = commands.add_parser(name, help=description)
+        if name == "collect":
+            command.add_argument("-o", "--output", default="results.jsonl", help="JSONL results file (appended to)")
+            command.add_argument("--wait", type=float, help="poll every N seconds until every batch has finished")
+    for command in commands.choices.values():
+        command.add_argument("-d", "--dir", required=True, help="run directory")
+        command.add_argument("--local", action="store_true", help="use the on-disk stand-in instead of the API")
+    args = parser.parse_args(argv)
+
+    from dotenv import find_dotenv, load_dotenv
+
+    load_dotenv(find_dotenv())
+    if args.command == "prepare":
+        embeddings = None
+        if args.fake:
+            from peel_fakes import fake_embeddings
+
+            embeddings = peel_core.build_embeddings(fake_embeddings())
+        vectorstore = peel_core.build_vectorstore(embeddings, args.retriever)
+        skip = load_finished(args.skip) if args.skip else frozenset()
+        manifest = prepare(
+            read_submissions(args.input, read_question(args.question)), args.dir, vectorstore, args.model, args.temperature, args.k,
+            args.max_requests, args.max_bytes, skip, screening=load_screener() if args.screen else None,
+        )
+        stats = manifest["stats"]
+        print(
+            f"{stats['requests']} requests in {len(manifest['files'])} files "
+            f"(skipped {stats['skipped']}, screened {stats['screened']}) under {args.dir}"
+        )
+        return
+
+    if args.local:
+        from peel_fakes import LocalBatchClient
+
+        client = LocalBatchClient(os.path.join(args.dir, "local-api"))
+    else:
+        client = OpenAIBatchClient()
+
+    if args.command == "submit":
+        manifest = submit(args.dir, client)
+        for entry in manifest["files"]:
+            print(f"{entry['name']}: {entry['requests']} requests -> {entry['batch_id']} ({entry['status']})")
+    elif args.command == "status":
+        for entry in refresh(args.dir, client)["files"]:
+            counts = entry.get("request_counts") or {}
+            done = "collected" if entry.get("collected") else entry.get("status", "not submitted")
+            print(f"{entry['name']}: {entry.get('batch_id', '-')} {done} {counts.get('completed', 0)}/{entry['requests']} done, {counts.get('failed', 0)} failed")
+    else:
+        while True:
+            stats = collect(args.dir, client, args.output)
+            print(" ".join(f"{k}={v}" for k, v in stats.items()), flush=True)
+            if not args.wait or not stats["pending"]:
+                break
+            time.sleep(args.wait)
+
+
+if __name__ == "__main__":
+    main()
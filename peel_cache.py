@@ -0,0 +1,109 @@
+"""
+Persistent cache of LLM evaluations.
+
+Entries are keyed by model name, temperature and a hash of the fully formatted
+prompt, so any change to the rubric, exemplars, question or answer is a miss.
+Sampled outputs (temperature > 0) are not cached unless asked for.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+def evaluation_key(model: str, temperature: float, prompt_text: str) -> str:
+    prompt_hash = hashlib.sha256(prompt_text.encode("utf-8")).hexdigest()
+    return f"{model}|{temperature:g}|{prompt_hash}"
+
+
+class EvaluationCache:
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 10_000,
+        max_age_s: float = 30 * 24 * 3600,
+        cache_sampled: bool = False,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_s = max_age_s
+        self.cache_sampled = cache_sampled
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS evaluations (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                temperature REAL NOT NULL,
+                feedback TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_evaluations_last_used ON evaluations(last_used_at)")
+        self._conn.commit()
+
+    def enabled_for(self, temperature: float) -> bool:
+        return temperature == 0 or self.cache_sampled
+
+    def get(self, model: str, temperature: float, prompt_text: str):
+        if not self.enabled_for(temperature):
+            self.bypassed += 1
+            return None
+        key = evaluation_key(model, temperature, prompt_text)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT feedback, created_at FROM evaluations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.max_age_s:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE evaluations SET last_used_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return row[0]
+
+    def put(self, model: str, temperature: float, prompt_text: str, feedback: str):
+        if not self.enabled_for(temperature):
+            return
+        key = evaluation_key(model, temperature, prompt_text)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO evaluations VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, temperature, feedback, now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        self._conn.execute("DELETE FROM evaluations WHERE created_at < ?", (now - self.max_age_s,))
+        # Least recently used entries go first once the cache is over its size cap.
+        self._conn.execute(
+            """
+            DELETE FROM evaluations WHERE key IN (
+                SELECT key FROM evaluations ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_entries,),
+        )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM evaluations")
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM evaluations").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "bypassed": self.bypassed, "entries": entries}
@@ -0,0 +1,162 @@
+"""
+Shared HTTP connection pool and a bounded cache of model clients.
+
+Every ChatOpenAI and OpenAIEmbeddings client built by peel_core sends its
+requests through one HTTPPool. Keep-alive connections to the API are reused
+across models, temperatures and the embedding client, instead of each
+client opening its own and paying the TCP and TLS handshakes again.
+
+Async requests go to a separate httpx.AsyncClient for each event loop, as
+an httpx async connection can only be used on the loop that opened it.
+That lets clients be shared between asyncio.run() calls, worker threads
+and Streamlit reruns. Clients whose loop has closed are dropped.
+
+ClientCache keeps the most recently used clients (PEEL_CLIENT_CACHE, default
+16) and evicts the rest, so a long-running server that sees many
+model/temperature combinations does not keep every client it ever built.
+
+    PEEL_HTTP_MAX_CONNECTIONS   connection cap for the pool (default 100)
+    PEEL_HTTP_KEEPALIVE         seconds an idle connection is kept (default 60)
+"""
+import asyncio
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+import httpx
+
+# The OpenAI SDK's default; requests override it with their own timeout.
+DEFAULT_TIMEOUT = httpx.Timeout(600.0, connect=5.0)
+
+
+class HTTPPool:
+    """One keep-alive pool shared by every sync client, and one per event loop for async ones."""
+
+    def __init__(self, max_connections: int = 100, max_keepalive: int = None, keepalive_expiry: float = 60.0):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive if max_keepalive is not None else max_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.counts = {"requests": 0, "connections": 0, "tls_handshakes": 0}
+        self._lock = threading.Lock()
+        self.sync = httpx.Client(limits=self.limits, timeout=DEFAULT_TIMEOUT, event_hooks={"request": [self._on_request]})
+        self.async_client = _LoopLocalAsyncClient(self)
+        self._async = weakref.WeakKeyDictionary()
+
+    def _count(self, event: str):
+        key = {"connection.connect_tcp.complete": "connections", "connection.start_tls.complete": "tls_handshakes"}.get(event)
+        if key is not None:
+            with self._lock:
+                self.counts[key] += 1
+
+    def _trace(self, event: str, info: dict):
+        self._count(event)
+
+    async def _atrace(self, event: str, info: dict):
+        self._count(event)
+
+    def _on_request(self, request: httpx.Request):
+        request.extensions["trace"] = self._trace
+        with self._lock:
+            self.counts["requests"] += 1
+
+    async def _aon_request(self, request: httpx.Request):
+        request.extensions["trace"] = self._atrace
+        with self._lock:
+            self.counts["requests"] += 1
+
+    def client_for_loop(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async.get(loop)
+            if client is None:
+                for closed in [l for l in self._async if l.is_closed()]:
+                    del self._async[closed]
+                client = httpx.AsyncClient(limits=self.limits, timeout=DEFAULT_TIMEOUT, event_hooks={"request": [self._aon_request]})
+                self._async[loop] = client
+            return client
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self.counts)
+            clients = [self.sync, *self._async.values()]
+        counts["reused"] = max(0, counts["requests"] - counts["connections"])
+        counts["open"] = sum(len(getattr(getattr(c._transport, "_pool", None), "connections", ())) for c in clients)
+        counts["event_loops"] = len(clients) - 1
+        return counts
+
+    def close(self):
+        self.sync.close()
+
+
+class _LoopLocalAsyncClient(httpx.AsyncClient):
+    """What the OpenAI SDK sees as its AsyncClient; sends on the pool's client for the running loop."""
+
+    def __init__(self, pool: HTTPPool):
+        super().__init__(limits=pool.limits, timeout=DEFAULT_TIMEOUT)
+        self._http_pool = pool
+
+    async def send(self, request: httpx.Request, **kwargs) -> httpx.Response:
+        return await self._http_pool.client_for_loop().send(request, **kwargs)
+
+
+class ClientCache:
+    """Least-recently-used cache of built clients, at most ``max_size`` of them."""
+
+    def __init__(self, max_size: int = 16):
+        self.max_size = max_size
+        self.counts = {"hits": 0, "misses": 0, "evictions": 0}
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, build):
+        with self._lock:
+            if key in self._clients:
+                self._clients.move_to_end(key)
+                self.counts["hits"] += 1
+                return self._clients[key]
+            self.counts["misses"] += 1
+        client = build()
+        with self._lock:
+            # Another thread may have built the same client meanwhile; keep the first.
+            client = self._clients.setdefault(key, client)
+            self._clients.move_to_end(key)
+            while len(self._clients) > self.max_size:
+                self._clients.popitem(last=False)
+                self.counts["evictions"] += 1
+        return client
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"cached": len(self._clients), **self.counts}
+
+
+_pool = None
+_pool_lock = threading.Lock()
+clients = ClientCache(int(os.environ.get("PEEL_CLIENT_CACHE", "16")))
+
+
+def http_pool() -> HTTPPool:
+    """The process-wide pool, created on first use from the PEEL_HTTP_* settings."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = HTTPPool(
+                max_connections=int(os.environ.get("PEEL_HTTP_MAX_CONNECTIONS", "100")),
+                keepalive_expiry=float(os.environ.get("PEEL_HTTP_KEEPALIVE", "60")),
+            )
+        return _pool
+
+def client_kwargs() -> dict:
+    """``http_client`` / ``http_async_client`` arguments for ChatOpenAI and OpenAIEmbeddings."""
+    pool = http_pool()
+    return {"http_client": pool.sync, "http_async_client": pool.async_client}
+
+def client_stats() -> dict:
+    """Pool usage (requests, connections opened, reused, open now) and client cache counts."""
+    stats = {f"client_{k}": v for k, v in clients.stats().items()}
+    if _pool is not None:
+        stats.update(_pool.stats())
+    return stats
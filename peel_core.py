@@ -0,0 +1,871 @@
+"""
+Shared PEEL evaluation logic: exemplar bank, prompts, retrieval and grading.
+
+Used by the Streamlit apps, TestPrompt.py and the headless batch grader
+(peel_batch.py). Importing this module does no work and pulls in neither
+Streamlit nor the LangChain/OpenAI clients; those are imported on first use,
+so worker processes and CLI tools start quickly and an unset OPENAI_API_KEY
+only matters once a model is actually called.
+"""
+import asyncio
+import json
+import os
+import re
+import statistics
+import time
+
+from peel_trace import NULL_TRACE
+
+
+# =========================
+#  EXAMPLE EVALUATIONS
+# =========================
+# Placeholders, used until a real bank is ingested with peel_exemplars.py
+# (see load_exemplars).
+EXAMPLE_EVALUATIONS = [
+    {
+        "label": "high_band_example",
+        "band": "13–15",
+        "text": """EXAMPLE
+Question: How does the writer create tension in this passage?
+Student answer:
+[Put the full strong student answer here.]
+
+Teacher feedback:
+**Score: 14/15**
+This response shows a strong understanding of the passage and follows the required essay structure effectively. The introduction clearly states the title, author, and context of the extract, and the thesis statement directly answers the question by outlining the key ways tension is created. The body paragraphs generally follow a PEEL structure, and the student supports their points with relevant quotations and clear explanations. Language aspects such as sensory imagery and short, abrupt sentences are identified and analysed, which strengthens the response. Minor improvements in depth of analysis could push this into full marks.
+"""
+    },
+    {
+        "label": "mid_band_example",
+        "band": "9–12",
+        "text": """EXAMPLE
+Question: In what ways is the character shown as selfish?
+Student answer:
+[Put a mid-level student answer here.]
+
+Teacher feedback:
+**Score: 10/15**
+The response attempts to follow the required structure and does answer the question, but not always consistently. The introduction names the character and briefly mentions the situation, yet the thesis statement is vague and does not clearly outline the main points that will be developed. The body paragraphs show some PEEL features, but explanations are often descriptive rather than analytical, and the answer sometimes slips into narration. Language aspects are mentioned but not always accurately analysed. With a clearer thesis and deeper explanation, this could move to a higher band.
+"""
+    },
+    {
+        "label": "low_band_example",
+        "band": "0–8",
+        "text": """EXAMPLE
+Question: How is the setting important in this extract?
+Student answer:
+[Put a weak student answer here.]
+
+Teacher feedback:
+**Score: 6/15**
+This response shows a basic awareness of the setting but does not fully address how it is important to the extract. The introduction is very brief and does not include the title, author, or a clear thesis statement. The paragraphs are loosely organised and do not consistently follow a PEEL structure. There is little direct evidence from the text, and explanations remain general rather than analytical. Language features are not clearly identified or discussed. To improve, the student needs to include a proper introduction, use quotations to support points, and focus on explaining how the setting affects mood, character, or theme.
+"""
+    },
+    # ➜ Add more examples here in the same format
+]
+
+# =========================
+#  PROMPT TEMPLATE
+# =========================
+
+# The prompt is laid out static-first so that every request shares the same
+# leading tokens (the rubric), which provider-side prompt caching can reuse.
+# Exemplars come next and the per-request question and answer go last.
+
+# The PEEL criteria and the expected essay structure are shared with the
+# paragraph-level prompts in peel_mapreduce.py.
+PEEL_CRITERIA = """1. POINT — Is the argument clearly stated and directly answering the question?
+2. EVIDENCE — Is there relevant, accurate, and specific supporting evidence?
+3. EXPLANATION — Does the student explain how the evidence supports the point, showing understanding and analysis?
+4. LINK — Does the student connect back to the question or provide a clear transition?
+"""
+
+ESSAY_STRUCTURE = """There should be one introductory paragraph followed by three body paragraphs and one conclusion paragraph.
+The introductory paragraph should first begin with the title of the story,
+then the name of the author,
+then a short one or two lines about the content of the extract or the content of the scene,
+followed by a thesis statement.
+The thesis statement should provide a clear answer to the question and outline all the points which will be highlighted in the following essay.
+The body paragraphs should follow the PEEL format, but language aspects also require to be mentioned.
+In language aspects, the student should identify a literary device or other forms of language used by the author to bring out what they're trying to say.
+They can either use the PETAL (Point, Evidence, Technique, Analysis, Link) format for this or provide a separate body paragraph for the same.
+If they are providing a separate body paragraph, they will have two paragraphs which explain points and one paragraph which highlights the literary devices.
+Then in the conclusion, they must summarize all the points and restate the thesis statement.
+Throughout the essay, they should not narrate the story; they need to be specific to the question.
+However, evidence must be explained and some content and background may be provided while doing the same.
+"""
+
+PEEL_RUBRIC = """
+You are an experienced IGCSE examiner. Your task is to evaluate a middle school student’s written response using the PEEL structure: Point, Evidence, Explanation, Link.
+
+Evaluate the new answer against these criteria:
+
+""" + PEEL_CRITERIA + """
+Expectation from the Student's Answer:
+""" + ESSAY_STRUCTURE + """
+Evaluation Criteria:
+- 10 marks for the content of the answer
+- 5 marks for quality of writing (grammar, vocabulary, clarity)
+- Total: 15 marks
+
+Provide your feedback in paragraph format using the structure below:
+- Start with giving a score out of 15 based on overall effectiveness. Output this in bold (Markdown) and add a newline after this line.
+- Then add a separate paragraph for each of the following, separated by a blank line:
+  - A judgment of how well the PEEL structure is followed.
+  - Comments on the strengths in Point, Evidence, Explanation, and Link.
+  - 2–3 clear suggestions for improvement (EBI: Even Better If…).
+  - A brief summary sentence encouraging improvement.
+
+Tone: Constructive, supportive, and academically appropriate for IGCSE level.
+Do not use bullet lists in your feedback paragraphs. Do not provide separate numeric scores for each criterion; only provide one overall score out of 15 at the start.
+
+You will be given several EXAMPLE EVALUATIONS. Each example contains:
+- The question
+- The student’s answer
+- The teacher’s feedback
+- The score out of 15
+
+Study these examples carefully and imitate their style, tone, level of strictness, and scoring when evaluating the new answer.
+"""
+
+EXAMPLES_SECTION = """
+EXAMPLE_EVALUATIONS:
+{examples}
+"""
+
+REQUEST_SECTION = """
+Now evaluate the NEW answer.
+
+QUESTION:
+{question}
+
+STUDENT_ANSWER:
+{student_answer}
+"""
+
+peel_prompt_string = PEEL_RUBRIC + EXAMPLES_SECTION + REQUEST_SECTION
+
+# Zero-shot PEEL prompt used by main.py (no exemplars).
+ZERO_SHOT_PEEL_PROMPT = """
+You are an experienced IGCSE examiner. Your task is to evaluate a middle school student’s written response using the PEEL structure: Point, Evidence, Explanation, Link.
+
+Evaluate the answer against these criteria:
+
+1. POINT — Is the argument clearly stated and directly answering the question?
+2. EVIDENCE — Is there relevant, accurate, and specific supporting evidence?
+3. EXPLANATION — Does the student explain how the evidence supports the point, showing understanding and analysis?
+4. LINK — Does the student connect back to the question or provide a clear transition?
+
+Expectation form the Student's Answer:
+There should be one introductory paragraph followed by three body paragraphs and one conclusion paragraph. 
+The introductory paragraph should first begin with the title of the story, 
+then the name of the author,
+then a short one or two lines about the content of the extract or the content of the scene, 
+followed by a thesis statement. 
+The thesis statement should provide a clear answer to the question and outline all the points which will be highlighted in the following essay. 
+The body paragraphs should follow the PEEL format, but language aspects also require to be mentioned. 
+In language aspects, you must identify a literary device or other forms of language used by the author to bring out what they're trying to say. 
+You can either use the PETAL (point, Evidence, Explanation, Link) format for this or provide a separate body paragraph for the same. 
+If you're providing a separate body paragraph, you have two paragraphs which explain points and one paragraph which highlights the literary devices. 
+Then in the conclusion, you must summarize all the points and restate the thesis statement. 
+Throughout the essay, you should not narrate and you need to be specific to the answer. 
+However, evidence must be explained and some content and background may be provided by doing the same.
+
+Evaluation Criteria:
+- 10 marks for the content of the answer
+- 5 marks for quality of writing (grammar, vocabulary, clarity)
+- Total: 15 marks
+
+Provide your feedback in paragraph format using the structure below:
+- Start with giving a score out of 15 based on overall effectiveness. (Output this in bold and add newline after this line).
+- Add a paragrah for each of the sections below and seperate them by a newline.
+- Provide a judgment of how well the PEEL structure is followed.
+- Comment specifically on the strengths in Point, Evidence, Explanation, and Link.
+- Provide 2–3 clear suggestions for improvement (EBI: Even Better If…).
+- Conclude with a brief summary sentence encouraging improvement.
+
+Tone: Constructive, supportive, and academically appropriate for IGCSE level.
+
+
+QUESTION:
+{question}
+
+STUDENT_ANSWER:
+{student_answer}
+"""
+
+# General short-answer prompt used by TestPrompt.py.
+GENERAL_EVALUATION_PROMPT = """
+You are an expert English teacher. Your job is to evaluate the student's answer and give helpful feedback.
+
+**Task:**
+- Read the question and the student's answer.
+- Decide if the answer is correct, partially correct, or incorrect.
+- Give clear feedback focusing on grammar, clarity, vocabulary, and content.
+- Provide a better version only if necessary.
+
+**Output Format:**
+Evaluation:
+- Correctness: (Correct / Partially correct / Incorrect)
+- Score: X/10
+- Strengths: ...
+- Areas to improve: ...
+- Suggested improved answer: ...
+
+**Here is the content to evaluate:**
+Question: "{question}"
+Student Answer: "{answer}"
+"""
+
+
+def __getattr__(name):
+    # ``prompt`` is the LangChain PromptTemplate form of peel_prompt_string.
+    # It is built on first access so importing this module stays cheap.
+    if name == "prompt":
+        from langchain_core.prompts import PromptTemplate
+
+        globals()["prompt"] = PromptTemplate(
+            template=peel_prompt_string,
+            input_variables=["examples", "question", "student_answer"],
+        )
+        return globals()["prompt"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class BuiltPrompt:
+    """A formatted prompt together with its static, exemplar and request segments."""
+
+    def __init__(self, static: str, examples: str, request: str):
+        self.static = static
+        self.examples = examples
+        self.request = request
+        self.text = static + examples + request
+
+    def token_counts(self, model_name: str = "gpt-5") -> dict:
+        return {
+            "static": estimate_tokens(self.static, model_name),
+            "examples": estimate_tokens(self.examples, model_name),
+            "request": estimate_tokens(self.request, model_name),
+            "total": estimate_tokens(self.text, model_name),
+        }
+
+_encodings = {}
+_tokenizer_missing = False
+
+
+def _encoding_for(model_name: str):
+    if model_name not in _encodings:
+        import tiktoken
+
+        try:
+            _encodings[model_name] = tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            # Models newer than the installed tiktoken use the gpt-4o tokenizer.
+            _encodings[model_name] = tiktoken.get_encoding("o200k_base")
+    return _encodings[model_name]
+
+def estimate_tokens(text: str, model_name: str) -> int:
+    """tiktoken count for ``text``; characters / 4 when the tokenizer files are unavailable.
+
+    Special-token text (e.g. a student typing ``<|endoftext|>``) is counted as
+    ordinary text instead of raising.
+    """
+    global _tokenizer_missing
+    if not _tokenizer_missing:
+        try:
+            return len(_encoding_for(model_name).encode(text, disallowed_special=()))
+        except Exception:
+            # tiktoken downloads its tables on first use; offline that fails every time.
+            _tokenizer_missing = True
+    return len(text) // 4 + 1
+
+def build_prompt(examples_text: str, question: str, student_answer: str, notes: str = "") -> BuiltPrompt:
+    """``notes`` (pre-screening facts) follow the answer; without them the prompt is unchanged."""
+    return BuiltPrompt(
+        PEEL_RUBRIC,
+        EXAMPLES_SECTION.format(examples=examples_text),
+        REQUEST_SECTION.format(question=question, student_answer=student_answer) + notes,
+    )
+
+# =========================
+#  LLM & VECTORSTORE
+# =========================
+
+EMBEDDING_MODEL = "text-embedding-3-large"
+
+# Caches, indexes and other local state live here unless PEEL_DATA_DIR is set.
+DATA_DIR = os.environ.get("PEEL_DATA_DIR", ".peel")
+
+# "chroma" (in-memory collection), "numpy" (memory-mapped .npy artifact) or
+# "ivf" (approximate search, partitioned by question and band; peel_ann.py).
+RETRIEVER_BACKEND = os.environ.get("PEEL_RETRIEVER", "chroma")
+
+
+def data_path(name: str) -> str:
+    return os.path.join(DATA_DIR, name)
+
+
+def build_llm(model_name: str, temperature: float = None, limiter=None):
+    """ChatOpenAI client on the shared connection pool; paced by ``limiter`` (or PEEL_TPM / PEEL_RPM) when one is set."""
+    from langchain_openai import ChatOpenAI
+
+    from peel_clients import client_kwargs
+    from peel_ratelimit import RateLimitedChatModel, limiter_for
+
+    limiter = limiter or limiter_for(model_name)
+    llm = ChatOpenAI(
+        model=model_name,
+        temperature=temperature,
+        # Ask for token usage on the final streamed chunk too, for tracing.
+        stream_usage=True,
+        # The limiter retries 429s itself, after pausing every caller.
+        **({"max_retries": 0} if limiter else {}),
+        **client_kwargs(),
+    )
+    return RateLimitedChatModel.wrap(llm, limiter) if limiter else llm
+
+def get_llm(model_name: str, temperature: float = None):
+    """build_llm, shared per (model, temperature) through the bounded peel_clients cache."""
+    from peel_clients import clients
+
+    return clients.get(("chat", model_name, temperature), lambda: build_llm(model_name, temperature))
+
+def build_embeddings(embeddings=None, cache: bool = True, limiter=None):
+    """Embeddings client backed by the on-disk embedding store.
+
+    Both exemplar indexing and query embedding go through the returned client,
+    so anything embedded once (by any process) is not sent to the API again.
+    Requests that do reach the API are paced by ``limiter`` (or PEEL_EMBED_TPM
+    / PEEL_EMBED_RPM for the default OpenAI client), and concurrent query
+    embeddings are sent together (peel_microbatch, PEEL_EMBED_BATCH_*).
+    """
+    from peel_embeddings import CachedEmbeddings, EmbeddingStore
+    from peel_microbatch import MicroBatchEmbeddings
+    from peel_ratelimit import RateLimitedEmbeddings, limiter_for
+
+    if embeddings is None:
+        from langchain_openai import OpenAIEmbeddings
+
+        from peel_clients import client_kwargs
+
+        limiter = limiter or limiter_for(EMBEDDING_MODEL, "embeddings")
+        embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL, **({"max_retries": 0} if limiter else {}), **client_kwargs())
+    if limiter is not None:
+        embeddings = RateLimitedEmbeddings(embeddings, limiter)
+    window = float(os.environ.get("PEEL_EMBED_BATCH_WINDOW_MS", "5")) / 1000
+    if window > 0:
+        embeddings = MicroBatchEmbeddings(embeddings, window, int(os.environ.get("PEEL_EMBED_BATCH_SIZE", "64")))
+    if not cache:
+        return embeddings
+    return CachedEmbeddings(embeddings, EmbeddingStore(data_path("embeddings.sqlite")))
+
+def load_exemplars() -> list[dict]:
+    """The ingested exemplar bank (see peel_exemplars.py), or the built-in placeholders."""
+    path = data_path("exemplars.sqlite")
+    if os.path.exists(path):
+        from peel_exemplars import ExemplarStore
+
+        exemplars = ExemplarStore(path).load()
+        if exemplars:
+            return exemplars
+    return EXAMPLE_EVALUATIONS
+
+def build_vectorstore(embeddings=None, backend: str = None, exemplars: list[dict] = None):
+    """Exemplar retriever for select_examples.
+
+    Both backends expose similarity_search(query, k) and return LangChain
+    Documents with the exemplar's metadata (label, band, ...).
+    """
+    if embeddings is None:
+        embeddings = build_embeddings()
+    if exemplars is None:
+        exemplars = load_exemplars()
+    backend = backend or RETRIEVER_BACKEND
+    if backend == "numpy":
+        from peel_index import NumpyExemplarIndex
+
+        return NumpyExemplarIndex.load(exemplars, embeddings, data_path("index"))
+    if backend == "ivf":
+        from peel_ann import PartitionedExemplarIndex
+
+        return PartitionedExemplarIndex.load(exemplars, embeddings, data_path("index"))
+    if backend != "chroma":
+        raise ValueError(f"Unknown retriever backend: {backend!r}")
+    from langchain_community.vectorstores import Chroma
+
+    texts = [ex["text"] for ex in exemplars]
+    metadatas = [{k: v for k, v in ex.items() if k != "text"} for ex in exemplars]
+
+    vectorstore = Chroma.from_texts(
+        texts=texts,
+        embedding=embeddings,
+        metadatas=metadatas,
+        collection_name="peel_examples",
+    )
+    return vectorstore
+
+def select_examples(vectorstore, student_answer: str, k: int = 3, trace=NULL_TRACE, question: str = None, stratify: bool = False) -> tuple[str, list]:
+    """Retrieve the k exemplars closest to ``student_answer``.
+
+    A partitioned retriever (the "ivf" backend) searches only ``question``'s
+    exemplars and, with ``stratify``, spreads the k results across bands;
+    other retrievers ignore both.
+    """
+    scope = {}
+    if getattr(vectorstore, "partitioned", False):
+        scope = {"question": question, "stratify": stratify}
+    if trace.enabled:
+        # Split the query embedding from the search so slow embedding calls show up.
+        with trace.span("retrieval.embed"):
+            vector = vectorstore.embeddings.embed_query(student_answer)
+        with trace.span("retrieval.search"):
+            docs = vectorstore.similarity_search_by_vector(vector, k=k, **scope)
+    else:
+        docs = vectorstore.similarity_search(student_answer, k=k, **scope)
+    examples_text = "\n\n---\n\n".join(d.page_content for d in docs)
+    return examples_text, docs
+
+def select_examples_batch(vectorstore, student_answers: list[str], k: int = 3, questions: list[str] = None) -> list[tuple[str, list]]:
+    """select_examples for many answers at once, embedding them in one call where the retriever allows."""
+    scope = {}
+    if getattr(vectorstore, "partitioned", False):
+        scope = {"questions": questions}
+    if hasattr(vectorstore, "similarity_search_batch"):
+        all_docs = vectorstore.similarity_search_batch(student_answers, k=k, **scope)
+    else:
+        all_docs = [vectorstore.similarity_search(a, k=k) for a in student_answers]
+    return [("\n\n---\n\n".join(d.page_content for d in docs), docs) for docs in all_docs]
+
+def format_prompt(examples_text: str, question: str, student_answer: str, notes: str = "") -> str:
+    return build_prompt(examples_text, question, student_answer, notes).text
+
+def screen_answer(screening, question: str, student_answer: str, trace=NULL_TRACE):
+    """Run the pre-screening rules (a peel_screen.Screener) and return the Verdict, or None without screening.
+
+    Raises peel_screen.EssayRejected when a reject rule matches.
+    """
+    if screening is None:
+        return None
+    from peel_screen import EssayRejected
+
+    with trace.span("screen"):
+        verdict = screening.check(question, student_answer)
+    trace.set(screen=verdict.action, screen_rule=verdict.rule)
+    if verdict.action == "reject":
+        raise EssayRejected(verdict)
+    return verdict
+
+def _notes(verdict) -> str:
+    return verdict.note if verdict is not None else ""
+
+# =========================
+#  EVALUATION
+# =========================
+
+SCORE_PATTERN = re.compile(r"Score:?\s*\**\s*(\d+(?:\.\d+)?)\s*/\s*15")
+
+
+def parse_score(feedback: str):
+    """Return the overall mark from the bold "Score: X/15" line, or None."""
+    match = SCORE_PATTERN.search(feedback)
+    return float(match.group(1)) if match else None
+
+def llm_identity(llm) -> tuple[str, float]:
+    model = getattr(llm, "model_name", None) or type(llm).__name__
+    temperature = getattr(llm, "temperature", None)
+    # ChatOpenAI leaves temperature unset when the API default (1.0) applies.
+    return model, 1.0 if temperature is None else float(temperature)
+
+def message_usage(message) -> dict:
+    usage = getattr(message, "usage_metadata", None) or {}
+    return {k: usage[k] for k in ("input_tokens", "output_tokens") if k in usage}
+
+def invoke_llm(llm, final_prompt: str, cache=None, trace=NULL_TRACE, policy=None, singleflight=None) -> str:
+    """Cached, optionally policy-wrapped and coalesced model call.
+
+    ``singleflight`` is an optional peel_singleflight.SingleFlight shared by
+    every caller in the process; identical concurrent calls share one result.
+    Feedback from a policy's fallback model is cached under that model and
+    is not shared with callers waiting for ``llm``.
+    """
+    model, temperature = llm_identity(llm)
+    if cache is not None:
+        feedback = cache.get(model, temperature, final_prompt)
+        if feedback is not None:
+            trace.set(cache_hit=True)
+            return feedback
+    answered = {"llm": llm}
+
+    def call() -> str:
+        if policy is not None:
+            feedback, answered["llm"] = policy.run(llm, final_prompt, trace)
+        else:
+            response = llm.invoke(final_prompt)
+            trace.set(**message_usage(response))
+            feedback = response.content
+        if cache is not None:
+            cache.put(*llm_identity(answered["llm"]), final_prompt, feedback)
+        return feedback
+
+    with trace.span("llm"):
+        if singleflight is None:
+            return call()
+        feedback, coalesced = singleflight.do(
+            singleflight.key(model, temperature, final_prompt), call, share=lambda _: answered["llm"] is llm
+        )
+    trace.set(coalesced=coalesced)
+    return feedback
+
+async def ainvoke_llm(llm, final_prompt: str, cache=None, trace=NULL_TRACE, policy=None, singleflight=None) -> str:
+    model, temperature = llm_identity(llm)
+    if cache is not None:
+        feedback = cache.get(model, temperature, final_prompt)
+        if feedback is not None:
+            trace.set(cache_hit=True)
+            return feedback
+
+    answered = {"llm": llm}
+
+    async def call() -> str:
+        if policy is not None:
+            feedback, answered["llm"] = await policy.arun(llm, final_prompt, trace)
+        else:
+            response = await llm.ainvoke(final_prompt)
+            trace.set(**message_usage(response))
+            feedback = response.content
+        if cache is not None:
+            cache.put(*llm_identity(answered["llm"]), final_prompt, feedback)
+        return feedback
+
+    with trace.span("llm"):
+        if singleflight is None:
+            return await call()
+        feedback, coalesced = await singleflight.ado(
+            singleflight.key(model, temperature, final_prompt), call, share=lambda _: answered["llm"] is llm
+        )
+    trace.set(coalesced=coalesced)
+    return feedback
+
+def evaluate_answer(question: str, student_answer: str, llm, vectorstore, k_examples: int = 3, cache=None, trace=NULL_TRACE, policy=None, singleflight=None, screening=None):
+    """Grade one answer; returns (feedback, exemplar documents used).
+
+    ``policy`` is an optional peel_policy.ExecutionPolicy (hedging / fallback),
+    ``singleflight`` an optional peel_singleflight.SingleFlight and
+    ``screening`` an optional peel_screen.Screener. An essay the screener
+    marks itself gets that feedback and no exemplars, without a model call.
+    """
+    verdict = screen_answer(screening, question, student_answer, trace)
+    if verdict is not None and verdict.feedback is not None:
+        return verdict.feedback, []
+    examples_text, docs_used = select_examples(vectorstore, student_answer, k_examples, trace, question)
+    with trace.span("prompt"):
+        final_prompt = format_prompt(examples_text, question, student_answer, _notes(verdict))
+
+    return invoke_llm(llm, final_prompt, cache, trace, policy, singleflight), docs_used
+
+async def aevaluate_answer(question: str, student_answer: str, llm, vectorstore, k_examples: int = 3, cache=None, trace=NULL_TRACE, policy=None, singleflight=None, screening=None):
+    verdict = screen_answer(screening, question, student_answer, trace)
+    if verdict is not None and verdict.feedback is not None:
+        return verdict.feedback, []
+    # Retrieval embeds the answer with a blocking client, so keep it off the event loop.
+    examples_text, docs_used = await asyncio.to_thread(
+        select_examples, vectorstore, student_answer, k_examples, trace, question
+    )
+    with trace.span("prompt"):
+        final_prompt = format_prompt(examples_text, question, student_answer, _notes(verdict))
+
+    return await ainvoke_llm(llm, final_prompt, cache, trace, policy, singleflight), docs_used
+
+
+# =========================
+#  ENSEMBLE
+# =========================
+
+class EnsembleResult:
+    """Several sampled evaluations of one prompt, aggregated by median score.
+
+    ``feedback`` is the sample whose score is closest to the median, so the
+    written comments agree with the reported mark. ``spread`` is max - min.
+    """
+
+    def __init__(self, samples: list[dict]):
+        self.samples = samples
+        self.prompt = None
+        scored = [s for s in samples if s["score"] is not None]
+        self.scores = [s["score"] for s in scored]
+        if scored:
+            self.score = statistics.median(self.scores)
+            self.spread = max(self.scores) - min(self.scores)
+            chosen = min(scored, key=lambda s: abs(s["score"] - self.score))
+        else:
+            self.score = None
+            self.spread = None
+            chosen = samples[0]
+        self.feedback = chosen["feedback"]
+        self.model = chosen["model"]
+
+    def summary(self) -> dict:
+        return {
+            "score": self.score,
+            "spread": self.spread,
+            "scores": self.scores,
+            "models": [s["model"] for s in self.samples],
+            "feedback_model": self.model,
+        }
+
+async def ainvoke_ensemble(llms, final_prompt: str, samples: int = 3, trace=NULL_TRACE) -> EnsembleResult:
+    """Sample ``final_prompt`` ``samples`` times concurrently, round-robin over ``llms``.
+
+    ``llms`` is one model or a list of models. The cache is deliberately not
+    consulted: repeated samples are the point. Failed samples are dropped
+    unless every sample fails.
+    """
+    if not isinstance(llms, (list, tuple)):
+        llms = [llms]
+
+    async def one(llm) -> dict:
+        response = await llm.ainvoke(final_prompt)
+        return {
+            "model": llm_identity(llm)[0],
+            "feedback": response.content,
+            "score": parse_score(response.content),
+            **message_usage(response),
+        }
+
+    with trace.span("llm.ensemble"):
+        results = await asyncio.gather(
+            *(one(llms[i % len(llms)]) for i in range(samples)), return_exceptions=True
+        )
+    done = [r for r in results if not isinstance(r, BaseException)]
+    if not done:
+        raise results[0]
+    trace.set(
+        ensemble_samples=len(done),
+        input_tokens=sum(r.get("input_tokens", 0) for r in done),
+        output_tokens=sum(r.get("output_tokens", 0) for r in done),
+    )
+    return EnsembleResult(done)
+
+def invoke_ensemble(llms, final_prompt: str, samples: int = 3, trace=NULL_TRACE) -> EnsembleResult:
+    """Blocking wrapper for callers without an event loop (e.g. a Streamlit script)."""
+    return asyncio.run(ainvoke_ensemble(llms, final_prompt, samples, trace))
+
+async def aevaluate_ensemble(question: str, student_answer: str, llms, vectorstore, k_examples: int = 3, samples: int = 3, trace=NULL_TRACE, screening=None, examples=None):
+    """Grade one answer ``samples`` times; returns (EnsembleResult, exemplar documents used).
+
+    Retrieval and the prompt are shared, so only the completions fan out.
+    ``examples`` is an (examples_text, docs) pair retrieved beforehand.
+    """
+    verdict = screen_answer(screening, question, student_answer, trace)
+    if verdict is not None and verdict.feedback is not None:
+        # A screened mark is deterministic, so one "sample" is the whole ensemble.
+        return EnsembleResult([{"model": "screen", "feedback": verdict.feedback, "score": verdict.score}]), []
+    examples_text, docs_used = examples or await asyncio.to_thread(
+        select_examples, vectorstore, student_answer, k_examples, trace, question
+    )
+    with trace.span("prompt"):
+        built = build_prompt(examples_text, question, student_answer, _notes(verdict))
+
+    result = await ainvoke_ensemble(llms, built.text, samples, trace)
+    result.prompt = built
+    return result, docs_used
+
+def evaluate_ensemble(question: str, student_answer: str, llms, vectorstore, k_examples: int = 3, samples: int = 3, trace=NULL_TRACE, screening=None, examples=None):
+    return asyncio.run(aevaluate_ensemble(question, student_answer, llms, vectorstore, k_examples, samples, trace, screening, examples))
+
+
+# =========================
+#  STREAMING
+# =========================
+
+class EvaluationStream:
+    """Iterate over feedback chunks as they arrive.
+
+    Keeps the running ``text``, picks up the "Score: X/15" line as soon as it
+    is complete, and records time to first token, time to score and total time
+    (seconds since the stream was created). ``chunks`` may be strings or
+    message chunks; token usage is taken from the latter when reported.
+    """
+
+    def __init__(self, chunks, on_complete=None, trace=NULL_TRACE):
+        self._chunks = chunks
+        self._on_complete = on_complete
+        self._trace = trace
+        self._started = time.perf_counter()
+        self._scanned = 0
+        self.prompt = None
+        self.text = ""
+        self.score = None
+        self.first_token_s = None
+        self.score_s = None
+        self.total_s = None
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            if not isinstance(chunk, str):
+                self._trace.set(**message_usage(chunk))
+                chunk = chunk_text(chunk)
+            if not chunk:
+                continue
+            if self.first_token_s is None:
+                self.first_token_s = time.perf_counter() - self._started
+                self._trace.record("llm.first_token", self._started, self._started + self.first_token_s)
+            self.text += chunk
+            if self.score is None:
+                self._scan_for_score()
+            yield chunk
+        self.total_s = time.perf_counter() - self._started
+        self._trace.record("llm", self._started, self._started + self.total_s)
+        if self._on_complete is not None:
+            self._on_complete(self.text)
+
+    def _scan_for_score(self):
+        # Only rescan the new text plus enough overlap for a split "Score: 14/15".
+        start = max(0, self._scanned - 32)
+        match = SCORE_PATTERN.search(self.text, start)
+        self._scanned = len(self.text)
+        if match:
+            self.score = float(match.group(1))
+            self.score_s = time.perf_counter() - self._started
+
+    def timings(self) -> dict:
+        return {
+            "first_token_s": self.first_token_s,
+            "score_s": self.score_s,
+            "total_s": self.total_s,
+            "score": self.score,
+        }
+
+def chunk_text(chunk) -> str:
+    content = chunk.content
+    if isinstance(content, str):
+        return content
+    # Some chat models stream content blocks instead of plain strings.
+    return "".join(block.get("text", "") for block in content if isinstance(block, dict))
+
+def _policy_chunks(policy, llm, final_prompt: str, trace, answered: dict):
+    # The policy has to see first tokens from both attempts before picking one,
+    # so its result is delivered as a single chunk.
+    text, answered["llm"] = policy.run(llm, final_prompt, trace)
+    yield text
+
+def stream_llm(llm, final_prompt: str, cache=None, trace=NULL_TRACE, policy=None, singleflight=None) -> EvaluationStream:
+    """Stream the model's feedback for ``final_prompt``.
+
+    With ``singleflight``, the first caller streams as usual and identical
+    concurrent callers receive the finished feedback as one chunk. As in
+    invoke_llm, a fallback model's feedback is cached under that model and
+    not shared.
+    """
+    answered = {"llm": llm}
+    if policy is not None:
+        chunks = _policy_chunks(policy, llm, final_prompt, trace, answered)
+    else:
+        chunks = llm.stream(final_prompt)
+    model, temperature = llm_identity(llm)
+    if singleflight is not None:
+        chunks = singleflight.stream(
+            singleflight.key(model, temperature, final_prompt), chunks, trace, share=lambda _: answered["llm"] is llm
+        )
+    if cache is None:
+        return EvaluationStream(chunks, trace=trace)
+    feedback = cache.get(model, temperature, final_prompt)
+    if feedback is not None:
+        trace.set(cache_hit=True)
+        return EvaluationStream(iter([feedback]), trace=trace)
+    return EvaluationStream(
+        chunks,
+        on_complete=lambda text: cache.put(*llm_identity(answered["llm"]), final_prompt, text),
+        trace=trace,
+    )
+
+def screened_stream(verdict, trace=NULL_TRACE) -> EvaluationStream:
+    """The screener's own feedback as a one-chunk stream; ``prompt`` stays None."""
+    return EvaluationStream(iter([verdict.feedback]), trace=trace)
+
+def stream_answer(question: str, student_answer: str, llm, vectorstore, k_examples: int = 3, cache=None, trace=NULL_TRACE, policy=None, singleflight=None, screening=None, examples=None):
+    """Like evaluate_answer, but returns an EvaluationStream instead of the finished text.
+
+    ``examples`` is an (examples_text, docs) pair already retrieved for this
+    answer, e.g. by a peel_prefetch.Prefetcher; retrieval is skipped.
+    """
+    verdict = screen_answer(screening, question, student_answer, trace)
+    if verdict is not None and verdict.feedback is not None:
+        return screened_stream(verdict, trace), []
+    examples_text, docs_used = examples or select_examples(vectorstore, student_answer, k_examples, trace, question)
+    with trace.span("prompt"):
+        built = build_prompt(examples_text, question, student_answer, _notes(verdict))
+
+    stream = stream_llm(llm, built.text, cache, trace, policy, singleflight)
+    stream.prompt = built
+    return stream, docs_used
+
+def log_stream_timings(stream: EvaluationStream, model_name: str, app: str):
+    """Append one line per finished stream to <DATA_DIR>/stream_timings.jsonl."""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    record = {"ts": time.time(), "app": app, "model": model_name, **stream.timings()}
+    with open(data_path("stream_timings.jsonl"), "a", encoding="utf-8") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+# =========================
+#  CLASS SESSIONS
+# =========================
+
+class QuestionSession:
+    """Precomputed state for grading many essays against one question.
+
+    Built once per question: the question embedding, a shortlist of the
+    ``shortlist_size`` exemplars closest to the question (with their vectors)
+    and the formatted prompt segments that do not depend on the answer. Each
+    essay then costs one answer embedding, a re-rank of the shortlist and the
+    completion. Prompts are identical to build_prompt's, so the evaluation
+    cache is shared with the one-off path.
+    """
+
+    def __init__(self, question: str, vectorstore, shortlist_size: int = 20):
+        import numpy as np
+
+        self.question = question
+        self.embeddings = vectorstore.embeddings
+        self.question_vector = self.embeddings.embed_query(question)
+        scope = {"question": question} if getattr(vectorstore, "partitioned", False) else {}
+        self.shortlist = vectorstore.similarity_search_by_vector(self.question_vector, k=shortlist_size, **scope)
+        vectors = np.asarray(self.embeddings.embed_documents([d.page_content for d in self.shortlist]), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self._shortlist_matrix = vectors / norms
+        head, tail = REQUEST_SECTION.split("{student_answer}")
+        self._request_head = head.format(question=question)
+        self._request_tail = tail
+
+    def select_examples(self, student_answer: str, k: int = 3, trace=NULL_TRACE) -> tuple[str, list]:
+        import numpy as np
+
+        with trace.span("retrieval.embed"):
+            vector = np.asarray(self.embeddings.embed_query(student_answer), dtype=np.float32)
+        with trace.span("retrieval.rerank"):
+            scores = self._shortlist_matrix @ vector
+            docs = [self.shortlist[i] for i in np.argsort(-scores)[:k]]
+        return "\n\n---\n\n".join(d.page_content for d in docs), docs
+
+    def build_prompt(self, examples_text: str, student_answer: str, notes: str = "") -> BuiltPrompt:
+        return BuiltPrompt(
+            PEEL_RUBRIC,
+            EXAMPLES_SECTION.format(examples=examples_text),
+            self._request_head + student_answer + self._request_tail + notes,
+        )
+
+    def stream_answer(self, student_answer: str, llm, k_examples: int = 3, cache=None, trace=NULL_TRACE, policy=None, singleflight=None, screening=None, examples=None):
+        """Session counterpart of stream_answer; returns (stream, docs)."""
+        verdict = screen_answer(screening, self.question, student_answer, trace)
+        if verdict is not None and verdict.feedback is not None:
+            return screened_stream(verdict, trace), []
+        examples_text, docs_used = examples or self.select_examples(student_answer, k_examples, trace)
+        with trace.span("prompt"):
+            built = self.build_prompt(examples_text, student_answer, _notes(verdict))
+
+        stream = stream_llm(llm, built.text, cache, trace, policy, singleflight)
+        stream.prompt = built
+        return stream, docs_used
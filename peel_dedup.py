@@ -0,0 +1,171 @@
+"""
+Near-duplicate detection across a batch of essays (MinHash + LSH, NumPy only).
+
+Each essay is reduced to its set of word ``shingle``-grams, and that set to a
+MinHash signature of ``num_perm`` 32-bit values. The share of positions where
+two signatures agree estimates the Jaccard similarity of the shingle sets.
+
+Signatures are cut into ``bands`` bands. Essays that answer the same question
+and share a band are candidates, so finding them costs one hash lookup per
+band per essay rather than a comparison per pair. Candidates are verified on
+their full signatures, and connected essays are split into clusters around
+leaders: every member is within ``threshold`` of its leader, which is the
+first such essay in input order. Only the leader needs an evaluation.
+
+With 128 permutations in 32 bands of 4 rows, a pair at similarity 0.7 becomes
+a candidate with probability > 0.99, and a pair at 0.2 with probability ~0.05.
+A threshold of 0.7 on 4-word shingles catches copies with roughly one word in
+thirty changed.
+"""
+import numpy as np
+
+from peel_ann import question_key
+from peel_screen import WORD
+
+MASK32 = np.uint64(0xFFFFFFFF)
+# Signature rows are packed into one 64-bit key per band with these multipliers.
+_BAND_MIX = np.random.default_rng(0x5EED).integers(1, 2**63, 64, dtype=np.uint64) | np.uint64(1)
+
+
+def _mix(h: np.ndarray) -> np.ndarray:
+    """splitmix64 finaliser, so shingle hashes are spread over all 64 bits."""
+    h = h ^ (h >> np.uint64(30))
+    h = h * np.uint64(0xBF58476D1CE4E5B9)
+    h = h ^ (h >> np.uint64(27))
+    h = h * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+
+class MinHasher:
+    """MinHash signatures over word shingles.
+
+    Words get small integer ids from a vocabulary shared by every essay the
+    hasher sees; a shingle's hash is a fixed linear combination of its word
+    ids, mixed. Permutation ``i`` is the multiply-shift hash
+    ``(a_i * h + b_i) >> 32`` with odd ``a_i``.
+    """
+
+    def __init__(self, num_perm: int = 128, shingle: int = 4, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.shingle = shingle
+        self.a = rng.integers(1, 2**63, num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.b = rng.integers(0, 2**63, num_perm, dtype=np.uint64)
+        self.weights = rng.integers(1, 2**63, shingle, dtype=np.uint64) | np.uint64(1)
+        self.vocab = {}
+
+    def shingles(self, text: str) -> np.ndarray:
+        vocab = self.vocab
+        words = WORD.findall(text.lower())
+        ids = np.fromiter((vocab.setdefault(w, len(vocab)) for w in words), dtype=np.uint64, count=len(words))
+        n = len(ids) - self.shingle + 1
+        if n < 1:
+            return np.empty(0, dtype=np.uint64)
+        h = ids[:n] * self.weights[0]
+        for j in range(1, self.shingle):
+            h += ids[j:j + n] * self.weights[j]
+        return np.unique(_mix(h))
+
+    def signature(self, text: str):
+        """uint32 signature, or None when the text is shorter than one shingle."""
+        h = self.shingles(text)
+        if not len(h):
+            return None
+        out = np.empty(self.num_perm, dtype=np.uint32)
+        # Blocks of permutations keep the (shingles x perms) product small.
+        step = max(1, 65536 // len(h))
+        for i in range(0, self.num_perm, step):
+            j = slice(i, i + step)
+            out[j] = (((h[:, None] * self.a[j] + self.b[j]) >> np.uint64(32)) & MASK32).min(axis=0)
+        return out
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return float(np.count_nonzero(a == b)) / len(a)
+
+
+def _band_keys(signatures: np.ndarray, groups: np.ndarray, bands: int) -> np.ndarray:
+    """(n, bands) uint64 keys; equal keys share the band rows and the group."""
+    n, num_perm = signatures.shape
+    rows = num_perm // bands
+    sig = signatures[:, :rows * bands].astype(np.uint64).reshape(n, bands, rows)
+    keys = (sig * _BAND_MIX[:rows]).sum(axis=2, dtype=np.uint64)
+    keys = _mix(keys ^ (np.arange(bands, dtype=np.uint64) * np.uint64(0x9E3779B97F4A7C15)))
+    return _mix(keys ^ groups.astype(np.uint64)[:, None])
+
+
+class _UnionFind:
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+
+    def find(self, i: int) -> int:
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(self, i: int, j: int):
+        i, j = self.find(i), self.find(j)
+        if i != j:
+            self.parent[max(i, j)] = min(i, j)
+
+
+def find_duplicates(texts, groups=None, threshold: float = 0.7, bands: int = 32, hasher: MinHasher = None) -> dict:
+    """Map each near-duplicate's index to ``(leader index, similarity)``.
+
+    ``texts`` is a sequence of essays and ``groups`` an optional parallel
+    sequence (the question); essays are only matched within a group. Indices
+    not in the result are leaders or unique.
+    """
+    hasher = hasher or MinHasher()
+    if hasher.num_perm % bands:
+        raise ValueError(f"bands ({bands}) must divide num_perm ({hasher.num_perm})")
+    group_ids = {}
+    kept, sigs, gids = [], [], []
+    for i, text in enumerate(texts):
+        sig = hasher.signature(text)
+        if sig is None:
+            continue
+        kept.append(i)
+        sigs.append(sig)
+        gids.append(group_ids.setdefault(question_key(groups[i]) if groups is not None else "", len(group_ids)))
+    if len(kept) < 2:
+        return {}
+    signatures = np.stack(sigs)
+    keys = _band_keys(signatures, np.asarray(gids), bands)
+
+    # Candidates: rows sharing a band key. Comparing each row with the first
+    # row of its bucket (and unioning) keeps this linear in the batch size.
+    uf = _UnionFind(len(kept))
+    for b in range(bands):
+        order = np.argsort(keys[:, b], kind="stable")
+        column = keys[order, b]
+        starts = np.flatnonzero(np.r_[True, column[1:] != column[:-1]])
+        sizes = np.diff(np.r_[starts, len(order)])
+        for start, size in zip(starts[sizes > 1], sizes[sizes > 1]):
+            first = order[start]
+            for j in order[start + 1:start + size]:
+                if similarity(signatures[first], signatures[j]) >= threshold:
+                    uf.union(first, j)
+
+    # Split each connected component around leaders, so every member is
+    # within the threshold of the essay whose evaluation it reuses.
+    components = {}
+    for i in range(len(kept)):
+        components.setdefault(uf.find(i), []).append(i)
+    duplicates = {}
+    for members in components.values():
+        if len(members) < 2:
+            continue
+        leaders = []
+        for i in members:
+            for leader in leaders:
+                score = similarity(signatures[leader], signatures[i])
+                if score >= threshold:
+                    duplicates[kept[i]] = (kept[leader], round(score, 3))
+                    break
+            else:
+                leaders.append(i)
+    return duplicates
@@ -0,0 +1,118 @@
+"""
+Persistent embedding store.
+
+Vectors are keyed by (embedding model, SHA-256 of the text) in SQLite, so a
+cold start or another replica only calls the embeddings API for texts nobody
+has embedded before. Exemplar indexing and query embedding share the store.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def embeddings_model_name(embeddings) -> str:
+    model = getattr(embeddings, "model", None)
+    if model:
+        dimensions = getattr(embeddings, "dimensions", None)
+        return f"{model}@{dimensions}" if dimensions else model
+    size = getattr(embeddings, "size", None)
+    return f"{type(embeddings).__name__}-{size}" if size else type(embeddings).__name__
+
+
+class EmbeddingStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get_many(self, model: str, hashes: list[str]) -> dict:
+        found = {}
+        with self._lock:
+            # Stay well under SQLite's bound-parameter limit.
+            for start in range(0, len(hashes), 500):
+                chunk = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *chunk],
+                )
+                for h, blob in rows:
+                    found[h] = array("f", blob).tolist()
+        return found
+
+    def put_many(self, model: str, items: dict):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)",
+                [(model, h, array("f", vector).tobytes()) for h, vector in items.items()],
+            )
+            self._conn.commit()
+
+    def count(self, model: str = None) -> int:
+        with self._lock:
+            if model is None:
+                return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings WHERE model = ?", (model,)).fetchone()[0]
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an Embeddings client and only forwards texts missing from the store."""
+
+    def __init__(self, underlying: Embeddings, store: EmbeddingStore, model: str = None):
+        self.underlying = underlying
+        self.store = store
+        self.model = model or embeddings_model_name(underlying)
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        hashes = [text_hash(t) for t in texts]
+        found = self.store.get_many(self.model, list(set(hashes)))
+
+        missing = {}
+        for h, text in zip(hashes, texts):
+            if h not in found:
+                missing.setdefault(h, text)
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            new = dict(zip(missing.keys(), vectors))
+            self.store.put_many(self.model, new)
+            found.update(new)
+
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        return [found[h] for h in hashes]
+
+    def embed_query(self, text: str) -> list[float]:
+        h = text_hash(text)
+        found = self.store.get_many(self.model, [h])
+        if h in found:
+            self.hits += 1
+            return found[h]
+        self.misses += 1
+        vector = self.underlying.embed_query(text)
+        self.store.put_many(self.model, {h: vector})
+        return vector
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "stored": self.store.count(self.model)}
@@ -0,0 +1,208 @@
+"""
+Exemplar bank ingestion.
+
+Loads marked scripts (question, answer, feedback, score, band, label) from
+JSONL / CSV files or folders into <data dir>/exemplars.sqlite, which
+peel_core.load_exemplars() then serves to the retrievers instead of the
+built-in placeholders.
+
+Records are identified by label (or by content hash when unlabelled) and
+deduplicated by a hash of their content. Only new or changed records are
+embedded, in batches under a concurrency cap; everything else is already in
+the embedding store, so re-ingesting a 10k-row bank with 50 edits costs 50
+embeddings.
+
+    python peel_exemplars.py marked_scripts/ extra.csv --prune
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import peel_core
+
+FIELDS = ("question", "answer", "feedback", "score", "band", "label")
+# The label is an identifier, not content: the same script under two labels is a duplicate.
+CONTENT_FIELDS = ("question", "answer", "feedback", "score", "band")
+
+
+def content_hash(record: dict) -> str:
+    canonical = json.dumps([record.get(f) for f in CONTENT_FIELDS], ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def exemplar_text(record: dict) -> str:
+    """Render a record in the same layout as peel_core.EXAMPLE_EVALUATIONS."""
+    feedback = record["feedback"].strip()
+    if record.get("score") is not None and peel_core.parse_score(feedback) is None:
+        feedback = f"**Score: {record['score']:g}/15**\n{feedback}"
+    return (
+        "EXAMPLE\n"
+        f"Question: {record.get('question') or ''}\n"
+        "Student answer:\n"
+        f"{record['answer'].strip()}\n\n"
+        "Teacher feedback:\n"
+        f"{feedback}\n"
+    )
+
+def _normalise(row: dict):
+    record = {f: (row.get(f) if row.get(f) not in ("", None) else None) for f in FIELDS}
+    if not record["answer"] or not record["feedback"]:
+        return None
+    for f in ("question", "answer", "feedback", "band", "label"):
+        if record[f] is not None:
+            record[f] = str(record[f])
+    if record["score"] is not None:
+        record["score"] = float(record["score"])
+    return record
+
+def _files(paths: list[str]):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                for name in sorted(names):
+                    if name.endswith((".jsonl", ".csv")):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+def read_exemplars(paths: list[str]):
+    """Yield normalised records from JSONL / CSV files and folders; rows without answer or feedback are skipped."""
+    for path in _files(paths):
+        with open(path, encoding="utf-8", newline="") as f:
+            rows = csv.DictReader(f) if path.endswith(".csv") else (json.loads(line) for line in f if line.strip())
+            for row in rows:
+                record = _normalise(row)
+                if record is not None:
+                    yield record
+
+
+class ExemplarStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS exemplars (
+                label TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL UNIQUE,
+                question TEXT,
+                score REAL,
+                band TEXT,
+                text TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def upsert(self, records, prune: bool = False) -> tuple[dict, list[str]]:
+        """Apply ``records`` in one transaction; returns (stats, texts of new or changed rows)."""
+        stats = {"added": 0, "changed": 0, "unchanged": 0, "duplicates": 0, "removed": 0}
+        changed_texts = []
+        seen_labels = set()
+        seen_hashes = set()
+        now = time.time()
+        with self._lock, self._conn:
+            existing = {label: h for label, h in self._conn.execute("SELECT label, content_hash FROM exemplars")}
+            hash_owner = {h: label for label, h in existing.items()}
+            for record in records:
+                h = content_hash(record)
+                label = record["label"] or h[:16]
+                owner = hash_owner.get(h, label)
+                if h in seen_hashes or owner != label:
+                    stats["duplicates"] += 1
+                    seen_labels.add(owner)  # the content is still present, so don't prune it
+                    continue
+                seen_hashes.add(h)
+                seen_labels.add(label)
+                if existing.get(label) == h:
+                    stats["unchanged"] += 1
+                    continue
+                stats["changed" if label in existing else "added"] += 1
+                text = exemplar_text(record)
+                changed_texts.append(text)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO exemplars VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (label, h, record["question"], record["score"], record["band"], text, now),
+                )
+                hash_owner.pop(existing.get(label), None)
+                existing[label] = h
+                hash_owner[h] = label
+            if prune:
+                stale = [(label,) for label in existing if label not in seen_labels]
+                self._conn.executemany("DELETE FROM exemplars WHERE label = ?", stale)
+                stats["removed"] = len(stale)
+        return stats, changed_texts
+
+    def load(self) -> list[dict]:
+        """Exemplars as dicts with label, band, question, score and text, in label order."""
+        with self._lock:
+            rows = self._conn.execute("SELECT label, band, question, score, text FROM exemplars ORDER BY label").fetchall()
+        exemplars = []
+        for label, band, question, score, text in rows:
+            ex = {"label": label, "band": band or "?", "question": question, "score": score, "text": text}
+            # Chroma metadata cannot hold None.
+            exemplars.append({k: v for k, v in ex.items() if v is not None})
+        return exemplars
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM exemplars").fetchone()[0]
+
+
+def embed_texts(embeddings, texts: list[str], batch_size: int = 512, concurrency: int = 4) -> int:
+    """Embed ``texts`` into the embedding store in batches, at most ``concurrency`` requests at a time."""
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in pool.map(embeddings.embed_documents, batches):
+            pass
+    return len(batches)
+
+def ingest(paths: list[str], store: ExemplarStore, embeddings, batch_size: int = 512, concurrency: int = 4, prune: bool = False) -> dict:
+    stats, changed_texts = store.upsert(read_exemplars(paths), prune=prune)
+    stats["embedding_batches"] = embed_texts(embeddings, changed_texts, batch_size, concurrency)
+    stats["total"] = store.count()
+    return stats
+
+
+# =========================
+#  CLI
+# =========================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest marked exemplars into the PEEL exemplar store.")
+    parser.add_argument("paths", nargs="+", help="JSONL / CSV files or folders of them")
+    parser.add_argument("--batch-size", type=int, default=512, help="texts per embeddings request")
+    parser.add_argument("--concurrency", type=int, default=4, help="embeddings requests in flight")
+    parser.add_argument("--prune", action="store_true", help="remove stored exemplars not present in the input")
+    parser.add_argument("--fake", action="store_true", help="use local fake embeddings (no network)")
+    args = parser.parse_args(argv)
+
+    if args.fake:
+        from peel_fakes import fake_embeddings
+
+        embeddings = peel_core.build_embeddings(fake_embeddings())
+    else:
+        embeddings = peel_core.build_embeddings()
+
+    started = time.perf_counter()
+    store = ExemplarStore(peel_core.data_path("exemplars.sqlite"))
+    stats = ingest(args.paths, store, embeddings, args.batch_size, args.concurrency, args.prune)
+    if peel_core.RETRIEVER_BACKEND in ("numpy", "ivf"):
+        # Write (and for "ivf", train) the index artifact now rather than on the app's first request.
+        peel_core.build_vectorstore(embeddings)
+    stats["elapsed_s"] = round(time.perf_counter() - started, 2)
+    print(" ".join(f"{k}={v}" for k, v in stats.items()))
+    print("embeddings: " + " ".join(f"{k}={v}" for k, v in embeddings.stats().items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,454 @@
+"""
+Local stand-ins for the OpenAI chat and embedding models.
+
+They never touch the network, so the batch grader and benchmarks can be run
+offline to measure throughput of the pipeline itself. FakeOpenAIServer goes one
+step further: a local OpenAI-compatible HTTP endpoint that enforces
+tokens-per-minute and requests-per-minute limits, so the real clients, their
+429 handling and the rate limiter can be exercised end to end.
+LocalBatchClient plays the Files and Batches APIs for peel_batchapi.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import math
+import os
+import random
+import struct
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+FAKE_FEEDBACK = """**Score: {score}/15**
+
+The response follows the PEEL structure with a clear introduction and thesis statement.
+
+Points are stated clearly and supported with evidence, although some explanations stay descriptive.
+
+EBI: explain how each quotation supports the point; name the literary technique; link back to the question.
+
+With deeper analysis this answer could reach a higher band."""
+
+# Reply to a peel_mapreduce paragraph prompt.
+FAKE_PARAGRAPH_FEEDBACK = """Marks: {marks}/10
+Writing: {writing}/5
+Comment: The point is clear and supported by a relevant quotation.
+Improve: Explain how the quotation supports the point and link back to the question."""
+
+
+class FakeGradingChatModel(BaseChatModel):
+    """Chat model that returns PEEL-shaped feedback after a fixed delay.
+
+    The score is derived from a hash of the prompt, so the same prompt always
+    gets the same mark at temperature 0; above that it wobbles by up to two
+    marks, like a sampled model. When streamed, the first chunk arrives after
+    ``first_token_latency`` and each following word after ``token_latency``.
+    ``first_token_latency_fn`` (if set) is called per request instead, to
+    inject variable or heavy-tailed latency. Non-streamed calls take
+    ``latency`` plus ``input_token_latency`` per prompt word and
+    ``output_token_latency`` per reply word, so that prompt and reply length
+    show up in wall-clock time. peel_mapreduce paragraph prompts get a
+    four-line paragraph assessment instead of full feedback.
+    """
+
+    model_name: str = "fake-grading"
+    temperature: float = 0.0
+    latency: float = 0.0
+    first_token_latency: float = 0.0
+    token_latency: float = 0.0
+    input_token_latency: float = 0.0
+    output_token_latency: float = 0.0
+    first_token_latency_fn: Optional[Callable[[], float]] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-grading"
+
+    def _feedback(self, messages) -> str:
+        text = "".join(str(m.content) for m in messages)
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        if "Marks: <0-10>/10" in text:
+            return FAKE_PARAGRAPH_FEEDBACK.format(marks=digest[1] % 11, writing=digest[2] % 6)
+        score = digest[0] % 16
+        if self.temperature > 0:
+            score = min(15, max(0, score + random.randint(-2, 2)))
+        return FAKE_FEEDBACK.format(score=score)
+
+    def _usage(self, messages, feedback: str) -> dict:
+        # Whitespace words stand in for tokens.
+        input_tokens = sum(len(str(m.content).split()) for m in messages)
+        output_tokens = len(feedback.split())
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+
+    def _result(self, messages) -> ChatResult:
+        feedback = self._feedback(messages)
+        message = AIMessage(content=feedback, usage_metadata=self._usage(messages, feedback))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _delay(self, result: ChatResult) -> float:
+        usage = result.generations[0].message.usage_metadata
+        return (
+            self.latency
+            + self.input_token_latency * usage["input_tokens"]
+            + self.output_token_latency * usage["output_tokens"]
+        )
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        result = self._result(messages)
+        delay = self._delay(result)
+        if delay:
+            time.sleep(delay)
+        return result
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        result = self._result(messages)
+        delay = self._delay(result)
+        if delay:
+            await asyncio.sleep(delay)
+        return result
+
+    def _chunks(self, messages):
+        feedback = self._feedback(messages)
+        words = feedback.split(" ")
+        for i, word in enumerate(words):
+            usage = self._usage(messages, feedback) if i == len(words) - 1 else None
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else " " + word, usage_metadata=usage))
+
+    def _first_token_delay(self) -> float:
+        if self.first_token_latency_fn is not None:
+            return self.first_token_latency_fn()
+        return self.first_token_latency
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self._first_token_delay())
+        for i, chunk in enumerate(self._chunks(messages)):
+            if i:
+                time.sleep(self.token_latency)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self._first_token_delay())
+        for i, chunk in enumerate(self._chunks(messages)):
+            if i:
+                await asyncio.sleep(self.token_latency)
+            yield chunk
+
+
+def fake_embeddings(size: int = 256):
+    return DeterministicFakeEmbedding(size=size)
+
+
+# =========================
+#  LOCAL OPENAI-COMPATIBLE SERVER
+# =========================
+
+def fake_chat_completion(body: dict) -> tuple[str, dict]:
+    """FakeGradingChatModel feedback and OpenAI-style usage for a chat completions request body."""
+    text = "".join(str(m.get("content") or "") for m in body.get("messages", []))
+    grader = FakeGradingChatModel(temperature=body.get("temperature") or 0.0)
+    feedback = grader._feedback([AIMessage(content=text)])
+    usage = {"prompt_tokens": len(text) // 4, "completion_tokens": len(feedback) // 4}
+    usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+    return feedback, usage
+
+
+class FakeOpenAIServer:
+    """``/v1/chat/completions`` and ``/v1/embeddings`` on localhost, with rate limits.
+
+    Each model gets its own sliding window of ``period`` seconds (60 for real
+    per-minute limits; shorter to keep tests quick). A request that would take
+    the window over ``rpm`` requests or ``tpm`` tokens is answered with a 429
+    and ``Retry-After`` / ``retry-after-ms`` headers saying when it would fit,
+    like the OpenAI API. Tokens are counted as characters / 4. Chat replies
+    are FakeGradingChatModel feedback (streamed as SSE when asked) after
+    ``latency`` seconds; embeddings take ``embed_latency`` seconds per request. Connections are HTTP/1.1 keep-alive; each new one
+    waits ``connect_latency`` seconds first, standing in for the TCP and TLS
+    handshakes, and is counted in ``stats()["connections"]``.
+
+        with FakeOpenAIServer(tpm=40_000, rpm=60, period=10) as server:
+            llm = ChatOpenAI(model="gpt-4.1-mini", base_url=server.base_url, api_key="fake")
+    """
+
+    def __init__(self, tpm: int = None, rpm: int = None, period: float = 60.0, latency: float = 0.0, host: str = "127.0.0.1", port: int = 0, connect_latency: float = 0.0, embed_latency: float = 0.0):
+        self.tpm = tpm
+        self.rpm = rpm
+        self.period = period
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.embed_latency = embed_latency
+        self.counts = {"requests": 0, "rate_limited": 0, "tokens": 0, "connections": 0}
+        self._windows = {}
+        self._lock = threading.Lock()
+        self._httpd = _HTTPServer((host, port), _handler_for(self))
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True, name="fake-openai")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counts)
+
+    def admit(self, model: str, tokens: int):
+        """Record the request and return None, or (seconds until it would fit, limit hit)."""
+        with self._lock:
+            window = self._windows.setdefault(model, deque())
+            now = time.monotonic()
+            while window and window[0][0] <= now - self.period:
+                window.popleft()
+            wait, kind = None, "requests"
+            if self.rpm and len(window) + 1 > self.rpm:
+                wait = window[0][0] + self.period - now
+            elif self.tpm:
+                kind = "tokens"
+                used = sum(t for _, t in window)
+                for at, t in window:
+                    if used + tokens <= self.tpm:
+                        break
+                    used -= t
+                    wait = at + self.period - now
+            if wait is not None:
+                self.counts["rate_limited"] += 1
+                return max(wait, 0.001), kind
+            window.append((now, tokens))
+            self.counts["requests"] += 1
+            self.counts["tokens"] += tokens
+            return None
+
+    def chat(self, body: dict):
+        return fake_chat_completion(body)
+
+    def embeddings(self, body: dict):
+        inputs = body.get("input")
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        # Inputs arrive as strings, or as token ids when the client tokenises first.
+        texts = [x if isinstance(x, str) else " ".join(map(str, x)) for x in inputs]
+        tokens = sum(len(x) // 4 if isinstance(x, str) else len(x) for x in inputs)
+        dim = body.get("dimensions") or 256
+        vectors = []
+        for text in texts:
+            seed = hashlib.sha256(text.encode("utf-8")).digest()
+            vectors.append([b / 127.5 - 1.0 for b in (seed * math.ceil(dim / len(seed)))[:dim]])
+        return vectors, {"prompt_tokens": tokens, "total_tokens": tokens}
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 resets connections when a batch opens dozens at once.
+    request_queue_size = 256
+
+
+def _handler_for(server: FakeOpenAIServer):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # Headers and body are separate writes; with Nagle, keep-alive replies stall ~40 ms.
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def setup(self):
+            super().setup()
+            with server._lock:
+                server.counts["connections"] += 1
+            time.sleep(server.connect_latency)
+
+        def _json(self, status: int, payload: dict, headers: dict = None):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _rate_limited(self, wait: float, kind: str):
+            self._json(
+                429,
+                {"error": {"message": f"Rate limit reached for {kind}. Please try again in {wait:.3f}s.", "type": kind, "code": "rate_limit_exceeded"}},
+                {"retry-after": str(math.ceil(wait)), "retry-after-ms": str(int(wait * 1000) + 1)},
+            )
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            model = body.get("model", "unknown")
+            if self.path.endswith("/chat/completions"):
+                feedback, usage = server.chat(body)
+                limited = server.admit(model, usage["total_tokens"])
+                if limited is not None:
+                    return self._rate_limited(*limited)
+                time.sleep(server.latency)
+                if body.get("stream"):
+                    return self._stream(model, feedback, usage, (body.get("stream_options") or {}).get("include_usage"))
+                return self._json(200, {
+                    "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": feedback}, "finish_reason": "stop"}],
+                    "usage": usage,
+                })
+            if self.path.endswith("/embeddings"):
+                vectors, usage = server.embeddings(body)
+                limited = server.admit(model, usage["total_tokens"])
+                if limited is not None:
+                    return self._rate_limited(*limited)
+                time.sleep(server.embed_latency)
+                if body.get("encoding_format") == "base64":
+                    vectors = [base64.b64encode(struct.pack(f"<{len(v)}f", *v)).decode("ascii") for v in vectors]
+                return self._json(200, {
+                    "object": "list", "model": model, "usage": usage,
+                    "data": [{"object": "embedding", "index": i, "embedding": v} for i, v in enumerate(vectors)],
+                })
+            self._json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+        def _stream(self, model: str, feedback: str, usage: dict, include_usage: bool):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def write(data: bytes):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+            def send(choices, **extra):
+                chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": model, "choices": choices, **extra}
+                write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+            for i, word in enumerate(feedback.split(" ")):
+                send([{"index": 0, "delta": {"role": "assistant", "content": word if i == 0 else " " + word}, "finish_reason": None}])
+            send([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            if include_usage:
+                send([], usage=usage)
+            write(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+# =========================
+#  LOCAL BATCH API
+# =========================
+
+class LocalBatchClient:
+    """Stand-in for the OpenAI Files and Batches APIs, kept on disk under ``directory``.
+
+    Same interface as peel_batchapi.OpenAIBatchClient. A batch completes on
+    the first ``retrieve`` at least ``delay`` seconds after it was created:
+    each request line is answered as FakeOpenAIServer would and written to an
+    output file in Batch-API result format. Every ``fail_every``-th request
+    goes to the error file with a 500 instead. State lives in files, so
+    separate submit and collect processes see the same batches.
+    """
+
+    def __init__(self, directory: str, delay: float = 0.0, fail_every: int = 0):
+        self.directory = directory
+        self.delay = delay
+        self.fail_every = fail_every
+        os.makedirs(os.path.join(directory, "files"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "batches"), exist_ok=True)
+
+    def _file(self, file_id: str) -> str:
+        return os.path.join(self.directory, "files", file_id)
+
+    def _batch_path(self, batch_id: str) -> str:
+        return os.path.join(self.directory, "batches", batch_id + ".json")
+
+    def _save(self, batch: dict):
+        with open(self._batch_path(batch["id"]), "w", encoding="utf-8") as f:
+            json.dump(batch, f)
+
+    def upload(self, path: str) -> str:
+        file_id = "file-" + uuid.uuid4().hex[:24]
+        with open(path, "rb") as src, open(self._file(file_id), "wb") as dst:
+            dst.write(src.read())
+        return file_id
+
+    def create(self, input_file_id: str, endpoint: str, metadata: dict = None) -> dict:
+        batch = {
+            "id": "batch_" + uuid.uuid4().hex[:24], "object": "batch", "endpoint": endpoint,
+            "input_file_id": input_file_id, "status": "validating", "created_at": time.time(),
+            "output_file_id": None, "error_file_id": None, "metadata": metadata,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        self._save(batch)
+        return batch
+
+    def retrieve(self, batch_id: str) -> dict:
+        with open(self._batch_path(batch_id), encoding="utf-8") as f:
+            batch = json.load(f)
+        if batch["status"] == "validating" and time.time() - batch["created_at"] >= self.delay:
+            self._run(batch)
+            self._save(batch)
+        elif batch["status"] == "validating":
+            batch["status"] = "in_progress"
+        return batch
+
+    def download(self, file_id: str, path: str):
+        with open(self._file(file_id), "rb") as src, open(path, "wb") as dst:
+            dst.write(src.read())
+
+    def _run(self, batch: dict):
+        output_id, error_id = "file-" + uuid.uuid4().hex[:24], "file-" + uuid.uuid4().hex[:24]
+        counts = {"total": 0, "completed": 0, "failed": 0}
+        with open(self._file(batch["input_file_id"]), encoding="utf-8") as requests, \
+                open(self._file(output_id), "w", encoding="utf-8") as output, \
+                open(self._file(error_id), "w", encoding="utf-8") as errors:
+            for line in requests:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                counts["total"] += 1
+                result = {"id": f"batch_req_{uuid.uuid4().hex[:24]}", "custom_id": request["custom_id"], "error": None}
+                if self.fail_every and counts["total"] % self.fail_every == 0:
+                    result["response"] = {
+                        "status_code": 500, "request_id": uuid.uuid4().hex,
+                        "body": {"error": {"message": "The server had an error processing your request.", "type": "server_error"}},
+                    }
+                    errors.write(json.dumps(result) + "\n")
+                    counts["failed"] += 1
+                    continue
+                feedback, usage = fake_chat_completion(request["body"])
+                result["response"] = {
+                    "status_code": 200, "request_id": uuid.uuid4().hex,
+                    "body": {
+                        "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()),
+                        "model": request["body"].get("model"),
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": feedback}, "finish_reason": "stop"}],
+                        "usage": usage,
+                    },
+                }
+                output.write(json.dumps(result) + "\n")
+                counts["completed"] += 1
+        batch.update(
+            status="completed", request_counts=counts, completed_at=time.time(),
+            output_file_id=output_id if counts["completed"] else None,
+            error_file_id=error_id if counts["failed"] else None,
+        )
@@ -0,0 +1,101 @@
+"""
+In-process exemplar index backed by a memory-mapped NumPy matrix.
+
+A drop-in alternative to the in-memory Chroma collection for banks of a few
+thousand exemplars: embeddings are L2-normalised once, saved as a float32
+``.npy`` artifact next to a JSON file with the texts and metadata, and
+searched with a single matrix product. Artifacts are versioned by a hash of
+the exemplar content and embedding model, so editing the bank rebuilds them.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+from langchain_core.documents import Document
+
+from peel_embeddings import embeddings_model_name
+
+
+def index_version(exemplars: list[dict], model: str) -> str:
+    digest = hashlib.sha256(model.encode("utf-8"))
+    for ex in exemplars:
+        digest.update(json.dumps(ex, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+def _normalise(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class NumpyExemplarIndex:
+    def __init__(self, matrix: np.ndarray, texts: list[str], metadatas: list[dict], embeddings, version: str = None):
+        self.matrix = matrix
+        self.texts = texts
+        self.metadatas = metadatas
+        self.embeddings = embeddings
+        self.version = version
+
+    # -------- artifact I/O --------
+
+    @staticmethod
+    def artifact_paths(directory: str, version: str) -> tuple[str, str]:
+        base = os.path.join(directory, f"exemplars-{version}")
+        return base + ".npy", base + ".json"
+
+    @classmethod
+    def build(cls, exemplars: list[dict], embeddings, directory: str) -> "NumpyExemplarIndex":
+        version = index_version(exemplars, embeddings_model_name(embeddings))
+        texts = [ex["text"] for ex in exemplars]
+        metadatas = [{k: v for k, v in ex.items() if k != "text"} for ex in exemplars]
+        matrix = _normalise(np.asarray(embeddings.embed_documents(texts), dtype=np.float32))
+
+        os.makedirs(directory, exist_ok=True)
+        npy_path, meta_path = cls.artifact_paths(directory, version)
+        # Write under temporary names so a concurrent loader never sees half a file.
+        np.save(npy_path + ".tmp.npy", matrix)
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"version": version, "texts": texts, "metadatas": metadatas}, f, ensure_ascii=False)
+        os.replace(npy_path + ".tmp.npy", npy_path)
+        os.replace(meta_path + ".tmp", meta_path)
+        return cls(matrix, texts, metadatas, embeddings, version)
+
+    @classmethod
+    def load(cls, exemplars: list[dict], embeddings, directory: str) -> "NumpyExemplarIndex":
+        """Open the artifact for this exemplar bank, building it first if needed."""
+        version = index_version(exemplars, embeddings_model_name(embeddings))
+        npy_path, meta_path = cls.artifact_paths(directory, version)
+        if not (os.path.exists(npy_path) and os.path.exists(meta_path)):
+            return cls.build(exemplars, embeddings, directory)
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        matrix = np.load(npy_path, mmap_mode="r")
+        return cls(matrix, meta["texts"], meta["metadatas"], embeddings, version)
+
+    # -------- search --------
+
+    def search_vectors(self, queries: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """Top-k (indices, cosine scores) per row of ``queries``, best first."""
+        queries = _normalise(np.atleast_2d(np.asarray(queries, dtype=np.float32)))
+        k = min(k, len(self.texts))
+        scores = queries @ self.matrix.T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+    def _documents(self, indices) -> list[Document]:
+        return [Document(page_content=self.texts[i], metadata=self.metadatas[i]) for i in indices]
+
+    def similarity_search(self, query: str, k: int = 4) -> list[Document]:
+        return self.similarity_search_by_vector(self.embeddings.embed_query(query), k)
+
+    def similarity_search_by_vector(self, embedding: list[float], k: int = 4) -> list[Document]:
+        indices, _ = self.search_vectors(embedding, k)
+        return self._documents(indices[0])
+
+    def similarity_search_batch(self, queries: list[str], k: int = 4) -> list[list[Document]]:
+        vectors = self.embeddings.embed_documents(queries)
+        indices, _ = self.search_vectors(vectors, k)
+        return [self._documents(row) for row in indices]
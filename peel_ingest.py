@@ -0,0 +1,234 @@
+"""
+Text extraction for uploaded questions and answers: .txt, .html and .zip.
+
+Files are read in chunks through an incremental decoder, and HTML is fed to
+the parser chunk by chunk, so only the text of the document being extracted
+is held in memory. Zip archives are read member by member from the central
+directory without unpacking them, and documents over ``MAX_DOCUMENT_BYTES``
+are skipped. Memory use therefore depends on the largest document, not the
+size of the archive.
+
+normalise() cleans up the extracted text but copies maths verbatim:
+``$$...$$``, ``$...$``, ``\\[...\\]`` and ``\\(...\\)`` spans.
+
+In an archive or folder, a file whose name starts with "question" (for
+example Question1.html) is the question for the other files in its folder.
+Answers with no such file use the ``question`` passed in. Each answer's
+student id is its path without the extension.
+
+    python peel_batch.py answers.zip --question Question1.html -o results.jsonl
+"""
+import codecs
+import os
+import re
+import unicodedata
+import zipfile
+from html.parser import HTMLParser
+
+CHUNK_BYTES = 64 * 1024
+MAX_DOCUMENT_BYTES = 2 * 1024 * 1024
+TEXT_EXTENSIONS = (".txt", ".md")
+HTML_EXTENSIONS = (".html", ".htm")
+DOCUMENT_EXTENSIONS = TEXT_EXTENSIONS + HTML_EXTENSIONS
+UPLOAD_TYPES = ["txt", "md", "html", "htm"]
+
+MATH = re.compile(r"\$\$.+?\$\$|\\\[.+?\\\]|\\\(.+?\\\)|(?<![\\$])\$(?!\s)[^$\n]+?(?<!\s)\$(?!\d)", re.S)
+SPACES = re.compile(r"[^\S\n]+")
+BLANK_LINES = re.compile(r"\n\s*\n\s*")
+
+# Tags that end a paragraph, and tags whose content is not part of the text.
+BLOCK_TAGS = {"p", "div", "li", "tr", "blockquote", "pre", "h1", "h2", "h3", "h4", "h5", "h6", "table", "ul", "ol"}
+SKIP_TAGS = {"head", "style", "script", "title"}
+
+
+class DocumentTooLarge(ValueError):
+    pass
+
+
+# =========================
+#  EXTRACTION
+# =========================
+
+class _HTMLText(HTMLParser):
+    """Collects the visible text of an HTML document, one paragraph per block."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self._skip += 1
+        elif tag == "br":
+            self.parts.append("\n")
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n\n")
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n\n")
+
+    def handle_data(self, data):
+        if not self._skip:
+            # Whitespace inside HTML text, line breaks included, is one space.
+            self.parts.append(re.sub(r"\s+", " ", data))
+
+    def text(self) -> str:
+        return "".join(self.parts)
+
+
+def read_chunks(fileobj, limit: int = MAX_DOCUMENT_BYTES):
+    """Yield decoded text from a binary file, ``CHUNK_BYTES`` at a time."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    total = 0
+    while True:
+        chunk = fileobj.read(CHUNK_BYTES)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > limit:
+            raise DocumentTooLarge(f"over {limit} bytes")
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+def normalise(text: str) -> str:
+    """Tidy whitespace and Unicode outside maths; paragraphs stay separated by a blank line."""
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    out, last = [], 0
+    for match in MATH.finditer(text):
+        out.append(_normalise_prose(text[last:match.start()]))
+        out.append(match.group(0))
+        last = match.end()
+    out.append(_normalise_prose(text[last:]))
+    return "".join(out).strip()
+
+def _normalise_prose(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text).replace("\u200b", "")
+    text = SPACES.sub(" ", text)
+    text = re.sub(r" ?\n ?", "\n", text)
+    return BLANK_LINES.sub("\n\n", text)
+
+def extract_text(fileobj, name: str, limit: int = MAX_DOCUMENT_BYTES) -> str:
+    """Normalised text of one .txt or .html document read from a binary file."""
+    if name.lower().endswith(HTML_EXTENSIONS):
+        parser = _HTMLText()
+        for chunk in read_chunks(fileobj, limit):
+            parser.feed(chunk)
+        parser.close()
+        return normalise(parser.text())
+    return normalise("".join(read_chunks(fileobj, limit)))
+
+
+# =========================
+#  DOCUMENTS
+# =========================
+
+def _is_document(name: str) -> bool:
+    base = os.path.basename(name)
+    if not base or base.startswith(".") or "__MACOSX/" in name:
+        return False
+    return name.lower().endswith(DOCUMENT_EXTENSIONS)
+
+def _is_question(name: str) -> bool:
+    return os.path.basename(name).lower().startswith("question")
+
+def _is_collection(source) -> bool:
+    if isinstance(source, str):
+        return os.path.isdir(source) or source.lower().endswith(".zip")
+    return getattr(source, "name", "").lower().endswith(".zip")
+
+def _entries(source, select=None):
+    """(name, size, opener) for every document in a zip, folder or single file."""
+    if isinstance(source, str) and os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for f in sorted(files):
+                path = os.path.join(root, f)
+                name = os.path.relpath(path, source).replace(os.sep, "/")
+                if _is_document(name) and (select is None or select(name)):
+                    yield name, os.path.getsize(path), lambda path=path: open(path, "rb")
+    elif _is_collection(source):
+        with zipfile.ZipFile(source) as archive:
+            for info in archive.infolist():
+                name = info.filename
+                if not info.is_dir() and _is_document(name) and (select is None or select(name)):
+                    yield name, info.file_size, lambda info=info: archive.open(info)
+    elif isinstance(source, str):
+        yield os.path.basename(source), os.path.getsize(source), lambda: open(source, "rb")
+    else:
+        yield os.path.basename(getattr(source, "name", "upload")), None, lambda: _Rewound(source)
+
+class _Rewound:
+    """Context manager over a caller-owned file object: rewinds it and leaves it open."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+
+    def __enter__(self):
+        self.fileobj.seek(0)
+        return self.fileobj
+
+    def __exit__(self, *exc):
+        return False
+
+def iter_documents(source, stats: dict = None, select=None):
+    """Yield ``(name, text)`` for each readable document in ``source``.
+
+    ``source`` is a path (file, folder or .zip) or a binary file object with a
+    ``name`` (e.g. a Streamlit upload); ``select`` optionally filters names.
+    Documents over the size limit are skipped and counted in ``stats``.
+    """
+    stats = {} if stats is None else stats
+    for name, size, opener in _entries(source, select):
+        try:
+            if size is not None and size > MAX_DOCUMENT_BYTES:
+                raise DocumentTooLarge(name)
+            with opener() as f:
+                text = extract_text(f, name)
+        except DocumentTooLarge:
+            stats["too_large"] = stats.get("too_large", 0) + 1
+            continue
+        yield name, text
+
+def _answer(name: str) -> bool:
+    return not _is_question(name)
+
+def count_answers(source) -> int:
+    """Number of answer documents in ``source``, from names alone."""
+    return sum(1 for _ in _entries(source, _answer if _is_collection(source) else None))
+
+def _question_for(questions: dict, name: str, default: str):
+    folder = os.path.dirname(name)
+    while folder:
+        if folder in questions:
+            return questions[folder]
+        folder = os.path.dirname(folder)
+    return questions.get("", default)
+
+def iter_submissions(source, question: str = None, stats: dict = None):
+    """Yield ``{student_id, question, answer}`` for every answer in ``source``.
+
+    Question files are read before any answer (the zip central directory
+    lists every name up front), so their position in the archive does not
+    matter. A folder without one uses its parent's question, then
+    ``question``. Answers with no question at all, and empty answers, are
+    skipped and counted in ``stats``.
+    """
+    stats = {} if stats is None else stats
+    questions, select = {}, None
+    if _is_collection(source):
+        for name, text in iter_documents(source, stats, _is_question):
+            questions[os.path.dirname(name)] = text
+        select = _answer
+    for name, text in iter_documents(source, stats, select):
+        answer_question = _question_for(questions, name, question)
+        if not answer_question:
+            stats["no_question"] = stats.get("no_question", 0) + 1
+        elif not text:
+            stats["empty"] = stats.get("empty", 0) + 1
+        else:
+            stats["answers"] = stats.get("answers", 0) + 1
+            yield {"student_id": os.path.splitext(name)[0], "question": answer_question, "answer": text}
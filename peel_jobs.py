@@ -0,0 +1,431 @@
+"""
+Persistent evaluation job queue and worker pool.
+
+The Streamlit app submits an evaluation and gets a job id back at once. A
+pool of worker threads, either inside the app process or in separate
+``python peel_jobs.py`` processes sharing the same database, claims queued
+jobs, writes the feedback into the job row as it streams and stores the
+result. The UI only reads the row by id, so a rerun, a browser refresh or
+another session (via the ?job= link) sees the same job, and a widget change
+never throws work away.
+
+While a job runs, its worker sends a heartbeat every few seconds, whether
+or not the evaluation is streaming. Jobs whose worker stops sending
+heartbeats (a crashed or restarted process) are put back on the queue, up to
+``max_attempts`` times. A worker whose job was taken away like this cannot
+overwrite the new attempt's result.
+
+    PEEL_JOB_WORKERS=0 streamlit run few_shot_peel.py   # UI only
+    python peel_jobs.py --workers 8                      # dedicated workers
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import peel_core
+from peel_results import ResultStore, record_trace
+from peel_trace import NULL_TRACE, JsonlTraceSink, Trace
+
+FINISHED = ("done", "failed")
+
+
+class JobStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                params TEXT NOT NULL,
+                partial TEXT NOT NULL DEFAULT '',
+                result TEXT,
+                error TEXT,
+                worker TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                heartbeat_at REAL,
+                finished_at REAL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at)")
+        self._conn.commit()
+
+    def submit(self, params: dict) -> str:
+        job_id = uuid.uuid4().hex[:16]
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, params, created_at) VALUES (?, 'queued', ?, ?)",
+                (job_id, json.dumps(params, ensure_ascii=False), time.time()),
+            )
+        return job_id
+
+    def claim(self, worker: str):
+        """Move the oldest queued job to running and return it, or None."""
+        with self._lock, self._conn:
+            while True:
+                row = self._conn.execute(
+                    "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    return None
+                now = time.time()
+                # Another process may have claimed it in between; only one UPDATE wins.
+                claimed = self._conn.execute(
+                    """
+                    UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1,
+                        started_at = ?, heartbeat_at = ?, partial = ''
+                    WHERE id = ? AND status = 'queued'
+                    """,
+                    (worker, now, now, row[0]),
+                ).rowcount
+                if claimed:
+                    break
+        return self.get(row[0])
+
+    # Updates to a running job only apply while ``worker`` still holds it, so a
+    # worker whose job was requeued and claimed again cannot overwrite it.
+
+    def heartbeat(self, job_id: str, worker: str) -> bool:
+        with self._lock, self._conn:
+            return bool(self._conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time(), job_id, worker),
+            ).rowcount)
+
+    def progress(self, job_id: str, worker: str, partial: str) -> bool:
+        with self._lock, self._conn:
+            return bool(self._conn.execute(
+                "UPDATE jobs SET partial = ?, heartbeat_at = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (partial, time.time(), job_id, worker),
+            ).rowcount)
+
+    def finish(self, job_id: str, worker: str, result: dict) -> bool:
+        with self._lock, self._conn:
+            return bool(self._conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, partial = '', finished_at = ? "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (json.dumps(result, ensure_ascii=False), time.time(), job_id, worker),
+            ).rowcount)
+
+    def fail(self, job_id: str, worker: str, error: str) -> bool:
+        with self._lock, self._conn:
+            return bool(self._conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (error, time.time(), job_id, worker),
+            ).rowcount)
+
+    def get(self, job_id: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, params, partial, result, error, attempts, created_at, started_at, finished_at "
+                "FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        keys = ("id", "status", "params", "partial", "result", "error", "attempts", "created_at", "started_at", "finished_at")
+        job = dict(zip(keys, row))
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def requeue_stale(self, stale_after: float = 300.0, max_attempts: int = 3) -> int:
+        """Requeue running jobs without a heartbeat for ``stale_after`` seconds (or fail them)."""
+        cutoff = time.time() - stale_after
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'worker stopped responding', finished_at = ? "
+                "WHERE status = 'running' AND heartbeat_at < ? AND attempts >= ?",
+                (time.time(), cutoff, max_attempts),
+            )
+            return self._conn.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL WHERE status = 'running' AND heartbeat_at < ?",
+                (cutoff,),
+            ).rowcount
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+        counts.update(dict(rows))
+        return counts
+
+
+class WorkerPool:
+    """Threads that claim jobs from ``store`` and run ``handler(params, progress)``.
+
+    Each running job gets a heartbeat every ``heartbeat_every`` seconds from
+    a timer thread, so evaluations that report no progress (ensembles,
+    fallback policies, map-reduce) are not mistaken for stalled ones.
+    """
+
+    def __init__(self, store: JobStore, handler, workers: int = 4, poll_interval: float = 0.2, housekeeping_every: float = 30.0, heartbeat_every: float = 10.0):
+        self.store = store
+        self.handler = handler
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.housekeeping_every = housekeeping_every
+        self.heartbeat_every = heartbeat_every
+        self.name = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._stop = threading.Event()
+        self._threads = []
+        self._last_housekeeping = 0.0
+
+    def start(self) -> "WorkerPool":
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, args=(f"{self.name}-{i}",), daemon=True, name=f"peel-job-{i}")
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _housekeeping(self):
+        now = time.time()
+        if now - self._last_housekeeping >= self.housekeeping_every:
+            self._last_housekeeping = now
+            self.store.requeue_stale()
+
+    def _run(self, worker: str):
+        while not self._stop.is_set():
+            self._housekeeping()
+            job = self.store.claim(worker)
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            done = threading.Event()
+            beating = threading.Thread(target=self._heartbeat, args=(job["id"], worker, done), daemon=True)
+            beating.start()
+            try:
+                result = self.handler(job["params"], lambda text, job_id=job["id"]: self.store.progress(job_id, worker, text))
+            except Exception as e:
+                self.store.fail(job["id"], worker, f"{type(e).__name__}: {e}")
+            else:
+                self.store.finish(job["id"], worker, result)
+            finally:
+                done.set()
+                beating.join()
+
+    def _heartbeat(self, job_id: str, worker: str, done: threading.Event):
+        while not done.wait(self.heartbeat_every):
+            if not self.store.heartbeat(job_id, worker):
+                return  # requeued or finished elsewhere
+
+
+# =========================
+#  EVALUATION HANDLER
+# =========================
+
+def prompt_tokens(built, model_name: str):
+    """Token counts for the result page; None when there was no full prompt or they cannot be counted.
+
+    The feedback is already paid for by now, so counting must never fail the job.
+    """
+    # Essays marked by the screener (or locally reduced) never had a full prompt.
+    if built is None:
+        return None
+    try:
+        return built.token_counts(model_name)
+    except Exception:
+        return None
+
+class EvaluationRunner:
+    """Runs evaluation jobs with per-process models, retriever, cache and single-flight.
+
+    ``params`` mirrors the few_shot_peel settings: question, answer, model,
+    temperature, k_examples, and optionally samples / ensemble_models,
+    map_reduce ("model" or "local", see peel_mapreduce), class_session,
+    first_token_timeout / fallback_model, screen and trace.
+    Every evaluation is added to ``results`` (a peel_results.ResultStore)
+    when one is given.
+    """
+
+    progress_every = 0.25  # seconds between partial-feedback writes
+
+    def __init__(self, cache=None, tracer_sink=None, max_sessions: int = 32, results=None):
+        from peel_policy import PolicyStats
+        from peel_prefetch import Prefetcher
+        from peel_screen import load_screener
+        from peel_singleflight import SingleFlight
+
+        self.cache = cache
+        self.tracer_sink = tracer_sink
+        self.results = results
+        self.singleflight = SingleFlight()
+        self.policy_stats = PolicyStats()
+        self.screener = load_screener()
+        self.prefetcher = Prefetcher()
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._vectorstore = None
+        self._sessions = OrderedDict()
+
+    def llm(self, model_name: str, temperature: float):
+        return peel_core.get_llm(model_name, temperature)
+
+    def vectorstore(self):
+        with self._lock:
+            if self._vectorstore is None:
+                self._vectorstore = peel_core.build_vectorstore()
+            return self._vectorstore
+
+    def session(self, question: str):
+        vectorstore = self.vectorstore()
+        with self._lock:
+            if question in self._sessions:
+                self._sessions.move_to_end(question)
+                return self._sessions[question]
+        session = peel_core.QuestionSession(question, vectorstore)
+        with self._lock:
+            self._sessions[question] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return session
+
+    def retrieval_key(self, params: dict) -> str:
+        from peel_prefetch import prefetch_key
+
+        retriever = "session" if params.get("class_session") else "store"
+        return prefetch_key(retriever, params["question"], params["answer"], params.get("k_examples", 3))
+
+    def _retrieve(self, params: dict):
+        k_examples = params.get("k_examples", 3)
+        if params.get("class_session"):
+            return self.session(params["question"]).select_examples(params["answer"], k_examples)
+        return peel_core.select_examples(self.vectorstore(), params["answer"], k_examples, question=params["question"])
+
+    def prefetch(self, params: dict, slot: str):
+        """Retrieve exemplars for a draft answer in the background, debounced per ``slot`` (a browser session)."""
+        if params.get("answer", "").strip():
+            self.prefetcher.schedule(slot, self.retrieval_key(params), self._retrieve, params)
+
+    def _policy(self, params: dict, temperature: float):
+        if params.get("first_token_timeout") is None:
+            return None
+        from peel_policy import ExecutionPolicy
+
+        fallback = params.get("fallback_model")
+        return ExecutionPolicy(
+            first_token_timeout=params["first_token_timeout"],
+            fallback_llm=self.llm(fallback, temperature) if fallback else None,
+            stats=self.policy_stats,
+        )
+
+    def __call__(self, params: dict, progress) -> dict:
+        model_name, temperature = params["model"], params.get("temperature", 0.0)
+        k_examples = params.get("k_examples", 3)
+        screening = self.screener if params.get("screen") else None
+        trace = NULL_TRACE
+        if params.get("trace") or self.results is not None:
+            # The results store needs the spans and token usage even when the trace is not written out.
+            trace = Trace(
+                "evaluate", self.tracer_sink if params.get("trace") else None,
+                app=params.get("app", "jobs"), model=model_name, temperature=temperature, k_examples=k_examples,
+            )
+
+        examples = self.prefetcher.get(self.retrieval_key(params))
+        if examples is not None:
+            trace.set(prefetched=True)
+
+        if params.get("samples", 1) > 1:
+            models = [model_name, *params.get("ensemble_models", [])]
+            trace.set(samples=params["samples"], ensemble_models=models)
+            ensemble, docs_used = peel_core.evaluate_ensemble(
+                params["question"], params["answer"], [self.llm(m, temperature) for m in models],
+                self.vectorstore(), k_examples, params["samples"], trace=trace, screening=screening, examples=examples,
+            )
+            feedback, built = ensemble.feedback, ensemble.prompt
+            result = {"ensemble": ensemble.summary()}
+        elif params.get("map_reduce"):
+            from peel_mapreduce import evaluate_mapreduce
+
+            graded, docs_used = evaluate_mapreduce(
+                params["question"], params["answer"], self.llm(model_name, temperature), self.vectorstore(), k_examples,
+                params["map_reduce"], cache=self.cache, trace=trace, screening=screening, examples=examples,
+            )
+            feedback, built = graded.feedback, graded.prompt
+            result = {"map_reduce": graded.summary()}
+        else:
+            options = dict(
+                cache=self.cache, trace=trace, policy=self._policy(params, temperature), singleflight=self.singleflight,
+                screening=screening, examples=examples,
+            )
+            llm = self.llm(model_name, temperature)
+            if params.get("class_session"):
+                stream, docs_used = self.session(params["question"]).stream_answer(params["answer"], llm, k_examples, **options)
+            else:
+                stream, docs_used = peel_core.stream_answer(
+                    params["question"], params["answer"], llm, self.vectorstore(), k_examples, **options
+                )
+            last = 0.0
+            for _ in stream:
+                if time.perf_counter() - last >= self.progress_every:
+                    progress(stream.text)
+                    last = time.perf_counter()
+            feedback, built = stream.text, stream.prompt
+            peel_core.log_stream_timings(stream, model_name, app=params.get("app", "jobs"))
+            result = {"timings": stream.timings()}
+
+        finished = trace.finish()
+        result.update({
+            "feedback": feedback,
+            "score": peel_core.parse_score(feedback),
+            "examples": [{"text": d.page_content, **d.metadata} for d in docs_used],
+            "prompt_tokens": prompt_tokens(built, model_name),
+            "trace": finished if params.get("trace") else None,
+        })
+        record_trace(
+            self.results, finished, app=params.get("app", "jobs"), model=model_name, temperature=temperature,
+            k_examples=k_examples, docs=docs_used, score=result["score"],
+        )
+        return result
+
+
+# =========================
+#  CLI
+# =========================
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run PEEL evaluation workers against the shared job queue.")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--no-cache", action="store_true", help="always call the model")
+    parser.add_argument("--no-results", action="store_true", help="do not record evaluations in <data dir>/results.sqlite")
+    args = parser.parse_args(argv)
+
+    from dotenv import find_dotenv, load_dotenv
+
+    from peel_cache import EvaluationCache
+
+    load_dotenv(find_dotenv())
+    cache = None if args.no_cache else EvaluationCache(peel_core.data_path("eval_cache.sqlite"))
+    results = None if args.no_results else ResultStore(peel_core.data_path("results.sqlite"))
+    runner = EvaluationRunner(cache, JsonlTraceSink(peel_core.data_path("traces.jsonl")), results=results)
+    store = JobStore(peel_core.data_path("jobs.sqlite"))
+    pool = WorkerPool(store, runner, workers=args.workers).start()
+    print(f"{args.workers} workers on {store.path}; Ctrl-C to stop")
+    try:
+        while True:
+            time.sleep(10)
+            print("jobs: " + " ".join(f"{k}={v}" for k, v in store.stats().items()), flush=True)
+    except KeyboardInterrupt:
+        pool.stop(timeout=5)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+"""
+Map-reduce evaluation of long essays, one paragraph per model call.
+
+The single-call path puts the whole essay and k exemplars into one prompt,
+and the model writes all its feedback in one go. This mode splits the answer
+into its introduction, body paragraphs and conclusion. It then marks every
+paragraph concurrently against its part of the rubric: the PEEL/PETAL
+criteria for body paragraphs, and the thesis and summary expectations for the
+introduction and conclusion. Each reply is four short lines, so the calls
+are small and finish together. The marks are then combined in one of two
+ways:
+
+    reduce="local"  no further call: content is introduction 2 + body 6 +
+                    conclusion 2 out of 10, writing is the word-weighted mean out
+                    of 5, and the feedback is composed from the paragraph comments
+    reduce="model"  one more call, with the rubric, the exemplars, the question,
+                    the introduction, the conclusion and the paragraph assessments
+                    (not the body text), writes the usual feedback
+
+"local" is the default and the fast path. "model" writes full feedback after
+the paragraph calls, so it is slower than a single call and uses more tokens;
+it trades that latency for feedback calibrated against the exemplars.
+
+Retrieval for the reduce call runs while the paragraphs are being marked.
+Answers too short or without recognisable paragraphs fall back to one call.
+"""
+import asyncio
+import re
+
+from peel_core import (
+    EXAMPLES_SECTION,
+    PEEL_CRITERIA,
+    PEEL_RUBRIC,
+    BuiltPrompt,
+    ainvoke_llm,
+    build_prompt,
+    llm_identity,
+    message_usage,
+    parse_score,
+    screen_answer,
+    select_examples,
+    _notes,
+)
+from peel_screen import PARAGRAPH_BREAK, WORD
+from peel_trace import NULL_TRACE
+
+MIN_WORDS = 250  # shorter answers are graded in one call
+MAX_PARAGRAPHS = 12  # more "paragraphs" than this is usually line-broken text, not an essay
+REDUCES = ("local", "model")
+
+
+# =========================
+#  PROMPTS
+# =========================
+
+ROLES = {
+    "introduction": (
+        "This is the introduction. It should begin with the title of the story, then the name of the author, "
+        "then one or two lines about the content of the extract or scene, followed by a thesis statement that "
+        "answers the question and outlines the points the essay will make."
+    ),
+    "body": (
+        "This is a body paragraph. It should follow the PEEL structure:\n\n" + PEEL_CRITERIA + "\n"
+        "Language aspects also need to be mentioned: a literary device or other language the author uses, "
+        "in the PETAL form (Point, Evidence, Technique, Analysis, Link). A paragraph that is given over to "
+        "language instead of a further point is also acceptable."
+    ),
+    "conclusion": (
+        "This is the conclusion. It should summarise the points made in the essay and restate the thesis statement."
+    ),
+}
+
+PARAGRAPH_PROMPT = """
+You are an experienced IGCSE examiner. You are marking one paragraph of a middle school student’s essay; the other paragraphs are marked separately.
+
+QUESTION:
+{question}
+
+{expectations}
+The student should not narrate the story and should stay specific to the question. Evidence must be explained.
+
+PARAGRAPH ({position}):
+{paragraph}
+
+Reply with exactly these four lines and nothing else:
+Marks: <0-10>/10 for how well the paragraph does its job in the essay
+Writing: <0-5>/5 for grammar, vocabulary and clarity
+Comment: <one sentence on the paragraph's main strength>
+Improve: <one specific suggestion (Even Better If...)>
+"""
+
+REDUCE_SECTION = """
+Now evaluate the NEW answer. Its paragraphs have already been assessed one by one; base your evaluation on the introduction and conclusion below and on the assessments of every paragraph.
+
+QUESTION:
+{question}
+
+INTRODUCTION:
+{introduction}
+
+PARAGRAPH ASSESSMENTS:
+{assessments}
+
+CONCLUSION:
+{conclusion}
+"""
+
+MARKS_PATTERN = re.compile(r"Marks:?\s*\**\s*(\d+(?:\.\d+)?)\s*/\s*10")
+WRITING_PATTERN = re.compile(r"Writing:?\s*\**\s*(\d+(?:\.\d+)?)\s*/\s*5")
+COMMENT_PATTERN = re.compile(r"Comment:\s*(.+)")
+IMPROVE_PATTERN = re.compile(r"Improve:\s*(.+)")
+
+
+# =========================
+#  SPLITTING
+# =========================
+
+def split_paragraphs(answer: str) -> list[str]:
+    """Paragraphs separated by blank lines, or by single line breaks when there are none."""
+    blocks = [b.strip() for b in PARAGRAPH_BREAK.split(answer.strip()) if b.strip()]
+    if len(blocks) == 1:
+        blocks = [line.strip() for line in answer.splitlines() if line.strip()]
+    return blocks
+
+def paragraph_roles(count: int) -> list[str]:
+    return ["introduction"] + ["body"] * (count - 2) + ["conclusion"]
+
+def should_split(paragraphs: list[str], min_words: int = MIN_WORDS) -> bool:
+    words = sum(len(WORD.findall(p)) for p in paragraphs)
+    return 3 <= len(paragraphs) <= MAX_PARAGRAPHS and words >= min_words
+
+def _position(role: str, index: int) -> str:
+    return f"body paragraph {index}" if role == "body" else role
+
+
+# =========================
+#  MAP
+# =========================
+
+def parse_assessment(reply: str) -> dict:
+    """Marks (out of 10), writing (out of 5), comment and suggestion from a paragraph reply; None where missing."""
+    fields = {}
+    for name, pattern, top in (("marks", MARKS_PATTERN, 10), ("writing", WRITING_PATTERN, 5)):
+        match = pattern.search(reply)
+        fields[name] = min(top, float(match.group(1))) if match else None
+    for name, pattern in (("comment", COMMENT_PATTERN), ("improve", IMPROVE_PATTERN)):
+        match = pattern.search(reply)
+        fields[name] = match.group(1).strip() if match else ""
+    return fields
+
+async def _complete(llm, prompt: str, cache=None) -> tuple[str, dict, bool]:
+    """One uncoalesced model call through the cache; returns (text, token usage, cache hit)."""
+    model, temperature = llm_identity(llm)
+    if cache is not None:
+        text = cache.get(model, temperature, prompt)
+        if text is not None:
+            return text, {}, True
+    response = await llm.ainvoke(prompt)
+    if cache is not None:
+        cache.put(model, temperature, prompt, response.content)
+    return response.content, message_usage(response), False
+
+async def assess_paragraphs(question: str, paragraphs: list[str], llm, cache=None) -> list[dict]:
+    """Mark every paragraph concurrently; one dict per paragraph, in essay order."""
+    roles = paragraph_roles(len(paragraphs))
+    positions = [_position(role, i) for i, role in enumerate(roles)]
+
+    async def one(role: str, position: str, paragraph: str) -> dict:
+        prompt = PARAGRAPH_PROMPT.format(
+            question=question, expectations=ROLES[role], position=position, paragraph=paragraph
+        )
+        reply, usage, hit = await _complete(llm, prompt, cache)
+        return {
+            "role": role, "position": position, "words": len(WORD.findall(paragraph)),
+            "reply": reply, "usage": usage, "cache_hit": hit, **parse_assessment(reply),
+        }
+
+    return await asyncio.gather(*(one(r, p, text) for r, p, text in zip(roles, positions, paragraphs)))
+
+
+# =========================
+#  REDUCE
+# =========================
+
+def _mean(values: list, weights: list = None):
+    weights = weights or [1] * len(values)
+    pairs = [(v, w) for v, w in zip(values, weights) if v is not None]
+    if not pairs:
+        return None
+    return sum(v * w for v, w in pairs) / max(sum(w for _, w in pairs), 1)
+
+def local_score(assessed: list[dict]) -> float:
+    """Overall mark out of 15 from the paragraph marks.
+
+    Content (10) is 2 for the introduction, 6 for the body and 2 for the
+    conclusion; a body of fewer than three paragraphs earns its share pro rata.
+    A paragraph whose reply had no readable mark is left out of the means.
+    """
+    intro, *body, conclusion = assessed
+    body_marks = _mean([p["marks"] for p in body])
+    writing = _mean([p["writing"] for p in assessed], [p["words"] for p in assessed])
+    if body_marks is None or writing is None:
+        raise ValueError("the paragraph assessments had no readable marks")
+    content = (
+        (intro["marks"] or 0) * 0.2
+        + body_marks * 0.6 * min(1.0, len(body) / 3)
+        + (conclusion["marks"] or 0) * 0.2
+    )
+    return float(max(0, min(15, round(content + writing))))
+
+def _band(marks) -> str:
+    if marks is None:
+        return "not assessed"
+    return "strong" if marks >= 8 else "secure" if marks >= 5 else "still developing"
+
+def _named(p: dict) -> str:
+    return p["position"] if p["role"] == "body" else "the " + p["position"]
+
+def local_feedback(assessed: list[dict]) -> str:
+    """Feedback in the model's paragraph format, composed from the paragraph assessments."""
+    score = local_score(assessed)
+    body = [p for p in assessed if p["role"] == "body"]
+    bands = [f"{_named(p)} is {_band(p['marks'])}" for p in assessed]
+    structure = (
+        f"The essay has an introduction, {len(body)} body paragraph{'s' if len(body) != 1 else ''} and a conclusion"
+        + (", as the task expects. " if len(body) == 3 else "; the task expects three body paragraphs. ")
+        + "Overall, " + ", ".join(bands[:-1]) + " and " + bands[-1] + "."
+    )
+    strengths = " ".join(
+        f"In {_named(p)}, {p['comment'][0].lower() + p['comment'][1:]}" for p in assessed if p["comment"]
+    )
+    suggestions = {}
+    for p in sorted(assessed, key=lambda p: 10 if p["marks"] is None else p["marks"]):
+        if p["improve"] and p["improve"] not in suggestions and len(suggestions) < 3:
+            suggestions[p["improve"]] = f"{p['improve'].rstrip('.')} ({_named(p)})"
+    ebi = "EBI: " + "; ".join(suggestions.values()) + "." if suggestions else ""
+    if score >= 12:
+        closing = "This is a confident, well-organised response; sharpening the weaker paragraphs would make it even stronger."
+    elif score >= 8:
+        closing = "This is a solid response, and developing the analysis in each paragraph would lift it into a higher band."
+    else:
+        closing = "Keep working on the PEEL structure paragraph by paragraph, and the overall answer will improve quickly."
+    return "\n\n".join(part for part in (f"**Score: {score:g}/15**", structure, strengths, ebi, closing) if part)
+
+def _assessments_text(assessed: list[dict]) -> str:
+    return "\n\n".join(f"{p['position'].capitalize()}:\n{p['reply'].strip()}" for p in assessed)
+
+def build_reduce_prompt(examples_text: str, question: str, paragraphs: list[str], assessed: list[dict], notes: str = "") -> BuiltPrompt:
+    # Same static rubric and exemplar segments as build_prompt, so provider-side prompt caching still applies.
+    return BuiltPrompt(
+        PEEL_RUBRIC,
+        EXAMPLES_SECTION.format(examples=examples_text),
+        REDUCE_SECTION.format(
+            question=question, introduction=paragraphs[0], assessments=_assessments_text(assessed),
+            conclusion=paragraphs[-1],
+        ) + notes,
+    )
+
+
+# =========================
+#  EVALUATION
+# =========================
+
+class MapReduceResult:
+    """Feedback for one essay and the paragraph assessments it was built from.
+
+    ``reduce`` is "model" or "local", or "single" when the essay was graded in
+    one call and "screen" when the screener marked it. ``prompt`` is the
+    reduce (or single-call) BuiltPrompt, None without one.
+    """
+
+    def __init__(self, feedback: str, paragraphs: list[dict], reduce: str, prompt: BuiltPrompt = None):
+        self.feedback = feedback
+        self.paragraphs = paragraphs
+        self.reduce = reduce
+        self.prompt = prompt
+        self.score = parse_score(feedback)
+
+    def summary(self) -> dict:
+        return {
+            "score": self.score,
+            "reduce": self.reduce,
+            "paragraphs": [
+                {k: p[k] for k in ("position", "words", "marks", "writing", "comment", "improve")}
+                for p in self.paragraphs
+            ],
+        }
+
+async def aevaluate_mapreduce(question: str, student_answer: str, llm, vectorstore, k_examples: int = 3, reduce: str = "local", cache=None, trace=NULL_TRACE, screening=None, examples=None, min_words: int = MIN_WORDS):
+    """Grade one answer paragraph by paragraph; returns (MapReduceResult, exemplar documents used).
+
+    ``examples`` is an (examples_text, docs) pair retrieved beforehand. The
+    local reduce uses no exemplars, so it does no retrieval.
+    """
+    if reduce not in REDUCES:
+        raise ValueError(f"reduce must be one of {REDUCES}, not {reduce!r}")
+    verdict = screen_answer(screening, question, student_answer, trace)
+    if verdict is not None and verdict.feedback is not None:
+        return MapReduceResult(verdict.feedback, [], "screen"), []
+
+    def retrieve():
+        return examples or select_examples(vectorstore, student_answer, k_examples, trace, question)
+
+    paragraphs = split_paragraphs(student_answer)
+    if not should_split(paragraphs, min_words):
+        trace.set(map_reduce="single")
+        examples_text, docs_used = await asyncio.to_thread(retrieve)
+        with trace.span("prompt"):
+            built = build_prompt(examples_text, question, student_answer, _notes(verdict))
+        feedback = await ainvoke_llm(llm, built.text, cache, trace)
+        return MapReduceResult(feedback, [], "single", built), docs_used
+
+    retrieval = asyncio.ensure_future(asyncio.to_thread(retrieve)) if reduce == "model" else None
+    try:
+        with trace.span("llm.map"):
+            assessed = await assess_paragraphs(question, paragraphs, llm, cache)
+    except BaseException:
+        if retrieval is not None:
+            retrieval.cancel()
+        raise
+    calls = [p["usage"] for p in assessed]
+    hits = [p["cache_hit"] for p in assessed]
+
+    built, docs_used = None, []
+    if reduce == "local":
+        feedback = local_feedback(assessed)
+    else:
+        examples_text, docs_used = await retrieval
+        with trace.span("prompt"):
+            built = build_reduce_prompt(examples_text, question, paragraphs, assessed, _notes(verdict))
+        with trace.span("llm.reduce"):
+            feedback, usage, hit = await _complete(llm, built.text, cache)
+        calls.append(usage)
+        hits.append(hit)
+
+    trace.set(
+        map_reduce=reduce,
+        map_calls=len(assessed),
+        cache_hit=all(hits),
+        input_tokens=sum(u.get("input_tokens", 0) for u in calls),
+        output_tokens=sum(u.get("output_tokens", 0) for u in calls),
+    )
+    return MapReduceResult(feedback, assessed, reduce, built), docs_used
+
+def evaluate_mapreduce(question: str, student_answer: str, llm, vectorstore, k_examples: int = 3, reduce: str = "local", cache=None, trace=NULL_TRACE, screening=None, examples=None, min_words: int = MIN_WORDS):
+    """Blocking wrapper for callers without an event loop (e.g. a job worker thread)."""
+    return asyncio.run(aevaluate_mapreduce(
+        question, student_answer, llm, vectorstore, k_examples, reduce, cache, trace, screening, examples, min_words,
+    ))
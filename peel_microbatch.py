@@ -0,0 +1,97 @@
+"""
+Micro-batching of concurrent query embeddings.
+
+Each Streamlit session embeds its answer with its own embed_query call, so
+under load the embeddings endpoint sees many one-text requests at once.
+MicroBatchEmbeddings collects the queries that arrive within ``window``
+seconds of each other, up to ``max_batch`` texts, and sends them as one
+embed_documents call. Each caller gets back its own vector. Identical texts
+in a batch are sent once.
+
+The first query into an empty batch leads it. It waits out the window, or
+until the batch is full, and then makes the call. Queries arriving after
+that start the next batch, so one slow request does not hold the others
+back. A failed call raises the same error in every caller of that batch.
+
+build_embeddings puts the batcher under the on-disk store, so only texts
+the store has not seen get batched, and over the rate limiter, so a batch
+counts as one request:
+
+    PEEL_EMBED_BATCH_WINDOW_MS  how long a batch stays open (default 5; 0 disables)
+    PEEL_EMBED_BATCH_SIZE       texts per batch at most (default 64)
+"""
+import threading
+from concurrent.futures import Future
+
+from langchain_core.embeddings import Embeddings
+
+from peel_embeddings import embeddings_model_name
+
+
+class _Batch:
+    def __init__(self):
+        self.texts = {}
+        self.full = threading.Event()
+
+    def add(self, text: str) -> Future:
+        if text not in self.texts:
+            self.texts[text] = Future()
+        return self.texts[text]
+
+
+class MicroBatchEmbeddings(Embeddings):
+    """Embeddings client that sends concurrent embed_query calls as one batched request."""
+
+    def __init__(self, underlying: Embeddings, window: float = 0.005, max_batch: int = 64):
+        self.underlying = underlying
+        self.window = window
+        self.max_batch = max_batch
+        self.model = embeddings_model_name(underlying)
+        self.counts = {"queries": 0, "batches": 0, "texts": 0, "largest": 0, "failed": 0}
+        self._open = None
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        # Already one request; nothing to gain from holding it back.
+        return self.underlying.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        with self._lock:
+            self.counts["queries"] += 1
+            batch = self._open
+            leader = batch is None
+            if leader:
+                batch = self._open = _Batch()
+            future = batch.add(text)
+            if len(batch.texts) >= self.max_batch:
+                self._open = None
+                batch.full.set()
+        if leader:
+            batch.full.wait(self.window)
+            self._flush(batch)
+        return future.result()
+
+    def _flush(self, batch: _Batch):
+        with self._lock:
+            if self._open is batch:
+                self._open = None
+            self.counts["batches"] += 1
+            self.counts["texts"] += len(batch.texts)
+            self.counts["largest"] = max(self.counts["largest"], len(batch.texts))
+        texts = list(batch.texts)
+        try:
+            vectors = self.underlying.embed_documents(texts)
+        except BaseException as exc:
+            with self._lock:
+                self.counts["failed"] += 1
+            for future in batch.texts.values():
+                future.set_exception(exc)
+            return
+        for text, vector in zip(texts, vectors):
+            batch.texts[text].set_result(vector)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self.counts)
+        counts["mean_batch"] = round(counts["texts"] / counts["batches"], 2) if counts["batches"] else 0.0
+        return counts
@@ -0,0 +1,132 @@
+"""
+Execution policy for tail latency: hedged requests and model fallback.
+
+The primary model gets ``first_token_timeout`` seconds to start streaming.
+If it has not produced a token by then, a backup request is sent, either a
+duplicate to the same model (a hedge) or to ``fallback_llm``. Whichever
+attempt streams its first token first wins, and the other is cancelled. The
+whole call is bounded by ``deadline``. Every call records which path won, so
+the threshold can be tuned from real traffic.
+"""
+import asyncio
+import statistics
+import threading
+import time
+
+from peel_core import chunk_text, message_usage
+from peel_trace import NULL_TRACE
+
+
+class PolicyStats:
+    """Process-wide tally of which path answered and how fast it started."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.wins = {"primary": 0, "hedge": 0, "fallback": 0}
+        self.hedged = 0
+        self.first_token_s = {"primary": [], "hedge": [], "fallback": []}
+
+    def record(self, winner: str, hedged: bool, first_token_s: float):
+        with self._lock:
+            self.wins[winner] += 1
+            self.hedged += int(hedged)
+            samples = self.first_token_s[winner]
+            samples.append(first_token_s)
+            del samples[:-1000]  # keep a recent window only
+
+    def summary(self) -> dict:
+        with self._lock:
+            out = {"wins": dict(self.wins), "hedged": self.hedged}
+            for name, samples in self.first_token_s.items():
+                if len(samples) >= 2:
+                    q = statistics.quantiles(samples, n=20)
+                    out[f"{name}_first_token_p50_s"] = statistics.median(samples)
+                    out[f"{name}_first_token_p95_s"] = q[-1]
+        return out
+
+
+class ExecutionPolicy:
+    def __init__(
+        self,
+        first_token_timeout: float = 8.0,
+        deadline: float = 120.0,
+        fallback_llm=None,
+        stats: PolicyStats = None,
+    ):
+        self.first_token_timeout = first_token_timeout
+        self.deadline = deadline
+        self.fallback_llm = fallback_llm
+        self.stats = stats or PolicyStats()
+
+    async def _attempt(self, name: str, llm, prompt: str, first: asyncio.Future, started: float):
+        parts = []
+        usage = {}
+        async for chunk in llm.astream(prompt):
+            usage = message_usage(chunk) or usage
+            text = chunk_text(chunk)
+            if text and not first.done():
+                first.set_result((name, asyncio.get_running_loop().time() - started))
+            parts.append(text)
+        return "".join(parts), usage
+
+    async def _race(self, llm, prompt: str, attempts: dict, first: asyncio.Future, started: float, backup_name: str, backup_llm):
+        loop = asyncio.get_running_loop()
+        # A primary that fails outright also triggers the backup early.
+        await asyncio.wait({first, attempts["primary"]}, timeout=self.first_token_timeout,
+                           return_when=asyncio.FIRST_COMPLETED)
+        if not first.done():
+            attempts[backup_name] = asyncio.create_task(
+                self._attempt(backup_name, backup_llm, prompt, first, started)
+            )
+            while not first.done() and not all(t.done() for t in attempts.values()):
+                await asyncio.wait({first, *attempts.values()}, return_when=asyncio.FIRST_COMPLETED)
+
+        if first.done():
+            winner, first_token_s = first.result()
+        else:
+            # Nothing streamed a token: surface the primary's error, if any.
+            winner, first_token_s = "primary", loop.time() - started
+        for name, task in attempts.items():
+            if name != winner:
+                task.cancel()
+        text, usage = await attempts[winner]
+        return winner, first_token_s, text, usage
+
+    async def arun(self, llm, prompt: str, trace=NULL_TRACE) -> tuple:
+        """Returns (text, the model that answered): ``llm`` when the primary or a hedge won, else the fallback."""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        perf_started = time.perf_counter()
+        first = loop.create_future()
+        attempts = {"primary": asyncio.create_task(self._attempt("primary", llm, prompt, first, started))}
+        backup_name = "fallback" if self.fallback_llm is not None else "hedge"
+        backup_llm = self.fallback_llm or llm
+
+        try:
+            winner, first_token_s, text, usage = await asyncio.wait_for(
+                self._race(llm, prompt, attempts, first, started, backup_name, backup_llm), self.deadline
+            )
+        finally:
+            for task in attempts.values():
+                if task.done() and not task.cancelled():
+                    task.exception()  # mark a losing attempt's error as handled
+                else:
+                    task.cancel()
+
+        hedged = len(attempts) > 1
+        self.stats.record(winner, hedged, first_token_s)
+        trace.set(policy_winner=winner, policy_hedged=hedged, **usage)
+        trace.record(f"llm.first_token.{winner}", perf_started, perf_started + first_token_s)
+        return text, backup_llm if winner == "fallback" else llm
+
+    async def ainvoke(self, llm, prompt: str, trace=NULL_TRACE) -> str:
+        text, _ = await self.arun(llm, prompt, trace)
+        return text
+
+    def run(self, llm, prompt: str, trace=NULL_TRACE) -> tuple:
+        """Blocking ``arun`` for callers without an event loop (e.g. a Streamlit script)."""
+        return asyncio.run(self.arun(llm, prompt, trace))
+
+    def invoke(self, llm, prompt: str, trace=NULL_TRACE) -> str:
+        return self.run(llm, prompt, trace)[0]
+
@@ -0,0 +1,117 @@
+"""
+Speculative retrieval while an answer is still being edited.
+
+The apps call Prefetcher.schedule() whenever the answer text changes.
+Streamlit only sends a text area's value when it loses focus, so new text is
+usually a finished paste or edit, and the click on Evaluate that caused the
+blur lands a fraction of a second later. New text therefore starts retrieval
+at once on a background thread (leading edge). Text that changes again
+within ``debounce`` seconds of a start, from the same ``slot`` (one browser
+session), waits for the window to close, and only the latest runs. A
+``leading=False`` prefetcher waits for ``debounce`` quiet seconds instead,
+as a classic debounce does. The result is kept
+against a hash of what it depends on: the question, the answer, k, and which
+retriever was used. When Evaluate is clicked for the same text,
+Prefetcher.get() returns that result, or waits for the run still in flight,
+and the evaluation goes straight to the completion. Different text misses,
+and the evaluation retrieves as usual.
+
+The answer embedding also lands in the on-disk embedding store
+(peel_embeddings), so workers in other processes skip the embeddings call
+even though they cannot see this in-memory result. The in-memory result
+itself only helps an evaluation run in the same process.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+def prefetch_key(*parts) -> str:
+    return hashlib.sha256("\x00".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+class Prefetcher:
+    def __init__(self, debounce: float = 0.25, max_entries: int = 64, workers: int = 2, leading: bool = True):
+        self.debounce = debounce
+        self.leading = leading
+        self.max_entries = max_entries
+        self.counts = {"scheduled": 0, "started": 0, "superseded": 0, "hits": 0, "waited": 0, "misses": 0, "failed": 0}
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="peel-prefetch")
+        self._results = OrderedDict()
+        self._timers = {}
+        self._last_start = {}  # slot -> when its latest retrieval started
+        self._lock = threading.Lock()
+
+    def schedule(self, slot: str, key: str, fn, *args):
+        """Run ``fn(*args)`` for ``key`` now, or once ``slot``'s debounce window closes."""
+        with self._lock:
+            self.counts["scheduled"] += 1
+            if key in self._results:
+                self._results.move_to_end(key)
+                return
+            pending = self._timers.get(slot)
+            if pending is not None:
+                if pending.args[1] == key:
+                    return
+                pending.cancel()
+                del self._timers[slot]
+                self.counts["superseded"] += 1
+            delay = self.debounce
+            if self.leading:
+                delay = self._last_start.get(slot, float("-inf")) + self.debounce - time.monotonic()
+                if delay <= 0:
+                    self._submit(slot, key, fn, args)
+                    return
+            timer = threading.Timer(delay, self._start, (slot, key, fn, args))
+            timer.daemon = True
+            self._timers[slot] = timer
+        timer.start()
+
+    def _start(self, slot: str, key: str, fn, args):
+        with self._lock:
+            current = self._timers.get(slot)
+            if current is None or current.args[1] != key:
+                # Superseded or cancelled after the timer had already fired.
+                return
+            del self._timers[slot]
+            if key not in self._results:
+                self._submit(slot, key, fn, args)
+
+    def _submit(self, slot: str, key: str, fn, args):
+        # Called with the lock held.
+        self._results[key] = self._executor.submit(fn, *args)
+        self.counts["started"] += 1
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+        now = time.monotonic()
+        self._last_start[slot] = now
+        if len(self._last_start) > 4 * self.max_entries:
+            # Only starts inside the debounce window matter.
+            self._last_start = {s: t for s, t in self._last_start.items() if now - t < self.debounce}
+
+    def get(self, key: str, timeout: float = None):
+        """The prefetched result for ``key``, waiting for it if it is still running; None if there is none."""
+        with self._lock:
+            future = self._results.get(key)
+            if future is None:
+                # Still inside the debounce window: the caller retrieves now, so drop the timer.
+                for slot, timer in list(self._timers.items()):
+                    if timer.args[1] == key:
+                        timer.cancel()
+                        del self._timers[slot]
+                self.counts["misses"] += 1
+                return None
+            self.counts["hits" if future.done() else "waited"] += 1
+        try:
+            return future.result(timeout)
+        except Exception:
+            with self._lock:
+                self.counts["failed"] += 1
+                self._results.pop(key, None)
+            return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counts, "cached": len(self._results), "pending": len(self._timers)}
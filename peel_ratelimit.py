@@ -0,0 +1,412 @@
+"""
+Client-side pacing for OpenAI tokens-per-minute and requests-per-minute limits.
+
+Every chat and embedding request estimates its size with tiktoken (the
+formatted prompt plus the expected completion) and takes that many tokens
+from a TPM bucket and one from an RPM bucket, waiting until both have
+refilled enough. When the response arrives, the estimate is corrected with
+the usage the API reported. Requests are spread evenly over the minute, with
+only a small burst allowed after an idle spell.
+
+On top of the buckets, an AIMD concurrency limit caps requests in flight.
+Each success raises it by about one per round of requests; a 429 halves it
+(once per round, not once per failed request) and pauses every caller until
+the Retry-After time, or an exponential backoff when the server sends none.
+The request that got the 429 is retried, so a long batch rides out limit
+changes without failed essays. The wrapped OpenAI clients are built with
+``max_retries=0`` so the SDK does not retry behind the limiter's back.
+
+Limits are shared per model across the process:
+
+    PEEL_TPM=2000000 PEEL_RPM=5000 streamlit run main.py
+    PEEL_EMBED_TPM=5000000 PEEL_EMBED_RPM=10000 python peel_batch.py essays.csv
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Any, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from peel_core import estimate_tokens
+from peel_embeddings import embeddings_model_name
+
+
+def retry_after(error) -> Optional[float]:
+    """Seconds the server asked us to wait if ``error`` is a rate limit (0.0 if it gave no hint), else None."""
+    response = getattr(error, "response", None)
+    status = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+    # Running out of credit is also a 429, but waiting will not fix it.
+    if status != 429 or getattr(error, "code", None) == "insufficient_quota":
+        return None
+    headers = getattr(response, "headers", None) or {}
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        try:
+            return float(headers.get(name)) * scale
+        except (TypeError, ValueError):
+            continue
+    return 0.0
+
+
+# =========================
+#  BUCKETS & LIMITER
+# =========================
+
+class TokenBucket:
+    """``capacity`` units refilled evenly over ``period`` seconds.
+
+    Takes are reservations: the level may go negative, and the caller waits
+    until its share has refilled. Waiting callers are therefore served in the
+    order they arrived without having to retry. After an idle spell only a
+    ``burst`` fraction of the capacity can go out at once: a full bucket plus
+    a period of refill would send twice the limit within one window.
+    """
+
+    def __init__(self, capacity: float, period: float = 60.0, burst: float = 0.1):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / period
+        self.ceiling = max(1.0, self.capacity * burst)
+        self.level = self.ceiling
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.ceiling, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Take ``amount`` and return the seconds to wait before using it."""
+        with self._lock:
+            self._refill()
+            # A request bigger than the bucket could never fit; let it through once full.
+            self.level -= min(amount, self.capacity)
+            return max(0.0, -self.level / self.rate)
+
+    def adjust(self, amount: float):
+        """Charge more (positive) or refund (negative) once the real cost is known."""
+        with self._lock:
+            self._refill()
+            self.level = min(self.ceiling, self.level - amount)
+
+    def drain(self):
+        """The server says we are over the limit: assume nothing is left."""
+        with self._lock:
+            self._refill()
+            self.level = min(self.level, 0.0)
+
+
+class RateLimiter:
+    """TPM/RPM buckets plus an adaptive concurrency limit, for one model."""
+
+    poll_interval = 0.01  # seconds between async checks for a free slot
+
+    def __init__(self, tpm: float = None, rpm: float = None, max_concurrency: int = 16, min_concurrency: int = 1, period: float = 60.0, burst: float = 0.1, max_retries: int = 8, max_backoff: float = 60.0, name: str = ""):
+        self.tokens = TokenBucket(tpm, period, burst) if tpm else None
+        self.requests = TokenBucket(rpm, period, burst) if rpm else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self.name = name
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self.counts = {"requests": 0, "rate_limited": 0, "retries": 0, "waited_s": 0.0, "estimated_tokens": 0, "used_tokens": 0}
+
+    # -------- slots --------
+
+    def _enter(self):
+        """Take a slot: 0.0 if taken, seconds left in a pause, or None to wait for a release."""
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return 0.0
+        return None
+
+    def _reserve(self, tokens: int) -> float:
+        delay = 0.0
+        if self.requests is not None:
+            delay = self.requests.reserve(1)
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.reserve(tokens))
+        return delay
+
+    def _granted(self, started: float, tokens: int) -> float:
+        with self._cond:
+            self.counts["requests"] += 1
+            self.counts["estimated_tokens"] += tokens
+            self.counts["waited_s"] += time.monotonic() - started
+        return time.monotonic()
+
+    def acquire(self, tokens: int) -> float:
+        """Block until the request may be sent. Returns a ticket for ``release``."""
+        started = time.monotonic()
+        with self._cond:
+            while (wait := self._enter()) != 0.0:
+                self._cond.wait(wait)
+        time.sleep(self._reserve(tokens))
+        # A 429 elsewhere while we waited for the bucket pauses us too.
+        time.sleep(max(0.0, self.paused_until - time.monotonic()))
+        return self._granted(started, tokens)
+
+    async def aacquire(self, tokens: int) -> float:
+        started = time.monotonic()
+        while True:
+            with self._cond:
+                wait = self._enter()
+            if wait == 0.0:
+                break
+            await asyncio.sleep(self.poll_interval if wait is None else wait)
+        try:
+            await asyncio.sleep(self._reserve(tokens))
+            await asyncio.sleep(max(0.0, self.paused_until - time.monotonic()))
+        except asyncio.CancelledError:
+            # Cancelled while waiting for the bucket (e.g. a hedge won): free the slot.
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+            raise
+        return self._granted(started, tokens)
+
+    def release(self, ticket: float, error: BaseException = None, attempt: int = 0) -> bool:
+        """Give the slot back. Returns True if ``error`` was a rate limit worth retrying."""
+        delay = retry_after(error) if error is not None else None
+        with self._cond:
+            self.in_flight -= 1
+            if error is None:
+                # Additive increase: about +1 once a full round of requests has succeeded.
+                self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+            elif delay is not None:
+                self.counts["rate_limited"] += 1
+                now = time.monotonic()
+                # Requests sent before the last decrease were sent at the old limit; halve once per round.
+                if ticket > self._last_decrease:
+                    self.limit = max(self.min_concurrency, self.limit / 2)
+                    self._last_decrease = now
+                if not delay:
+                    delay = min(self.max_backoff, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+                self.paused_until = max(self.paused_until, now + delay)
+            self._cond.notify_all()
+        if delay is None:
+            return False
+        for bucket in (self.tokens, self.requests):
+            if bucket is not None:
+                bucket.drain()
+        retry = attempt < self.max_retries
+        if retry:
+            with self._cond:
+                self.counts["retries"] += 1
+        return retry
+
+    def settle(self, estimated: int, used: Optional[int]):
+        """Correct the token bucket with the usage the API reported."""
+        if not used:
+            return
+        with self._cond:
+            self.counts["used_tokens"] += used
+        if self.tokens is not None:
+            self.tokens.adjust(used - estimated)
+
+    # -------- calls --------
+
+    def call(self, fn, tokens: int):
+        """Run ``fn()`` under the limits, retrying it after a 429."""
+        attempt = 0
+        while True:
+            ticket = self.acquire(tokens)
+            try:
+                result = fn()
+            except BaseException as e:
+                if self.release(ticket, e, attempt):
+                    attempt += 1
+                    continue
+                raise
+            self.release(ticket)
+            return result
+
+    async def acall(self, coro_fn, tokens: int):
+        attempt = 0
+        while True:
+            ticket = await self.aacquire(tokens)
+            try:
+                result = await coro_fn()
+            except BaseException as e:
+                if self.release(ticket, e, attempt):
+                    attempt += 1
+                    continue
+                raise
+            self.release(ticket)
+            return result
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = dict(self.counts)
+            stats.update(concurrency=round(self.limit, 1), in_flight=self.in_flight, waited_s=round(stats["waited_s"], 2))
+        return stats
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def limiter_for(model: str, kind: str = "chat") -> Optional[RateLimiter]:
+    """The process-wide limiter for ``model``, or None when no limits are configured.
+
+    Chat models read PEEL_TPM / PEEL_RPM, embedding models PEEL_EMBED_TPM /
+    PEEL_EMBED_RPM; PEEL_MAX_CONCURRENCY caps requests in flight (default 16).
+    """
+    prefix = "PEEL_EMBED_" if kind == "embeddings" else "PEEL_"
+    tpm, rpm = os.environ.get(prefix + "TPM"), os.environ.get(prefix + "RPM")
+    if not tpm and not rpm:
+        return None
+    with _limiters_lock:
+        if (kind, model) not in _limiters:
+            _limiters[(kind, model)] = RateLimiter(
+                tpm=float(tpm) if tpm else None,
+                rpm=float(rpm) if rpm else None,
+                max_concurrency=int(os.environ.get("PEEL_MAX_CONCURRENCY", 16)),
+                name=model,
+            )
+        return _limiters[(kind, model)]
+
+def limiter_stats() -> dict:
+    with _limiters_lock:
+        return {f"{kind}:{model}": limiter.stats() for (kind, model), limiter in _limiters.items()}
+
+
+# =========================
+#  WRAPPED CLIENTS
+# =========================
+
+class RateLimitedChatModel(BaseChatModel):
+    """Chat model whose calls all go through a RateLimiter.
+
+    ``model_name`` and ``temperature`` mirror the wrapped model, so cache keys
+    and traces are the same as without the limiter. A stream is only retried
+    if the 429 comes before its first chunk, which is where the API sends it.
+    """
+
+    llm: BaseChatModel
+    limiter: Any
+    model_name: str = ""
+    temperature: Optional[float] = None
+    expected_output_tokens: int = 600
+
+    @classmethod
+    def wrap(cls, llm: BaseChatModel, limiter: RateLimiter, **kwargs) -> "RateLimitedChatModel":
+        return cls(
+            llm=llm, limiter=limiter,
+            model_name=getattr(llm, "model_name", None) or type(llm).__name__,
+            temperature=getattr(llm, "temperature", None),
+            **kwargs,
+        )
+
+    @property
+    def _llm_type(self) -> str:
+        return "rate-limited"
+
+    def _estimate(self, messages) -> int:
+        text = "".join(str(m.content) for m in messages)
+        output = getattr(self.llm, "max_tokens", None) or self.expected_output_tokens
+        return estimate_tokens(text, self.model_name) + output
+
+    def _settle(self, usage, estimated: int):
+        self.limiter.settle(estimated, (usage or {}).get("total_tokens"))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        estimated = self._estimate(messages)
+        message = self.limiter.call(lambda: self.llm.invoke(messages, stop=stop, **kwargs), estimated)
+        self._settle(message.usage_metadata, estimated)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        estimated = self._estimate(messages)
+        message = await self.limiter.acall(lambda: self.llm.ainvoke(messages, stop=stop, **kwargs), estimated)
+        self._settle(message.usage_metadata, estimated)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        estimated = self._estimate(messages)
+        attempt = 0
+        while True:
+            ticket = self.limiter.acquire(estimated)
+            chunks = iter(self.llm.stream(messages, stop=stop, **kwargs))
+            try:
+                chunk = next(chunks, None)
+            except BaseException as e:
+                if self.limiter.release(ticket, e, attempt):
+                    attempt += 1
+                    continue
+                raise
+            break
+        usage = None
+        try:
+            while chunk is not None:
+                usage = chunk.usage_metadata or usage
+                yield ChatGenerationChunk(message=chunk)
+                chunk = next(chunks, None)
+        except BaseException as e:
+            self.limiter.release(ticket, e)
+            raise
+        self.limiter.release(ticket)
+        self._settle(usage, estimated)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        estimated = self._estimate(messages)
+        attempt = 0
+        while True:
+            ticket = await self.limiter.aacquire(estimated)
+            chunks = aiter(self.llm.astream(messages, stop=stop, **kwargs))
+            try:
+                chunk = await anext(chunks, None)
+            except BaseException as e:
+                if self.limiter.release(ticket, e, attempt):
+                    attempt += 1
+                    continue
+                raise
+            break
+        usage = None
+        try:
+            while chunk is not None:
+                usage = chunk.usage_metadata or usage
+                yield ChatGenerationChunk(message=chunk)
+                chunk = await anext(chunks, None)
+        except BaseException as e:
+            self.limiter.release(ticket, e)
+            raise
+        self.limiter.release(ticket)
+        self._settle(usage, estimated)
+
+
+class RateLimitedEmbeddings(Embeddings):
+    """Embeddings client whose requests go through a RateLimiter.
+
+    Sits under CachedEmbeddings, so only texts missing from the store count
+    against the limits.
+    """
+
+    def __init__(self, underlying: Embeddings, limiter: RateLimiter):
+        self.underlying = underlying
+        self.limiter = limiter
+        self.model = embeddings_model_name(underlying)
+
+    def _estimate(self, texts: list[str]) -> int:
+        name = getattr(self.underlying, "model", None) or "text-embedding-3-large"
+        return sum(estimate_tokens(t, name) for t in texts)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        return self.limiter.call(lambda: self.underlying.embed_documents(texts), self._estimate(texts))
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.limiter.call(lambda: self.underlying.embed_query(text), self._estimate([text]))
@@ -0,0 +1,415 @@
+"""
+Append-only store of every evaluation, for the analytics page.
+
+Each evaluation is one row in <data dir>/results.sqlite. The row holds the
+app, model, temperature, k_examples, the exemplars used, the parsed score,
+token counts, the cost, and the stage timings taken from its trace. Rows
+are only ever inserted.
+
+Each insert also updates hourly and daily rollups in the same transaction,
+one row per period, app and model. The row holds counts, tokens and cost, a
+score histogram, and histograms of total and first-token latency in
+logarithmic buckets 5% wide. The analytics page reads only the rollups:
+hourly ones for the last week, daily ones beyond that. Its p50/p95 latency,
+cost per essay and score histograms therefore cost the same whether the
+table holds a thousand evaluations or ten million. Percentiles come back as
+the midpoint of their bucket, so they are accurate to about 2.5%. Ranges
+read from the daily rollup start at midnight UTC.
+
+Batch runs buffer rows (``flush_every``) and write each chunk in one
+transaction.
+
+    streamlit run peel_analytics.py
+"""
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+# USD per million input / output tokens. Models missing here are recorded
+# with their tokens but no cost.
+PRICES = {
+    "gpt-5": (1.25, 10.00),
+    "gpt-5-mini": (0.25, 2.00),
+    "gpt-5-nano": (0.05, 0.40),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+
+BUCKET_GROWTH = 1.05
+_LOG_GROWTH = math.log(BUCKET_GROWTH)
+# 1.05 ** 300 ms is over half an hour; anything slower shares the last bucket.
+LATENCY_BUCKETS = 301
+LATENCY_METRICS = ("total", "first_token")
+
+COLUMNS = (
+    "ts", "app", "model", "temperature", "k_examples", "exemplar_ids", "score", "input_tokens", "output_tokens",
+    "cost_usd", "total_ms", "retrieval_ms", "prompt_ms", "first_token_ms", "llm_ms", "cache_hit", "student_id",
+    "trace_id",
+)
+
+
+def cost_usd(model: str, input_tokens, output_tokens):
+    price = PRICES.get(model)
+    if price is None or input_tokens is None:
+        return None
+    return (input_tokens * price[0] + (output_tokens or 0) * price[1]) / 1e6
+
+def latency_bucket(ms: float) -> int:
+    return 0 if ms < 1 else min(LATENCY_BUCKETS - 1, int(math.log(ms) / _LOG_GROWTH) + 1)
+
+def bucket_ms(bucket: int) -> float:
+    """Geometric midpoint of a latency bucket."""
+    return 0.5 if bucket == 0 else BUCKET_GROWTH ** (bucket - 0.5)
+
+def percentile(counts, q: float):
+    """``q`` quantile (0-1) in ms of a latency histogram (counts per bucket)."""
+    cumulative = np.cumsum(counts)
+    if not len(cumulative) or not cumulative[-1]:
+        return None
+    return bucket_ms(int(np.searchsorted(cumulative, q * cumulative[-1])))
+
+def _pack(counts: np.ndarray) -> bytes:
+    # Only the span of non-empty buckets, after its offset: a few hundred bytes per row.
+    nonzero = np.flatnonzero(counts)
+    if not len(nonzero):
+        return b""
+    lo, hi = nonzero[0], nonzero[-1] + 1
+    return np.concatenate([[lo], counts[lo:hi]]).astype("<i4").tobytes()
+
+def _unpack_into(total: np.ndarray, blob: bytes):
+    if blob:
+        packed = np.frombuffer(blob, dtype="<i4")
+        total[packed[0]:packed[0] + len(packed) - 1] += packed[1:]
+
+def _span_ms(spans: list, match) -> float:
+    durations = [s["duration_ms"] for s in spans if match(s["name"])]
+    return round(sum(durations), 2) if durations else None
+
+def _first_token_ms(spans: list) -> float:
+    # The execution policy records llm.first_token.<winner> when the winning
+    # attempt streams its first token. A streamed policy result also gets a
+    # plain llm.first_token, but only once the whole answer arrives as one
+    # chunk, so the policy's span takes precedence.
+    policy = _span_ms(spans, lambda n: n.startswith("llm.first_token."))
+    return policy if policy is not None else _span_ms(spans, lambda n: n == "llm.first_token")
+
+def evaluation_record(trace: dict, app: str, model: str, temperature: float, k_examples: int, docs=(), score=None, student_id: str = None) -> dict:
+    """One results row from a finished trace (Trace.to_dict()) and what the evaluation used."""
+    attrs, spans = trace["attrs"], trace["spans"]
+    input_tokens, output_tokens = attrs.get("input_tokens"), attrs.get("output_tokens")
+    cache_hit = bool(attrs.get("cache_hit"))
+    return {
+        "ts": trace["ts"],
+        "app": app,
+        "model": model,
+        "temperature": temperature,
+        "k_examples": k_examples,
+        "exemplar_ids": json.dumps([d.metadata.get("label") for d in docs]),
+        "score": score,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        # A cache hit costs nothing, whatever the original call used.
+        "cost_usd": 0.0 if cache_hit else cost_usd(model, input_tokens, output_tokens),
+        "total_ms": trace["total_ms"],
+        "retrieval_ms": _span_ms(spans, lambda n: n.startswith("retrieval.")),
+        "prompt_ms": _span_ms(spans, lambda n: n == "prompt"),
+        "first_token_ms": _first_token_ms(spans),
+        "llm_ms": _span_ms(spans, lambda n: n in ("llm", "llm.ensemble", "llm.map", "llm.reduce")),
+        "cache_hit": int(cache_hit),
+        "student_id": student_id,
+        "trace_id": trace["trace_id"],
+    }
+
+
+# =========================
+#  STORE
+# =========================
+
+class _Rollup:
+    """Running totals for one rollup row, or for any group of them."""
+
+    def __init__(self):
+        self.n = self.scored = self.cache_hits = self.input_tokens = self.output_tokens = 0
+        self.score_sum = self.cost_usd = 0.0
+        self.scores = np.zeros(16, dtype=np.int64)
+        self.latency = {metric: np.zeros(LATENCY_BUCKETS, dtype=np.int64) for metric in LATENCY_METRICS}
+
+    def add_record(self, r: dict):
+        self.n += 1
+        if r.get("score") is not None:
+            self.scored += 1
+            self.score_sum += r["score"]
+            self.scores[min(15, max(0, int(round(r["score"]))))] += 1
+        self.cache_hits += r.get("cache_hit") or 0
+        self.input_tokens += r.get("input_tokens") or 0
+        self.output_tokens += r.get("output_tokens") or 0
+        self.cost_usd += r.get("cost_usd") or 0.0
+        for metric in LATENCY_METRICS:
+            ms = r.get(f"{metric}_ms")
+            if ms is not None:
+                self.latency[metric][latency_bucket(ms)] += 1
+
+    def add_row(self, row: tuple):
+        """Fold in a stored row: the ROLLUP_COLUMNS after the key."""
+        n, scored, score_sum, cache_hits, input_tokens, output_tokens, cost, scores, *latency = row
+        self.n += n
+        self.scored += scored
+        self.score_sum += score_sum
+        self.cache_hits += cache_hits
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+        self.cost_usd += cost
+        _unpack_into(self.scores, scores)
+        for metric, blob in zip(LATENCY_METRICS, latency):
+            _unpack_into(self.latency[metric], blob)
+
+    def row(self) -> tuple:
+        return (
+            self.n, self.scored, self.score_sum, self.cache_hits, self.input_tokens, self.output_tokens, self.cost_usd,
+            _pack(self.scores), *(_pack(self.latency[m]) for m in LATENCY_METRICS),
+        )
+
+ROLLUP_COLUMNS = (
+    "n", "scored", "score_sum", "cache_hits", "input_tokens", "output_tokens", "cost_usd", "scores",
+    *(f"{m}_ms" for m in LATENCY_METRICS),
+)
+# Rollup table -> seconds per period.
+ROLLUPS = {"rollup_hourly": 3600, "rollup_daily": 86400}
+# Longer ranges are read from the daily rollup.
+HOURLY_RANGE = 7 * 86400
+
+
+class ResultStore:
+    def __init__(self, path: str, flush_every: int = 1):
+        self.path = path
+        self.flush_every = flush_every
+        self._pending = []
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Job workers, batch runs and the apps may all write at once.
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS evaluations (
+                id INTEGER PRIMARY KEY,
+                ts REAL NOT NULL,
+                app TEXT,
+                model TEXT NOT NULL,
+                temperature REAL,
+                k_examples INTEGER,
+                exemplar_ids TEXT,
+                score REAL,
+                input_tokens INTEGER,
+                output_tokens INTEGER,
+                cost_usd REAL,
+                total_ms REAL,
+                retrieval_ms REAL,
+                prompt_ms REAL,
+                first_token_ms REAL,
+                llm_ms REAL,
+                cache_hit INTEGER,
+                student_id TEXT,
+                trace_id TEXT
+            );
+            """
+        )
+        for table in ROLLUPS:
+            self._conn.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    period INTEGER NOT NULL,
+                    app TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    n INTEGER NOT NULL,
+                    scored INTEGER NOT NULL,
+                    score_sum REAL NOT NULL,
+                    cache_hits INTEGER NOT NULL,
+                    input_tokens INTEGER NOT NULL,
+                    output_tokens INTEGER NOT NULL,
+                    cost_usd REAL NOT NULL,
+                    scores BLOB NOT NULL,
+                    total_ms BLOB NOT NULL,
+                    first_token_ms BLOB NOT NULL,
+                    PRIMARY KEY (period, app, model)
+                )
+                """
+            )
+
+    # -------- writes --------
+
+    def add(self, record: dict):
+        """Queue one evaluation_record(); written once ``flush_every`` rows are queued."""
+        with self._lock:
+            self._pending.append(record)
+            if len(self._pending) < self.flush_every:
+                return
+            records, self._pending = self._pending, []
+        self.record_many(records)
+
+    def flush(self):
+        with self._lock:
+            records, self._pending = self._pending, []
+        if records:
+            self.record_many(records)
+
+    def record_many(self, records: list, insert: bool = True):
+        """Insert ``records`` (unless ``insert`` is False) and fold them into the rollup, in one transaction."""
+        groups = {}
+        for r in records:
+            for table, seconds in ROLLUPS.items():
+                key = (table, int(r["ts"] // seconds), r.get("app") or "", r["model"])
+                groups.setdefault(key, _Rollup()).add_record(r)
+
+        with self._lock:
+            # Take the write lock up front: the rollup is read, merged and written back.
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if insert:
+                    self._conn.executemany(
+                        f"INSERT INTO evaluations ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                        [tuple(r.get(c) for c in COLUMNS) for r in records],
+                    )
+                for (table, *key), group in groups.items():
+                    stored = self._conn.execute(
+                        f"SELECT {', '.join(ROLLUP_COLUMNS)} FROM {table} WHERE period = ? AND app = ? AND model = ?", key,
+                    ).fetchone()
+                    if stored is not None:
+                        group.add_row(stored)
+                    self._conn.execute(
+                        f"INSERT OR REPLACE INTO {table} VALUES ({', '.join('?' * (3 + len(ROLLUP_COLUMNS)))})",
+                        (*key, *group.row()),
+                    )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def rebuild_rollups(self):
+        """Recompute the rollups from the evaluations table (e.g. after copying rows in by hand)."""
+        with self._lock:
+            for table in ROLLUPS:
+                self._conn.execute(f"DELETE FROM {table}")
+        last = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT id, {', '.join(COLUMNS)} FROM evaluations WHERE id > ? ORDER BY id LIMIT 50000", (last,)
+                ).fetchall()
+            if not rows:
+                return
+            last = rows[-1][0]
+            self.record_many([dict(zip(COLUMNS, row[1:])) for row in rows], insert=False)
+
+    # -------- queries --------
+
+    def _rollups(self, group_by, since: float = None, until: float = None, models=None, apps=None, hourly: bool = None) -> dict:
+        """Rollup rows in range, merged into a _Rollup per ``group_by(period start, app, model)``."""
+        if hourly is None:
+            hourly = since is not None and (until or time.time()) - since <= HOURLY_RANGE
+        table = "rollup_hourly" if hourly else "rollup_daily"
+        seconds = ROLLUPS[table]
+        clauses, params = [], []
+        if since is not None:
+            clauses.append("period >= ?")
+            params.append(int(since // seconds))
+        if until is not None:
+            clauses.append("period <= ?")
+            params.append(int(until // seconds))
+        for column, values in (("model", models), ("app", apps)):
+            if values:
+                clauses.append(f"{column} IN ({','.join('?' * len(values))})")
+                params.extend(values)
+        where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+        with self._lock:
+            rows = self._conn.execute(f"SELECT period, app, model, {', '.join(ROLLUP_COLUMNS)} FROM {table}{where}", params).fetchall()
+        groups = {}
+        for row in rows:
+            key = group_by(row[0] * seconds, row[1], row[2])
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = _Rollup()
+            group.add_row(row[3:])
+        return groups
+
+    def summary(self, since: float = None, until: float = None, models=None, apps=None) -> list[dict]:
+        """Per-model figures for the analytics page, busiest model first.
+
+        Evaluations, mean score, cost and tokens per essay, cache hit rate and
+        p50/p95 latency, plus the ``scores`` (0-15) and ``latency`` histograms.
+        """
+        groups = self._rollups(lambda start, app, model: model, since, until, models, apps)
+        out = []
+        for model, g in sorted(groups.items(), key=lambda item: -item[1].n):
+            row = {
+                "model": model,
+                "evaluations": g.n,
+                "mean_score": round(g.score_sum / g.scored, 2) if g.scored else None,
+                "cost_per_essay_usd": g.cost_usd / g.n,
+                "input_tokens_per_essay": round(g.input_tokens / g.n),
+                "output_tokens_per_essay": round(g.output_tokens / g.n),
+                "cache_hit_rate": round(g.cache_hits / g.n, 3),
+                "total_cost_usd": g.cost_usd,
+                "scores": g.scores.tolist(),
+                "latency": g.latency,
+            }
+            for metric in LATENCY_METRICS:
+                for q in (50, 95):
+                    value = percentile(g.latency[metric], q / 100)
+                    row[f"{metric}_p{q}_ms"] = round(value) if value is not None else None
+            out.append(row)
+        return out
+
+    def timeline(self, since: float = None, until: float = None, models=None, apps=None, hours: int = 24) -> list[dict]:
+        """Evaluations, cost and p50/p95 total latency per model for each ``hours``-long period."""
+        length = hours * 3600
+        hourly = None if length % 86400 == 0 else True
+        groups = self._rollups(lambda start, app, model: (start // length, model), since, until, models, apps, hourly)
+        return [
+            {
+                "period_start": period * length,
+                "model": model,
+                "evaluations": g.n,
+                "cost_usd": g.cost_usd,
+                "p50_ms": percentile(g.latency["total"], 0.5),
+                "p95_ms": percentile(g.latency["total"], 0.95),
+            }
+            for (period, model), g in sorted(groups.items())
+        ]
+
+    def options(self) -> dict:
+        """Models and apps seen so far, and the first and last hour with data."""
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT model, app FROM rollup_daily").fetchall()
+            first, last = self._conn.execute("SELECT MIN(period), MAX(period) FROM rollup_hourly").fetchone()
+        return {
+            "models": sorted({m for m, _ in rows}),
+            "apps": sorted({a for _, a in rows}),
+            "first": first * 3600 if first is not None else None,
+            "last": (last + 1) * 3600 if last is not None else None,
+        }
+
+    def recent(self, limit: int = 50) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {', '.join(COLUMNS)} FROM evaluations ORDER BY id DESC LIMIT ?", [limit]).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def count(self) -> int:
+        # The daily rollup is tiny; COUNT(*) on millions of evaluations is not.
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(n), 0) FROM rollup_daily").fetchone()[0]
+
+
+def record_trace(store, trace: dict, **fields):
+    """Add one evaluation to ``store`` (a ResultStore or None); ``trace`` is a finished Trace.to_dict()."""
+    if store is not None and trace is not None:
+        store.add(evaluation_record(trace, **fields))
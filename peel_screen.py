@@ -0,0 +1,245 @@
+"""
+Local pre-screening of essays before any model call.
+
+analyse() measures an answer in plain Python, without a model or the network:
+- paragraph, word and sentence counts
+- quotations
+- the share of the answer copied from the question
+- the share repeated within the answer (an essay pasted twice scores ~0.5)
+
+It handles a few thousand essays per second on one core.
+
+A Screener applies rules to those facts, in order. The first ``reject`` or
+``score`` rule that matches decides:
+
+    reject    the essay is not graded; EssayRejected carries the reason
+    score     a fixed low-band result is returned and the LLM is not called
+    annotate  the facts go into the prompt after the answer (every matching
+              annotate rule adds its message)
+
+Rules are plain dicts, so they can be kept in a JSON file (PEEL_SCREEN_RULES).
+Conditions are ``<fact>_<op>: value`` with op one of lt, le, gt, ge, eq, ne,
+and all conditions of a rule must hold. Messages may use the facts, e.g.
+``"{words} words"``.
+"""
+import json
+import os
+import re
+import threading
+from functools import lru_cache
+
+EXPECTED_PARAGRAPHS = 5  # introduction + three body paragraphs + conclusion (see PEEL_RUBRIC)
+
+DEFAULT_RULES = [
+    {"name": "empty", "when": {"words_lt": 1}, "action": "reject", "message": "No answer was submitted."},
+    {
+        "name": "copied_question", "when": {"question_overlap_ge": 0.8}, "action": "score", "score": 0,
+        "message": "The answer repeats the question instead of responding to it.",
+    },
+    {
+        "name": "pasted_twice", "when": {"repeated_share_ge": 0.4}, "action": "reject",
+        "message": "The essay appears to be pasted more than once; submit a single copy.",
+    },
+    {
+        "name": "too_short", "when": {"words_lt": 50}, "action": "score", "score": 1,
+        "message": "At {words} words, the answer is too short to show an introduction, developed PEEL paragraphs and a conclusion.",
+    },
+    {
+        "name": "structure", "when": {"paragraphs_ne": EXPECTED_PARAGRAPHS}, "action": "annotate",
+        "message": "The answer has {paragraphs} paragraph(s); the task expects an introduction, three body paragraphs and a conclusion.",
+    },
+    {
+        "name": "no_quotations", "when": {"quotations_eq": 0}, "action": "annotate",
+        "message": "No quotations from the text were detected.",
+    },
+]
+
+SCREEN_FEEDBACK = """**Score: {score}/15**
+
+{message}
+
+This answer was marked without a full evaluation: {summary}.
+
+EBI: open with an introduction that names the text and author and gives a thesis; develop three body paragraphs that each make a point, quote evidence and explain it; finish with a conclusion that restates the thesis.
+
+Submit a complete answer to receive detailed feedback."""
+
+SCREEN_NOTE = """
+STRUCTURE CHECK (measured automatically, for reference when marking):
+{lines}
+"""
+
+WORD = re.compile(r"\w+(?:['’]\w+)*")
+SENTENCE_END = re.compile(r"[.!?]+(?:\s|$)")
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+# The lookahead lets the scan skip quickly past text without an opening quote.
+QUOTATION = re.compile(r'(?=["“‘\'])(?:"[^"\n]{2,}?"|“[^”\n]{2,}?”|‘[^’\n]{2,}?’|(?<!\w)\'[^\'\n]{2,}?\'(?!\w))')
+SHINGLE = 8  # words per shingle when looking for repeated passages
+
+OPS = {
+    "lt": lambda a, b: a < b,
+    "le": lambda a, b: a <= b,
+    "gt": lambda a, b: a > b,
+    "ge": lambda a, b: a >= b,
+    "eq": lambda a, b: a == b,
+    "ne": lambda a, b: a != b,
+}
+
+
+class EssayRejected(ValueError):
+    def __init__(self, verdict: "Verdict"):
+        super().__init__(f"{verdict.rule}: {verdict.message}")
+        self.verdict = verdict
+
+
+# =========================
+#  ANALYSIS
+# =========================
+
+@lru_cache(maxsize=1024)
+def _question_ngrams(question: str) -> tuple[frozenset, frozenset]:
+    words = WORD.findall(question.lower())
+    return frozenset(words), frozenset(zip(words, words[1:], words[2:]))
+
+def _paragraphs(text: str) -> int:
+    blocks = [b for b in PARAGRAPH_BREAK.split(text) if b.strip()]
+    if len(blocks) == 1:
+        # Pasted text often separates paragraphs with single line breaks.
+        return sum(1 for line in text.splitlines() if line.strip())
+    return len(blocks)
+
+def analyse(question: str, answer: str) -> dict:
+    """Structural facts about ``answer``; cheap enough to run on every submission."""
+    text = answer.strip()
+    words = WORD.findall(text.lower())
+    quotes = QUOTATION.findall(text)
+
+    overlap = 0.0
+    q_words, q_trigrams = _question_ngrams(question or "")
+    if len(words) >= 3 and q_trigrams:
+        trigrams = list(zip(words, words[1:], words[2:]))
+        overlap = sum(map(q_trigrams.__contains__, trigrams)) / len(trigrams)
+    elif words and q_words:
+        overlap = sum(map(q_words.__contains__, words)) / len(words)
+
+    repeated = 0.0
+    if len(words) >= 2 * SHINGLE:
+        shingles = list(zip(*(words[i:] for i in range(SHINGLE))))
+        repeated = 1.0 - len(set(shingles)) / len(shingles)
+
+    return {
+        "words": len(words),
+        "characters": len(text),
+        "paragraphs": _paragraphs(text) if text else 0,
+        "sentences": len(SENTENCE_END.findall(text)),
+        "quotations": len(quotes),
+        "quoted_words": sum(len(WORD.findall(q)) for q in quotes),
+        "question_overlap": round(overlap, 3),
+        "repeated_share": round(repeated, 3),
+    }
+
+
+# =========================
+#  RULES
+# =========================
+
+class Verdict:
+    """What screening decided for one essay: ``action`` is pass, annotate, score or reject."""
+
+    def __init__(self, facts: dict, action: str = "pass", rule: str = None, message: str = "", score: int = None, notes: list = ()):
+        self.facts = facts
+        self.action = action
+        self.rule = rule
+        self.message = message
+        self.score = score
+        self.notes = list(notes)
+
+    @property
+    def feedback(self):
+        """Feedback for a ``score`` verdict, in the same shape as the model's."""
+        if self.action != "score":
+            return None
+        f = self.facts
+        summary = f"{f['words']} words in {f['paragraphs']} paragraph(s), {f['quotations']} quotation(s)"
+        return SCREEN_FEEDBACK.format(score=self.score, message=self.message, summary=summary)
+
+    @property
+    def note(self) -> str:
+        """Text to append to the prompt; empty unless an annotate rule matched."""
+        if not self.notes:
+            return ""
+        f = self.facts
+        lines = [
+            f"- {f['paragraphs']} paragraph(s), {f['words']} words, {f['sentences']} sentence(s)",
+            f"- {f['quotations']} quotation(s) ({f['quoted_words']} quoted words)",
+            *(f"- {n}" for n in self.notes),
+        ]
+        return SCREEN_NOTE.format(lines="\n".join(lines))
+
+    def summary(self) -> dict:
+        return {"action": self.action, "rule": self.rule, "facts": self.facts}
+
+
+class _Rule:
+    def __init__(self, spec: dict):
+        self.name = spec["name"]
+        self.action = spec["action"]
+        if self.action not in ("reject", "score", "annotate"):
+            raise ValueError(f"Rule {self.name!r}: unknown action {self.action!r}")
+        self.message = spec.get("message", "")
+        self.score = spec.get("score", 0)
+        self.conditions = []
+        for key, value in spec.get("when", {}).items():
+            fact, _, op = key.rpartition("_")
+            if op not in OPS:
+                raise ValueError(f"Rule {self.name!r}: condition {key!r} must end in one of {', '.join(OPS)}")
+            self.conditions.append((fact, OPS[op], value))
+
+    def matches(self, facts: dict) -> bool:
+        return all(op(facts[fact], value) for fact, op, value in self.conditions)
+
+
+class Screener:
+    def __init__(self, rules: list[dict] = None):
+        self.rules = [_Rule(r) for r in (DEFAULT_RULES if rules is None else rules)]
+        self.counts = {"pass": 0, "annotate": 0, "score": 0, "reject": 0}
+        self._lock = threading.Lock()  # check() runs on batch and job worker threads
+        known = set(analyse("", ""))
+        for rule in self.rules:
+            for fact, _, _ in rule.conditions:
+                if fact not in known:
+                    raise ValueError(f"Rule {rule.name!r}: unknown fact {fact!r}")
+
+    @classmethod
+    def from_file(cls, path: str) -> "Screener":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def check(self, question: str, answer: str) -> Verdict:
+        facts = analyse(question, answer)
+        notes = []
+        verdict = None
+        for rule in self.rules:
+            if not rule.matches(facts):
+                continue
+            message = rule.message.format(**facts)
+            if rule.action == "annotate":
+                notes.append(message)
+                continue
+            verdict = Verdict(facts, rule.action, rule.name, message, rule.score)
+            break
+        if verdict is None:
+            verdict = Verdict(facts, "annotate" if notes else "pass", notes=notes)
+        with self._lock:
+            self.counts[verdict.action] += 1
+        return verdict
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counts)
+
+
+def load_screener() -> Screener:
+    """Screener with the rules in PEEL_SCREEN_RULES (a JSON list), or the defaults."""
+    path = os.environ.get("PEEL_SCREEN_RULES")
+    return Screener.from_file(path) if path else Screener()
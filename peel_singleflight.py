@@ -0,0 +1,160 @@
+"""
+Process-wide single-flight for LLM evaluations.
+
+When several callers (Streamlit sessions, batch workers) ask for the same
+evaluation at the same time, only the first one, the leader, calls the model.
+The others wait on its in-flight call and receive the same feedback. Calls are
+keyed like the evaluation cache, by model, temperature and prompt hash, so the
+two layers agree on what counts as "the same request": the cache dedupes
+across time, single-flight dedupes requests that are in flight together.
+
+A leader that fails passes its error to everyone waiting on it. A leader whose
+stream is abandoned half way (e.g. the user reran the Streamlit script) does
+not: its waiters retry, and one of them becomes the new leader. Neither does
+a leader whose result the caller marks as not to be shared (``share``), e.g.
+feedback that came from a fallback model rather than the one in the key.
+"""
+import asyncio
+import threading
+from concurrent.futures import Future
+
+from peel_cache import evaluation_key
+from peel_core import chunk_text
+from peel_trace import NULL_TRACE
+
+
+class _Abandoned(Exception):
+    pass
+
+class _Unshared(_Abandoned):
+    pass
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: dict[str, Future] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.abandoned = 0
+        self.unshared = 0
+
+    @staticmethod
+    def key(model: str, temperature: float, prompt_text: str) -> str:
+        return evaluation_key(model, temperature, prompt_text)
+
+    def _join(self, key: str) -> tuple[bool, Future]:
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return False, flight
+            flight = self._flights[key] = Future()
+            self.leaders += 1
+            return True, flight
+
+    def _finish(self, key: str, flight: Future, result=None, error: BaseException = None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            if isinstance(error, _Unshared):
+                self.unshared += 1
+            elif isinstance(error, _Abandoned):
+                self.abandoned += 1
+        if error is not None:
+            flight.set_exception(error)
+        else:
+            flight.set_result(result)
+
+    # -------- blocking --------
+
+    def _settle(self, key: str, flight: Future, result, share):
+        if share is not None and not share(result):
+            self._finish(key, flight, error=_Unshared())
+        else:
+            self._finish(key, flight, result)
+
+    def do(self, key: str, fn, share=None) -> tuple[str, bool]:
+        """Run ``fn()`` unless an identical call is in flight; returns (result, coalesced).
+
+        ``share(result)``, if given, decides whether waiters get the leader's
+        result; if not, they retry on their own.
+        """
+        while True:
+            leader, flight = self._join(key)
+            if leader:
+                try:
+                    result = fn()
+                except BaseException as exc:
+                    self._finish(key, flight, error=exc)
+                    raise
+                self._settle(key, flight, result, share)
+                return result, False
+            try:
+                return flight.result(), True
+            except _Abandoned:
+                continue
+
+    def stream(self, key: str, chunks, trace=NULL_TRACE, share=None):
+        """Yield ``chunks`` as the leader, or the leader's full text as a single chunk.
+
+        The returned generator joins the flight on first iteration, not when
+        it is created.
+        """
+        while True:
+            leader, flight = self._join(key)
+            trace.set(coalesced=not leader)
+            if not leader:
+                try:
+                    yield flight.result()
+                    return
+                except _Abandoned:
+                    continue
+
+            parts = []
+            try:
+                for chunk in chunks:
+                    parts.append(chunk if isinstance(chunk, str) else chunk_text(chunk))
+                    yield chunk
+            except GeneratorExit:
+                self._finish(key, flight, error=_Abandoned())
+                raise
+            except BaseException as exc:
+                self._finish(key, flight, error=exc)
+                raise
+            self._settle(key, flight, "".join(parts), share)
+            return
+
+    # -------- asyncio --------
+
+    async def ado(self, key: str, coro_fn, share=None) -> tuple[str, bool]:
+        """Async ``do``: ``coro_fn()`` is awaited by the leader only."""
+        while True:
+            leader, flight = self._join(key)
+            if leader:
+                try:
+                    result = await coro_fn()
+                except asyncio.CancelledError:
+                    self._finish(key, flight, error=_Abandoned())
+                    raise
+                except BaseException as exc:
+                    self._finish(key, flight, error=exc)
+                    raise
+                self._settle(key, flight, result, share)
+                return result, False
+            try:
+                # Shielded so one waiter being cancelled does not cancel the shared flight.
+                return await asyncio.shield(asyncio.wrap_future(flight)), True
+            except _Abandoned:
+                continue
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_flight = len(self._flights)
+        return {
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "abandoned": self.abandoned,
+            "unshared": self.unshared,
+            "in_flight": in_flight,
+        }
@@ -0,0 +1,156 @@
+"""
+Lightweight per-request tracing.
+
+A Trace collects named spans (retrieval, prompt build, LLM first token and
+total time) plus attributes such as token usage, and is written to a sink
+when finished. When tracing is off, Tracer.start() hands back a shared no-op
+trace, so instrumented code pays one attribute lookup per span.
+
+    tracer = Tracer(JsonlTraceSink(data_path("traces.jsonl")))
+    trace = tracer.start("evaluate", model="gpt-5")
+    with trace.span("retrieval"):
+        ...
+    trace.finish()
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+
+
+class Trace:
+    enabled = True
+
+    def __init__(self, name: str, sink=None, **attrs):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.sink = sink
+        self.attrs = attrs
+        self.spans = []
+        self.ts = time.time()
+        self._t0 = time.perf_counter()
+
+    @contextmanager
+    def span(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter())
+
+    def record(self, name: str, start: float, end: float):
+        """Add a span from two time.perf_counter() readings."""
+        self.spans.append({
+            "name": name,
+            "start_ms": round((start - self._t0) * 1000, 2),
+            "duration_ms": round((end - start) * 1000, 2),
+        })
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "ts": self.ts,
+            "total_ms": round((time.perf_counter() - self._t0) * 1000, 2),
+            "attrs": self.attrs,
+            "spans": self.spans,
+        }
+
+    def finish(self) -> dict:
+        record = self.to_dict()
+        if self.sink is not None:
+            self.sink.write(record)
+        return record
+
+
+class _NullTrace:
+    enabled = False
+    _span = nullcontext()
+
+    def span(self, name):
+        return self._span
+
+    def record(self, name, start, end):
+        pass
+
+    def set(self, **attrs):
+        pass
+
+    def finish(self):
+        return None
+
+NULL_TRACE = _NullTrace()
+
+
+class Tracer:
+    def __init__(self, sink=None, enabled: bool = None):
+        self.sink = sink
+        if enabled is None:
+            enabled = os.environ.get("PEEL_TRACE", "0") not in ("", "0", "false")
+        self.enabled = enabled
+
+    def start(self, name: str, **attrs):
+        if not self.enabled:
+            return NULL_TRACE
+        return Trace(name, self.sink, **attrs)
+
+
+# =========================
+#  SINKS
+# =========================
+
+class JsonlTraceSink:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+class SqliteTraceSink:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS spans (
+                trace_id TEXT NOT NULL,
+                trace_name TEXT NOT NULL,
+                ts REAL NOT NULL,
+                span TEXT NOT NULL,
+                start_ms REAL NOT NULL,
+                duration_ms REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS traces (trace_id TEXT PRIMARY KEY, name TEXT, ts REAL, total_ms REAL, attrs TEXT)"
+        )
+        self._conn.commit()
+
+    def write(self, record: dict):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO traces VALUES (?, ?, ?, ?, ?)",
+                (record["trace_id"], record["name"], record["ts"], record["total_ms"], json.dumps(record["attrs"])),
+            )
+            self._conn.executemany(
+                "INSERT INTO spans VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (record["trace_id"], record["name"], record["ts"], s["name"], s["start_ms"], s["duration_ms"])
+                    for s in record["spans"]
+                ],
+            )
+            self._conn.commit()
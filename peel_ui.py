@@ -0,0 +1,118 @@
+"""
+Streamlit widgets shared by the PEEL apps.
+"""
+import os
+
+import streamlit as st
+
+
+def load_api_key():
+    """Find OPENAI_API_KEY in the environment, a local .env file or Streamlit secrets.
+
+    Returns None instead of raising, so the apps can render and show a warning.
+    """
+    from dotenv import load_dotenv, find_dotenv
+
+    load_dotenv(find_dotenv())  # read local .env file
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        # On Streamlit Cloud, secrets are also exposed as env vars, but in case:
+        try:
+            api_key = st.secrets["OPENAI_API_KEY"]
+            os.environ["OPENAI_API_KEY"] = api_key
+        except Exception:
+            pass
+    return api_key
+
+
+
+def render_stream(stream) -> str:
+    """Render an EvaluationStream progressively and return the final feedback.
+
+    The score is shown as a metric as soon as the "Score: X/15" line has been
+    streamed, ahead of the rest of the feedback.
+    """
+    score_slot = st.empty()
+    feedback_slot = st.empty()
+    feedback_slot.caption("Waiting for the model...")
+    score_shown = False
+    for _ in stream:
+        if stream.score is not None and not score_shown:
+            score_slot.metric("Score", f"{stream.score:g}/15")
+            score_shown = True
+        feedback_slot.markdown(stream.text + " ▌")
+    feedback_slot.markdown(stream.text)
+    return stream.text
+
+def render_ensemble(summary: dict, feedback: str) -> str:
+    """Show the median score, its spread and the representative feedback.
+
+    ``summary`` is EnsembleResult.summary().
+    """
+    if summary["score"] is not None:
+        st.metric(
+            f"Score (median of {len(summary['scores'])})",
+            f"{summary['score']:g}/15",
+            help="Spread is the gap between the highest and lowest sampled score.",
+        )
+        st.caption(
+            f"Spread {summary['spread']:g} · samples: " + ", ".join(f"{s:g}" for s in summary["scores"])
+            + f" · feedback from {summary['feedback_model']}"
+        )
+    st.markdown(feedback)
+    return feedback
+
+def render_paragraphs(summary: dict, feedback: str) -> str:
+    """Show the score, the feedback and the paragraph marks it was built from.
+
+    ``summary`` is peel_mapreduce.MapReduceResult.summary().
+    """
+    if summary["score"] is not None:
+        st.metric("Score", f"{summary['score']:g}/15")
+    st.markdown(feedback)
+    if summary["paragraphs"]:
+        with st.expander("Paragraph by paragraph"):
+            st.table([
+                {
+                    "paragraph": p["position"],
+                    "words": p["words"],
+                    "marks": "–" if p["marks"] is None else f"{p['marks']:g}/10",
+                    "writing": "–" if p["writing"] is None else f"{p['writing']:g}/5",
+                    "comment": p["comment"],
+                    "improve": p["improve"],
+                }
+                for p in summary["paragraphs"]
+            ])
+    return feedback
+
+def render_stream_timings(stream):
+    parts = [f"First token {stream.first_token_s or 0:.1f}s"]
+    if stream.score_s is not None:
+        parts.append(f"score at {stream.score_s:.1f}s")
+    parts.append(f"complete in {stream.total_s:.1f}s")
+    st.caption(" · ".join(parts))
+
+def render_trace(trace: dict):
+    """Per-stage timing breakdown for one finished trace."""
+    st.subheader("Last request")
+    st.caption(f"Total {trace['total_ms'] / 1000:.2f}s")
+    st.table(
+        [{"stage": s["name"], "start (ms)": s["start_ms"], "duration (ms)": s["duration_ms"]} for s in trace["spans"]]
+    )
+    attrs = trace["attrs"]
+    if "input_tokens" in attrs:
+        st.caption(f"Tokens: {attrs['input_tokens']} in · {attrs.get('output_tokens', 0)} out")
+    if attrs.get("cache_hit"):
+        st.caption("Served from the evaluation cache.")
+
+def render_connection_stats():
+    """Shared HTTP pool and client cache usage (peel_clients), once a request has been sent."""
+    from peel_clients import client_stats
+
+    stats = client_stats()
+    if not stats.get("requests"):
+        return
+    st.caption(
+        f"Connections: {stats['connections']} opened for {stats['requests']} requests · {stats['open']} open "
+        f"· {stats['client_cached']} clients cached"
+    )